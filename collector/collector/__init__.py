@@ -31,7 +31,7 @@ app.config.from_object(config.Config)
 from .model import *
 from . import report_handler
 
-handler = RotatingFileHandler(app.config['LOG_FILE'], maxBytes=10000, backupCount=1)
+handler = RotatingFileHandler(app.config['LOG_FILE'], maxBytes=app.config.get('LOG_MAX_BYTES', 10000), backupCount=1)
 handler.setLevel(app.config['LOG_LEVEL'])
 app.logger.addHandler(handler)
 
@@ -0,0 +1,97 @@
+# Copyright (C) 2015-2020 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import gzip
+import json
+import time
+from decimal import Decimal
+from urllib.parse import quote
+from . import app
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EXTENSIONS = {
+    'gzip': '.ndjson.gz',
+    'zstd': '.ndjson.zst',
+}
+
+
+def to_json(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError("{} is not JSON serializable".format(type(value).__name__))
+
+
+def append(filename, data):
+    """ Appends data to filename and returns its offset in the file once it
+        is on disk """
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o640)
+    try:
+        offset = os.lseek(fd, 0, os.SEEK_END)
+        os.write(fd, data)
+        os.fsync(fd)
+        return offset
+    finally:
+        os.close(fd)
+
+
+class RecordArchive(object):
+    """ Keeps the purged records in compressed NDJSON files, one directory
+        per day of reception and classification:
+
+            <path>/day=2020-06-15/classification=org.clearlinux%2Fhello%2Fworld/<name>.ndjson.zst
+
+        Each write appends a zstd frame, or a gzip member, to the files of
+        its records, so a file stays readable with zstdcat or zcat whatever
+        happens to the purge. Once the files are on disk a line per frame
+        is added to <path>/manifest.ndjson, then the records are deleted.
+    """
+
+    def __init__(self, path, compression):
+        if compression == 'zstd' and zstandard is None:
+            app.logger.error("zstandard is not installed, archiving with gzip")
+            compression = 'gzip'
+        if compression not in EXTENSIONS:
+            raise ValueError("Unknown archive compression {}".format(compression))
+        self.path = path
+        self.compression = compression
+        # Every purge writes its own files
+        self.name = "records-{}-{}".format(time.strftime("%Y%m%dT%H%M%SZ", time.gmtime()), os.getpid())
+
+    def compress(self, data):
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor().compress(data)
+        return gzip.compress(data)
+
+    def write(self, rows):
+        groups = {}
+        for row in rows:
+            day = time.strftime("%Y-%m-%d", time.gmtime(float(row['timestamp_server'])))
+            groups.setdefault((day, row['classification']), []).append(row)
+        entries = []
+        for (day, classification), group in sorted(groups.items()):
+            directory = os.path.join("day=" + day, "classification=" + quote(classification, safe=''))
+            os.makedirs(os.path.join(self.path, directory), exist_ok=True)
+            filename = os.path.join(directory, self.name + EXTENSIONS[self.compression])
+            data = self.compress(''.join([json.dumps(r, default=to_json) + '\n' for r in group]).encode('utf-8'))
+            offset = append(os.path.join(self.path, filename), data)
+            entries.append({
+                'file': filename,
+                'offset': offset,
+                'length': len(data),
+                'day': day,
+                'classification': classification,
+                'records': len(group),
+                'first_id': min([r['id'] for r in group]),
+                'last_id': max([r['id'] for r in group]),
+                'archived': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            })
+        manifest = ''.join([json.dumps(e) + '\n' for e in entries]).encode('utf-8')
+        append(os.path.join(self.path, "manifest.ndjson"), manifest)
+
+
+# vi: ts=4 et sw=4 sts=4
@@ -0,0 +1,289 @@
+# Copyright (C) 2015-2020 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+""" Asyncio entrypoint of the collector, an ASGI application serving the
+    same /v2/collector contract as the Flask application. Records are
+    validated with the same rules and written through a pool of asyncpg
+    connections, so a worker holds thousands of concurrent uploads without
+    a thread for each of them:
+
+        uvicorn collector.asgi:application --uds /var/www/collector/socket/collector.sock
+
+    Write-behind, the spool and the access log are only available in the
+    uWSGI application.
+"""
+
+import io
+import json
+import time
+import asyncio
+from decimal import Decimal
+import asyncpg
+from sqlalchemy import (
+    Boolean,
+    Integer,
+    LargeBinary,
+    Numeric)
+from werkzeug.datastructures import Headers
+from . import app
+from .model import (
+    EVENT_INSERT,
+    PAYLOAD_INSERT,
+    Payload,
+    Record)
+from .lib.validation import InvalidUsage
+from .lib.body import read_body
+from .lib.admission import AdmissionControl
+from .lib.ratelimit import get_retry_after
+from .metrics import get_metrics
+from .monitoring import (
+    count_records,
+    report_admission,
+    timed_write)
+from .report_handler import (
+    MAX_PAYLOAD_LEN,
+    rate_limiter,
+    get_rate_limit_state,
+    decode_payload,
+    get_record_from_headers,
+    get_response_mode,
+    is_recent_event,
+    add_recent_events)
+
+COLLECTOR_PATHS = ('/', '/v2/collector')
+
+admission = AdmissionControl(app.config.get("ASGI_MAX_INFLIGHT", 2000),
+                             app.config.get("ADMISSION_MAX_COMMIT_LATENCY", 1.0),
+                             app.config.get("ADMISSION_LATENCY_HALF_LIFE", 5),
+                             app.config.get("ADMISSION_RETRY_AFTER", 5),
+                             app.config.get("ADMISSION_RETRY_JITTER", 10))
+
+
+def get_converter(column):
+    # asyncpg does not coerce arguments, validated header values are strings
+    if isinstance(column.type, Integer):
+        return int
+    if isinstance(column.type, Numeric):
+        return lambda value: Decimal(str(value))
+    if isinstance(column.type, Boolean):
+        return bool
+    if isinstance(column.type, LargeBinary):
+        return bytes
+    return str
+
+
+class RecordWriter(object):
+    """ Inserts records one at a time, events already stored are skipped
+        the same way Record.create_many does """
+
+    def __init__(self, table):
+        self.table = table
+        self.converters = {c.name: get_converter(c) for c in table.columns}
+        self.statements = {}
+        self.pool = None
+
+    async def open(self, dsn, min_size, max_size):
+        self.pool = await asyncpg.create_pool(dsn, min_size=min_size, max_size=max_size)
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    def get_statement(self, names):
+        stmt = self.statements.get(names)
+        if stmt is None:
+            stmt = "INSERT INTO {} ({}) VALUES ({}) RETURNING id".format(
+                self.table.name, ', '.join(names), ', '.join(['${}'.format(i + 1) for i in range(len(names))]))
+            self.statements[names] = stmt
+        return stmt
+
+    async def write(self, record):
+        """ Returns the id of the new row, or None if the event is stored """
+        # Dimension values missing from the cache are looked up with the
+        # blocking engine, keep it off the event loop
+        loop = asyncio.get_event_loop()
+        row = await loop.run_in_executor(None, Record.get_row_values, record)
+        row['processed'] = False
+        names = tuple(sorted(row))
+        values = [row[n] if row[n] is None else self.converters[n](row[n]) for n in names]
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                if Record.has_event_id(row):
+                    event_id = await conn.fetchval(EVENT_INSERT, row['event_id'], row['timestamp_server'])
+                    if event_id is None:
+                        return None
+                for payload in Payload.get_rows([record], [row]):
+                    await conn.execute(PAYLOAD_INSERT.format('($1, $2)'), payload['hash'], payload['payload'])
+                return await conn.fetchval(self.get_statement(names), *values)
+
+
+record_writer = RecordWriter(Record.__table__)
+
+
+def get_headers(scope):
+    return Headers([(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope['headers']])
+
+
+async def send_response(send, status, body=None, headers=None):
+    raw_headers = []
+    data = b''
+    if body is not None:
+        data = json.dumps(body).encode('utf-8')
+        raw_headers.append((b'content-type', b'application/json'))
+    for name, value in (headers or {}).items():
+        raw_headers.append((name.lower().encode('latin-1'), str(value).encode('latin-1')))
+    raw_headers.append((b'content-length', str(len(data)).encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': data})
+
+
+async def send_metrics(send):
+    data, content_type = get_metrics()
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', content_type.encode('latin-1')),
+                            (b'content-length', str(len(data)).encode('latin-1'))]})
+    await send({'type': 'http.response.body', 'body': data})
+
+
+async def receive_body(receive, headers):
+    """ Reads the request body within the limits of the Flask application,
+        the compressed bytes are capped before read_body decompresses them """
+    content_length = headers.get('Content-Length', type=int)
+    if content_length is not None and content_length > MAX_PAYLOAD_LEN:
+        raise InvalidUsage("Request body exceeds {} bytes".format(MAX_PAYLOAD_LEN), 413, reason="body_too_large")
+    data = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionResetError("Client disconnected")
+        data += message.get('body', b'')
+        if len(data) > MAX_PAYLOAD_LEN:
+            raise InvalidUsage("Request body exceeds {} bytes".format(MAX_PAYLOAD_LEN), 413, reason="body_too_large")
+        if not message.get('more_body', False):
+            break
+    return read_body(io.BytesIO(bytes(data)), len(data), headers.get('Content-Encoding'), MAX_PAYLOAD_LEN)
+
+
+async def post_record(receive, send, headers):
+    data = await receive_body(receive, headers)
+    record = get_record_from_headers(headers, decode_payload(data))
+
+    if is_recent_event(record):
+        count_records([record], 'duplicate')
+        await send_response(send, 200, {'message': "Record already stored"})
+        return
+
+    if app.config.get("RATE_LIMIT_ENABLED", False):
+        # The Redis client blocks, keep it off the event loop
+        loop = asyncio.get_event_loop()
+        retry_after = (await loop.run_in_executor(None, rate_limiter.check, [record]))[0]
+        if retry_after:
+            count_records([record], 'rejected')
+            raise InvalidUsage("Too many records, retry later", 429,
+                               headers={'Retry-After': get_retry_after(retry_after)}, reason="rate_limited")
+
+    start = time.time()
+    try:
+        with timed_write('insert'):
+            record_id = await record_writer.write(record)
+    except (asyncpg.PostgresError, OSError) as e:
+        app.logger.error(e)
+        retry_after = admission.get_retry_after()
+        raise InvalidUsage("Database unavailable, retry later", 503,
+                           payload={'retry_after': retry_after},
+                           headers={'Retry-After': str(retry_after)}, reason="database_unavailable")
+    finally:
+        admission.observe(time.time() - start)
+        report_admission(admission)
+
+    add_recent_events([record])
+    if record_id is None:
+        count_records([record], 'duplicate')
+        await send_response(send, 200, {'message': "Record already stored"})
+        return
+
+    count_records([record], 'created')
+
+    mode, preferred = get_response_mode(headers)
+    response_headers = {}
+    if preferred:
+        response_headers['Preference-Applied'] = 'return={}'.format(mode)
+    if mode == 'empty':
+        await send_response(send, 204, headers=response_headers)
+    elif mode == 'minimal':
+        await send_response(send, 201, {'id': record_id}, response_headers)
+    else:
+        await send_response(send, 201, Record.format_record(record_id, record), response_headers)
+
+
+async def handle_http(scope, receive, send):
+    path = scope['path']
+    method = scope['method']
+    headers = get_headers(scope)
+    if path == '/v2/collector/status' and method == 'GET':
+        state = admission.get_state()
+        state['enabled'] = app.config.get("ADMISSION_ENABLED", False)
+        loop = asyncio.get_event_loop()
+        rate_limit = await loop.run_in_executor(None, get_rate_limit_state)
+        await send_response(send, 200, {'admission': state, 'rate_limit': rate_limit})
+    elif path == '/v2/collector/metrics' and method == 'GET' and app.config.get("METRICS_ENABLED", True):
+        report_admission(admission)
+        await send_metrics(send)
+    elif path in COLLECTOR_PATHS and method == 'GET':
+        await send_response(send, 302, headers={'Location': '/telemetryui'})
+    elif path in COLLECTOR_PATHS and method == 'POST':
+        admitted = not app.config.get("ADMISSION_ENABLED", False) or admission.enter()
+        report_admission(admission)
+        if not admitted:
+            retry_after = admission.get_retry_after()
+            raise InvalidUsage("Collector is overloaded, retry later", 503,
+                               payload={'retry_after': retry_after},
+                               headers={'Retry-After': str(retry_after)}, reason="overloaded")
+        try:
+            await post_record(receive, send, headers)
+        finally:
+            if app.config.get("ADMISSION_ENABLED", False):
+                admission.leave()
+                report_admission(admission)
+    elif path in COLLECTOR_PATHS:
+        await send_response(send, 405, {'message': "Method not allowed"})
+    else:
+        await send_response(send, 404, {'message': "Not found"})
+
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await record_writer.open(app.config['SQLALCHEMY_DATABASE_URI'],
+                                         app.config.get("ASGI_POOL_MIN_SIZE", 4),
+                                         app.config.get("ASGI_POOL_MAX_SIZE", 20))
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await record_writer.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    try:
+        await handle_http(scope, receive, send)
+    except InvalidUsage as error:
+        await send_response(send, error.status_code, error.to_dict(), error.headers)
+    except ConnectionResetError:
+        pass
+
+
+# vi: ts=4 et sw=4 sts=4
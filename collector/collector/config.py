@@ -22,12 +22,62 @@ class Config(object):
     db_host = os.environ['POSTGRES_HOSTNAME']
     db_user = os.environ['POSTGRES_USER']
     db_passwd = os.environ['POSTGRES_PASSWORD']
+    redis_passwd = os.environ.get('REDIS_PASSWD', '')
+    redis_hostname = os.environ.get('REDIS_HOSTNAME', 'redis')
     DEBUG = False
     TESTING = False
     LOG_LEVEL = logging.ERROR
     SQLALCHEMY_DATABASE_URI = 'postgres://{user}:{passwd}@{host}/telemetry'.format(user=db_user, passwd=db_passwd, host=db_host)
     SQLALCHEMY_TRACK_MODIFICATIONS = True
     LOG_FILE = 'handler.log'
+    REDIS_HOSTNAME = redis_hostname
+    REDIS_PORT = 6379
+    REDIS_PASSWD = redis_passwd
+    LOG_MAX_BYTES = 10 * 1024 * 1024
+
+    # Database connections of each uWSGI worker: pool_size connections are
+    # kept open, one per thread, and max_overflow more are opened under load.
+    # A request waits at most pool_timeout seconds for a connection.
+    # Connections are checked before use and replaced after pool_recycle
+    # seconds, so restarts and idle timeouts of the database or of a proxy
+    # in front of it do not fail requests.
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": 2,
+        "max_overflow": 2,
+        "pool_timeout": 10,
+        "pool_pre_ping": True,
+        "pool_recycle": 1800,
+    }
+    # When PREPARED_INSERT_ENABLED == True single records are inserted with
+    # statements prepared once per connection instead of through the ORM
+    PREPARED_INSERT_ENABLED = True
+
+    # Access log, one JSON object per request written by a background
+    # thread. Requests are sampled by classification using the rates in
+    # ACCESS_LOG_SAMPLING ("default" applies to every other classification
+    # and to batch requests), failed requests are always logged when
+    # ACCESS_LOG_ERRORS == True. ACCESS_LOG_PAYLOAD is one of "omit",
+    # "truncate" (to ACCESS_LOG_PAYLOAD_MAX characters) or "full". Every
+    # worker appends to ACCESS_LOG_FILE, rotate it with logrotate (without
+    # copytruncate), the workers reopen the file once it is moved. Lines
+    # are dropped while more than ACCESS_LOG_QUEUE_SIZE are waiting.
+    ACCESS_LOG_ENABLED = True
+    ACCESS_LOG_FILE = 'access.log'
+    ACCESS_LOG_QUEUE_SIZE = 10000
+    ACCESS_LOG_SAMPLING = {
+        "default": 1.0,
+        "org.clearlinux/heartbeat/ping": 0.01,
+    }
+    ACCESS_LOG_ERRORS = True
+    ACCESS_LOG_PAYLOAD = "truncate"
+    ACCESS_LOG_PAYLOAD_MAX = 256
+
+    # The records table is partitioned by reception time, with one partition
+    # per "day" or per "month". Partitions are created daily for the current
+    # and the next RECORDS_PARTITIONS_AHEAD intervals. Partitions older than
+    # every retention period below are dropped as a whole by the purge.
+    RECORDS_PARTITION_INTERVAL = "month"
+    RECORDS_PARTITIONS_AHEAD = 3
 
     # When PURGE_OLD_RECORDS == True then a purging system of old records will
     # be triggered daily. If this variable is not present, then no purging will be done.
@@ -43,6 +93,26 @@ class Config(object):
             "org.clearlinux/hello/world": 1,
         }
     }
+    # Records are purged in ranges of PURGE_CHUNK_SIZE ids, one transaction
+    # per range. A purge stops after PURGE_TIME_BUDGET seconds and the next
+    # one carries on, use 0 to let it run to completion.
+    PURGE_CHUNK_SIZE = 10000
+    PURGE_TIME_BUDGET = 3600
+    # When ARCHIVE_ENABLED == True the purged records are first appended to
+    # compressed NDJSON files under ARCHIVE_DIR, one directory per day and
+    # classification, listed in ARCHIVE_DIR/manifest.ndjson.
+    # ARCHIVE_COMPRESSION is "zstd" or "gzip".
+    ARCHIVE_ENABLED = False
+    ARCHIVE_DIR = 'archive'
+    ARCHIVE_COMPRESSION = 'zstd'
+    # The purge pauses after a chunk slower than PURGE_MAX_CHUNK_LATENCY
+    # seconds, and while the replicas are more than PURGE_MAX_REPLICATION_LAG
+    # seconds behind, checking every PURGE_THROTTLE_PAUSE seconds. A chunk is
+    # held back at most PURGE_MAX_PAUSE seconds. Use 0 to disable a check.
+    PURGE_MAX_CHUNK_LATENCY = 2
+    PURGE_MAX_REPLICATION_LAG = 30
+    PURGE_THROTTLE_PAUSE = 5
+    PURGE_MAX_PAUSE = 300
 
     # The Telemetry ID (TID) accepted by this `collector` app. The ID should be a
     # random UUID, generated with (for example) `uuidgen`. The default value
@@ -50,4 +120,123 @@ class Config(object):
     # Architecture.
     TELEMETRY_ID = "6907c830-eed9-4ce9-81ae-76daf8d88f0f"
 
+    # Maximum size in bytes of a record payload, and of the body of a
+    # request to the /v2/collector/batch endpoint. Request bodies may be
+    # compressed (Content-Encoding: gzip or zstd), the limits apply both
+    # to the bytes received and to the decompressed body. Larger requests
+    # are rejected with HTTP 413.
+    MAX_PAYLOAD_LEN = 300 * 1024
+    MAX_BATCH_LEN = 16 * 1024 * 1024
+
+    # Maximum number of records accepted in a single request to the
+    # /v2/collector/batch endpoint.
+    BATCH_MAX_RECORDS = 1000
+
+    # Number of Event-Ids (record format v4) each worker remembers, retried
+    # events found there are answered with HTTP 200 without querying the
+    # database. Events are stored only once in any case.
+    RECENT_EVENT_IDS = 100000
+
+    # Event-Ids are kept EVENT_ID_RETENTION_DAYS days after their reception
+    # to detect retried events, independently of the record retention.
+    EVENT_ID_RETENTION_DAYS = 35
+
+    # Payloads of at least PAYLOAD_DEDUP_MIN_LEN characters are stored once
+    # in the payloads table and referenced by their hash, shorter payloads
+    # are kept with their record.
+    PAYLOAD_DEDUP_MIN_LEN = 64
+
+    # Number of classification, build, system name... ids each worker keeps
+    # in memory, missing values are looked up and inserted on demand.
+    DIMENSION_CACHE_SIZE = 10000
+
+    # Response to a stored record: "representation" echoes the whole record
+    # back, "minimal" only returns its id and "empty" answers HTTP 204
+    # without a body. Clients can ask for a different mode with the
+    # "Prefer: return=minimal" or "Prefer: return=representation" header.
+    COLLECTOR_RESPONSE_MODE = "representation"
+
+    # When ADMISSION_ENABLED == True a worker answers HTTP 503 with a
+    # Retry-After header, instead of accepting more work, while it has
+    # ADMISSION_MAX_INFLIGHT requests in progress or while its recent
+    # database commit latency is above ADMISSION_MAX_COMMIT_LATENCY seconds.
+    # The latency estimate halves every ADMISSION_LATENCY_HALF_LIFE seconds
+    # without commits. Retry-After is ADMISSION_RETRY_AFTER seconds plus a
+    # random jitter of up to ADMISSION_RETRY_JITTER seconds. The admission
+    # state is reported by /v2/collector/status and by the
+    # collector_admission_* metrics. ADMISSION_MAX_INFLIGHT counts the
+    # requests of one worker, it must not exceed the threads of a uWSGI
+    # worker (threads in collector.ini) or the limit never triggers.
+    ADMISSION_ENABLED = False
+    ADMISSION_MAX_INFLIGHT = 2
+    ADMISSION_MAX_COMMIT_LATENCY = 1.0
+    ADMISSION_LATENCY_HALF_LIFE = 5
+    ADMISSION_RETRY_AFTER = 5
+    ADMISSION_RETRY_JITTER = 10
+
+    # Asyncio entrypoint (collector.asgi), served by an ASGI server such as
+    # uvicorn instead of uWSGI. Records are written through a pool of
+    # ASGI_POOL_MIN_SIZE to ASGI_POOL_MAX_SIZE connections; with admission
+    # control enabled a worker accepts up to ASGI_MAX_INFLIGHT concurrent
+    # requests.
+    ASGI_POOL_MIN_SIZE = 4
+    ASGI_POOL_MAX_SIZE = 20
+    ASGI_MAX_INFLIGHT = 2000
+
+    # When RATE_LIMIT_ENABLED == True records are rejected with HTTP 429
+    # and a Retry-After header once a machine or a classification exceeds
+    # its limit. Limits are (records per second, burst) token buckets shared
+    # by all the collector workers through Redis. RATE_LIMIT_MACHINE applies
+    # to every Machine-Id, RATE_LIMIT_CLASSIFICATION to each classification,
+    # with "default" used for the ones not listed; None disables a limit.
+    # Dropped records are counted in the collector:ratelimit:dropped Redis
+    # hash, reported by /v2/collector/status. Records are accepted when
+    # Redis cannot be reached.
+    RATE_LIMIT_ENABLED = False
+    RATE_LIMIT_REDIS_TIMEOUT = 0.1
+    RATE_LIMIT_MACHINE = (0.5, 120)
+    RATE_LIMIT_CLASSIFICATION = {
+        "default": (1000, 10000),
+    }
+
+    # When WRITE_BEHIND_ENABLED == True accepted records are answered with
+    # HTTP 202 and kept in memory by each worker, they are loaded into the
+    # database with COPY once WRITE_BEHIND_MAX_RECORDS are pending or the
+    # oldest pending record is WRITE_BEHIND_MAX_DELAY seconds old. Pending
+    # records are flushed when the worker shuts down. If the database is
+    # unavailable at most WRITE_BEHIND_MAX_PENDING records are kept.
+    WRITE_BEHIND_ENABLED = False
+    WRITE_BEHIND_MAX_RECORDS = 500
+    WRITE_BEHIND_MAX_DELAY = 2
+    WRITE_BEHIND_MAX_PENDING = 50000
+
+    # When SPOOL_ENABLED == True records that cannot be written to the
+    # database, because it fails or does not answer within
+    # SPOOL_LATENCY_BUDGET seconds, are appended to segment files under
+    # SPOOL_DIR and answered with HTTP 202. After a failure the database is
+    # not tried again for SPOOL_RETRY_INTERVAL seconds. Every
+    # SPOOL_REPLAY_INTERVAL seconds the spooled records are loaded into the
+    # database, one segment (at most SPOOL_SEGMENT_MAX_BYTES) at a time.
+    # A worker gives up its segment for replay once the database is tried
+    # again, or after SPOOL_SEGMENT_MAX_AGE seconds while it is still down.
+    SPOOL_ENABLED = False
+    SPOOL_DIR = 'spool'
+    SPOOL_SEGMENT_MAX_BYTES = 16 * 1024 * 1024
+    SPOOL_SEGMENT_MAX_AGE = 60
+    SPOOL_LATENCY_BUDGET = 2
+    SPOOL_RETRY_INTERVAL = 10
+    SPOOL_REPLAY_INTERVAL = 30
+
+    # /api/records answers 304 Not Modified while no record was added,
+    # updated or purged since the ETag or Last-Modified time the client
+    # sends. The ETag also changes every ETAG_MAX_AGE seconds, as records
+    # leave the time window of the queries.
+    ETAG_MAX_AGE = 60
+
+    # When METRICS_ENABLED == True /v2/collector/metrics exposes the record
+    # counts, validation failures and database write latencies in the
+    # Prometheus text format. Set PROMETHEUS_MULTIPROC_DIR in the
+    # environment of uWSGI so they are aggregated across the workers.
+    METRICS_ENABLED = True
+
 # vi: ts=4 et sw=4 sts=4
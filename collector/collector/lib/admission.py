@@ -0,0 +1,79 @@
+# Copyright (C) 2015-2020 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import math
+import time
+import random
+import threading
+
+# Weight of the newest sample in the commit latency moving average
+LATENCY_ALPHA = 0.2
+
+
+class AdmissionControl(object):
+    """ Sheds load before the database falls over. A worker stops
+        admitting requests while it has max_inflight requests in progress
+        or while its recent database commit latency is above max_latency.
+
+        The latency estimate decays with half_life seconds while there are
+        no new commits, otherwise a worker that sheds every request would
+        never notice that the database recovered.
+    """
+
+    def __init__(self, max_inflight, max_latency, half_life, retry_after, retry_jitter):
+        self.max_inflight = max_inflight
+        self.max_latency = max_latency
+        self.half_life = half_life
+        self.retry_after = retry_after
+        self.retry_jitter = retry_jitter
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.latency = 0.0
+        self.observed_at = time.time()
+        self.admitted = 0
+        self.rejected = 0
+
+    def get_latency(self):
+        elapsed = time.time() - self.observed_at
+        return self.latency * 0.5 ** (elapsed / self.half_life)
+
+    def is_overloaded(self):
+        return self.inflight >= self.max_inflight or self.get_latency() > self.max_latency
+
+    def enter(self):
+        with self.lock:
+            if self.is_overloaded():
+                self.rejected += 1
+                return False
+            self.inflight += 1
+            self.admitted += 1
+            return True
+
+    def leave(self):
+        with self.lock:
+            self.inflight -= 1
+
+    def observe(self, seconds):
+        with self.lock:
+            self.latency = LATENCY_ALPHA * seconds + (1 - LATENCY_ALPHA) * self.get_latency()
+            self.observed_at = time.time()
+
+    def get_retry_after(self):
+        # Spread the retries of rejected clients instead of having them
+        # come back all at once
+        return int(math.ceil(self.retry_after + random.uniform(0, self.retry_jitter)))
+
+    def get_state(self):
+        with self.lock:
+            return {
+                'overloaded': self.is_overloaded(),
+                'inflight': self.inflight,
+                'max_inflight': self.max_inflight,
+                'commit_latency': round(self.get_latency(), 6),
+                'max_commit_latency': self.max_latency,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+            }
+
+
+# vi: ts=4 et sw=4 sts=4
@@ -0,0 +1,78 @@
+# Copyright (C) 2015-2020 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import gzip
+import zlib
+from .validation import InvalidUsage
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class LimitedStream(object):
+    """ Wraps the request input, raising HTTP 413 once more than max_len
+        bytes have been read from the client """
+
+    def __init__(self, stream, max_len):
+        self.stream = stream
+        self.max_len = max_len
+        self.read_len = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.max_len - self.read_len + 1
+        data = self.stream.read(min(size, self.max_len - self.read_len + 1))
+        self.read_len += len(data)
+        if self.read_len > self.max_len:
+            raise InvalidUsage("Request body exceeds {} bytes".format(self.max_len), 413, reason="body_too_large")
+        return data
+
+    def readable(self):
+        return True
+
+
+def open_body(stream, content_encoding, max_len):
+    limited = LimitedStream(stream, max_len)
+    if content_encoding in (None, '', 'identity'):
+        return limited
+    if content_encoding in ('gzip', 'x-gzip'):
+        return gzip.GzipFile(fileobj=limited, mode='rb')
+    if content_encoding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(limited)
+    raise InvalidUsage("Content-Encoding {} is not supported".format(content_encoding), 415, reason="unsupported_encoding")
+
+
+def read_body(stream, content_length, content_encoding, max_len):
+    """ Reads a request body, decompressing it on the fly. Both the bytes
+        received and the decompressed size are limited to max_len, so an
+        oversized or maliciously compressed body is rejected without being
+        held in memory.
+    """
+    if content_length is not None and content_length > max_len:
+        raise InvalidUsage("Request body exceeds {} bytes".format(max_len), 413, reason="body_too_large")
+    if content_encoding is not None:
+        content_encoding = content_encoding.strip().lower()
+    reader = open_body(stream, content_encoding, max_len)
+    data = bytearray()
+    try:
+        while True:
+            chunk = reader.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            data += chunk
+            if len(data) > max_len:
+                raise InvalidUsage("Decompressed body exceeds {} bytes".format(max_len), 413, reason="body_too_large")
+    except (OSError, EOFError, zlib.error) as e:
+        raise InvalidUsage("Could not decompress request body, {}".format(e), 400, reason="decompression_failed")
+    except Exception as e:
+        if zstandard is not None and isinstance(e, zstandard.ZstdError):
+            raise InvalidUsage("Could not decompress request body, {}".format(e), 400, reason="decompression_failed")
+        raise
+    return bytes(data)
+
+
+# vi: ts=4 et sw=4 sts=4
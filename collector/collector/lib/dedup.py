@@ -0,0 +1,38 @@
+# Copyright (C) 2015-2020 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import threading
+from collections import OrderedDict
+
+
+class RecentEventIds(object):
+    """ Bounded set of the Event-Ids most recently stored by this worker,
+        used to answer client retries without a database round trip. The
+        primary key of the record_events table remains the source of truth.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.event_ids = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, event_id):
+        with self.lock:
+            if event_id not in self.event_ids:
+                return False
+            self.event_ids.move_to_end(event_id)
+            return True
+
+    def clear(self):
+        with self.lock:
+            self.event_ids.clear()
+
+    def add(self, event_id):
+        with self.lock:
+            self.event_ids[event_id] = True
+            self.event_ids.move_to_end(event_id)
+            if len(self.event_ids) > self.maxsize:
+                self.event_ids.popitem(last=False)
+
+
+# vi: ts=4 et sw=4 sts=4
@@ -0,0 +1,109 @@
+# Copyright (C) 2015-2020 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import math
+import time
+import redis
+
+# Token buckets shared by every collector worker. All the buckets a record
+# draws from are checked and updated in one atomic step, so a record is
+# either admitted by all of them or rejected without consuming tokens.
+# KEYS: bucket keys followed by the dropped records counter
+# ARGV: now, then rate, burst and counter field for each bucket
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local nbuckets = #KEYS - 1
+local tokens = {}
+local retry_after = 0
+local limited_by = nil
+for i = 1, nbuckets do
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local burst = tonumber(ARGV[i * 3])
+    local bucket = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local available = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    available = math.min(burst, available + math.max(0, now - ts) * rate)
+    tokens[i] = available
+    if available < 1 and (1 - available) / rate > retry_after then
+        retry_after = (1 - available) / rate
+        limited_by = ARGV[i * 3 + 1]
+    end
+end
+if limited_by then
+    redis.call('HINCRBY', KEYS[#KEYS], limited_by, 1)
+    return tostring(retry_after)
+end
+for i = 1, nbuckets do
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local burst = tonumber(ARGV[i * 3])
+    redis.call('HMSET', KEYS[i], 'tokens', tokens[i] - 1, 'ts', now)
+    redis.call('EXPIRE', KEYS[i], math.ceil(burst / rate) + 1)
+end
+return '0'
+"""
+
+DROPPED_KEY = "collector:ratelimit:dropped"
+
+
+class RateLimiter(object):
+    """ Limits the records accepted per Machine-Id and per classification.
+
+        machine_limit is a (records per second, burst) tuple applied to
+        every machine, classification_limits maps classifications to such
+        tuples, the "default" entry applies to the ones not listed. A None
+        limit disables the corresponding bucket.
+    """
+
+    def __init__(self, redis_client, machine_limit, classification_limits, logger):
+        self.redis_client = redis_client
+        self.machine_limit = machine_limit
+        self.classification_limits = classification_limits
+        self.logger = logger
+        self.script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def get_buckets(self, record):
+        buckets = []
+        if self.machine_limit:
+            buckets.append(("collector:ratelimit:machine:{}".format(record['machine_id']),
+                            self.machine_limit, "machine"))
+        classification = record['classification']
+        limit = self.classification_limits.get(classification, self.classification_limits.get("default"))
+        if limit:
+            buckets.append(("collector:ratelimit:classification:{}".format(classification),
+                            limit, "classification:{}".format(classification)))
+        return buckets
+
+    def check(self, records, now=None):
+        """ Returns, for each record, 0 if it is admitted or the number of
+            seconds after which it would be """
+        now = now or time.time()
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for record in records:
+                buckets = self.get_buckets(record)
+                keys = [b[0] for b in buckets] + [DROPPED_KEY]
+                args = [now]
+                for _, (rate, burst), field in buckets:
+                    args.extend([rate, burst, field])
+                self.script(keys=keys, args=args, client=pipe)
+            return [float(r) for r in pipe.execute()]
+        except redis.exceptions.RedisError as e:
+            # Do not turn a Redis outage into an ingestion outage
+            self.logger.error("Rate limiting skipped, {}".format(e))
+            return [0] * len(records)
+
+    def get_dropped(self):
+        """ Returns the number of records dropped by each bucket type over
+            all the workers, None when Redis is unavailable """
+        try:
+            return {k: int(v) for k, v in self.redis_client.hgetall(DROPPED_KEY).items()}
+        except redis.exceptions.RedisError as e:
+            self.logger.error("Rate limiting counters unavailable, {}".format(e))
+            return None
+
+
+def get_retry_after(seconds):
+    return str(int(math.ceil(seconds)))
+
+
+# vi: ts=4 et sw=4 sts=4
@@ -14,8 +14,10 @@
 # limitations under the License.
 #
 
+import re
 import string
 from .. import app
+from ..monitoring import count_failure
 MAX_NUM_RECORDS = '1000'
 
 REQUIRED_HEADERS_V1 = (
@@ -50,21 +52,31 @@ REQUIRED_HEADERS_V4 = REQUIRED_HEADERS_V3 + (
 TELEMETRY_ID = app.config.get("TELEMETRY_ID", "6907c830-eed9-4ce9-81ae-76daf8d88f0f")
 
 SEVERITY_VALUES = [1, 2, 3, 4]
-VALID_RECORD_FORMAT_VERSIONS = [1, 2, 3, 4]
 POSTGRES_INT_MAX = 2147483647
 MAXLEN_PRINTABLE = 200
+PRINTABLE = frozenset(string.printable)
+EVENT_ID_CHARS = frozenset("0123456789abcdef")
+ARCHITECTURES = frozenset(["armv7l", "armv6l", "aarch64", "amd64", "sparc64", "ppc64", "i686", "i386", "x86_64", "ppc"])
+CLEAR_BUILD_REGEX = re.compile(r"^[0-9]+$")
+BUILD_REGEX = re.compile(r"^[-_a-zA-Z0-9.]+$")
 
 
 class InvalidUsage(Exception):
     status_code = 400
 
-    def __init__(self, message, status_code=None, payload=None):
+    def __init__(self, message, status_code=None, payload=None, headers=None, reason="invalid_request"):
         Exception.__init__(self)
         self.message = message
         if status_code is not None:
             self.status_code = status_code
         self.payload = payload
+        self.headers = headers
         app.logger.error("InvalidUsage ({}): {}".format(self.status_code, self.message))
+        # Failures are counted by their fixed reason, or the list of reasons
+        # of every problem found in the headers of a record, messages can
+        # hold client data
+        for r in [reason] if isinstance(reason, str) else reason:
+            count_failure(self.status_code, r)
 
     def to_dict(self):
         rv = dict(self.payload or ())
@@ -75,17 +87,6 @@ class InvalidUsage(Exception):
         return self.message
 
 
-def validate_headers(headers, required_headers):
-    """ Check for every single required header to be
-        in the request """
-    req_headers = dict(headers)
-    req_headers_keys = req_headers.keys()
-    for header in required_headers:
-        if header not in req_headers_keys:
-            raise InvalidUsage("Record-Format-Version headers are invalid, {} missing".format(header), 400)
-    return True
-
-
 def is_not_none(v):
     return v is not None
 
@@ -95,25 +96,7 @@ def is_a_number(n):
 
 
 def value_is_printable(a_value):
-    return all([x in string.printable for x in a_value])
-
-
-def record_format_version_validation(record_format_version):
-    return all([is_not_none(record_format_version), is_a_number(record_format_version)]) and int(record_format_version) in VALID_RECORD_FORMAT_VERSIONS
-
-
-def record_format_version_headers_validation(record_format_version, headers):
-    # Validate required headers based on Record Version
-    req_headrs = {
-        '1': REQUIRED_HEADERS_V1,
-        '2': REQUIRED_HEADERS_V2,
-        '3': REQUIRED_HEADERS_V3,
-        '4': REQUIRED_HEADERS_V4,
-    }
-    reqs = req_headrs.get(record_format_version, None)
-    if reqs is None:
-        return False
-    return validate_headers(headers, reqs)
+    return all([x in PRINTABLE for x in a_value])
 
 
 def validation_tid_header(tid):
@@ -137,7 +120,7 @@ def validate_timestamp(timestamp):
 
 
 def validate_architecture(arch):
-    return arch in ["armv7l", "armv6l", "aarch64", "amd64", "sparc64", "ppc64", "i686", "i386", "x86_64", "ppc"]
+    return arch in ARCHITECTURES
 
 
 def validate_host_type(host_type):
@@ -148,55 +131,172 @@ def validate_kernel_version(kernel_version):
     """ makes sure that the kernel version string has at least 2 numbers
         version, major and minor revision
     """
-    try:
-        version, major_revision, _ = str(kernel_version).split('.', maxsplit=2)
-        return all([is_a_number(x) for x in [version, major_revision]])
-    except ValueError as e:
-        print(e)
-        return False
+    parts = str(kernel_version).split('.', maxsplit=2)
+    return len(parts) == 3 and is_a_number(parts[0]) and is_a_number(parts[1])
 
 
 def validate_payload_format_version(payload_format_version):
-    return int(payload_format_version) < POSTGRES_INT_MAX
+    return is_a_number(payload_format_version) and int(payload_format_version) < POSTGRES_INT_MAX
 
 
 def validate_x_header(header_value):
     return is_not_none(header_value) and len(header_value) < MAXLEN_PRINTABLE and value_is_printable(header_value)
 
 
+def validate_system_name(system_name):
+    return is_not_none(system_name)
+
+
 def validate_created(created):
     return is_a_number(created)
 
 
 def validate_record_limit(limit):
-    return is_a_number(limit) and limit <= MAX_NUM_RECORDS
+    return is_a_number(limit) and int(limit) <= int(MAX_NUM_RECORDS)
 
 
 def validate_event_id(header_value):
-    return len(header_value) == 32 and len([v for v in header_value if v in "0123456789abcdef"]) == 32
-
-
-def validate_header(name, value, expected=None):
-    if expected is None:
-        return {
-            'tid_header': validation_tid_header,
-            'record_format_version': record_format_version_validation,
-            'payload_format_version': validate_payload_format_version,
-            'severity': validate_severity,
-            'classification': validate_classification,
-            'machine_id': validate_machine_id,
-            'timestamp': validate_timestamp,
-            'architecture': validate_architecture,
-            'host_type': validate_host_type,
-            'kernel_version': validate_kernel_version,
-            'board_name': validate_x_header,
-            'cpu_model': validate_x_header,
-            'bios_version': validate_x_header,
-            'build': validate_x_header,
-            'event_id': validate_event_id,
-        }.get(name, lambda x: False)(value)
+    return is_not_none(header_value) and len(header_value) == 32 and all([v in EVENT_ID_CHARS for v in header_value])
+
+
+def validate_build(build, system_name):
+    # The build number is stored as a string in the database, but if this
+    # record is from a Clear Linux OS system, only accept an integer.
+    # Otherwise, loosen the restriction to the characters listed for
+    # VERSION_ID in os-release(5) in addition to the capital letters A-Z.
+    if system_name == 'clear-linux-os':
+        if not CLEAR_BUILD_REGEX.match(build):
+            return "Clear Linux OS build version has invalid characters"
+    elif not BUILD_REGEX.match(build):
+        return "Build version has invalid characters"
+    return None
+
+
+def clean_quotes(value):
+    # It is common to see values quoted in os-release. We don't need the
+    # quotes, so strip them from the semantic value.
+    return value.replace('"', '').replace("'", "")
+
+
+def clean_external(value):
+    return value == "true"
+
+
+class RecordField(object):
+    """ A header that is validated and stored with the record """
+
+    def __init__(self, name, header, validator, message, clean=None):
+        self.name = name
+        self.header = header
+        self.validator = validator
+        self.message = message
+        self.clean = clean
+
+
+class RecordSchema(object):
+    """ Precomputed validation rules for one Record-Format-Version, the
+        headers of a request are checked in a single pass and every problem
+        found is reported at once.
+    """
+
+    def __init__(self, version, required_headers, fields, defaults):
+        self.version = version
+        self.required_headers = required_headers
+        self.fields = fields
+        self.defaults = defaults
+
+    def validate(self, headers):
+        """ Returns the record values and the list of the reasons and
+            messages of the errors found """
+        errors = []
+        record = dict(self.defaults)
+        record['record_version'] = self.version
+        for header in self.required_headers:
+            if header not in headers:
+                errors.append(("missing_header", "Record-Format-Version headers are invalid, {} missing".format(header)))
+        for field in self.fields:
+            value = headers.get(field.header)
+            if value is None and field.header in self.required_headers:
+                # Already reported as missing
+                continue
+            if not field.validator(value):
+                errors.append(("invalid_" + field.name, field.message))
+            elif field.clean is not None:
+                record[field.name] = field.clean(value)
+            else:
+                record[field.name] = value
+        if 'build' in record and 'system_name' in record:
+            error = validate_build(record['build'], record['system_name'])
+            if error is not None:
+                errors.append(("invalid_build", error))
+        return record, errors
+
+
+FIELDS_V1 = (
+    RecordField('severity', 'Severity', validate_severity, "severity value is out of range"),
+    RecordField('classification', 'Classification', validate_classification, "Classification value is invalid"),
+    RecordField('machine_id', 'Machine-Id', validate_machine_id, "Machine id value is invalid"),
+    RecordField('ts_capture', 'Creation-Timestamp', validate_timestamp, "timestamp is invalid", int),
+    RecordField('architecture', 'Arch', validate_architecture, "architecture is invalid"),
+    RecordField('host_type', 'Host-Type', validate_host_type, "host type is invalid"),
+    RecordField('kernel_version', 'Kernel-Version', validate_kernel_version, "kernel version is invalid"),
+    RecordField('system_name', 'System-Name', validate_system_name, "System name is missing", clean_quotes),
+    RecordField('build', 'Build', is_not_none, "Build is missing", clean_quotes),
+    RecordField('payload_version', 'Payload-Format-Version', validate_payload_format_version,
+                "Payload format version outside of range supported"),
+    RecordField('external', 'X-CLR-External', lambda x: True, "", clean_external),
+)
+
+FIELDS_V3 = FIELDS_V1 + (
+    RecordField('board_name', 'Board-Name', validate_x_header, "board name is invalid"),
+    RecordField('cpu_model', 'Cpu-Model', validate_x_header, "cpu model is invalid"),
+    RecordField('bios_version', 'Bios-Version', validate_x_header, "BIOS version is invalid"),
+)
+
+FIELDS_V4 = FIELDS_V3 + (
+    RecordField('event_id', 'Event-Id', validate_event_id, "Event id is invalid"),
+)
+
+DEFAULTS_V1 = {
+    'board_name': "N/A",
+    'cpu_model': "N/A",
+    'bios_version': "N/A",
+    'event_id': "N/A",
+    'external': False,
+}
+
+RECORD_SCHEMAS = {
+    '1': RecordSchema('1', REQUIRED_HEADERS_V1, FIELDS_V1, DEFAULTS_V1),
+    '2': RecordSchema('2', REQUIRED_HEADERS_V2, FIELDS_V1, DEFAULTS_V1),
+    '3': RecordSchema('3', REQUIRED_HEADERS_V3, FIELDS_V3, DEFAULTS_V1),
+    '4': RecordSchema('4', REQUIRED_HEADERS_V4, FIELDS_V4, DEFAULTS_V1),
+}
+
+
+def validate_record_headers(headers):
+    """ Validates the headers of a record with the schema of its
+        Record-Format-Version, returns the values to store keyed on the
+        Record.create argument names or raises InvalidUsage listing every
+        problem found.
+    """
+    errors = []
+    # The collector only accepts records with the configured TID value.
+    # Make sure the TID in the collector config.py matches the TID
+    # configured for telemetrics-client on the systems from which this
+    # collector receives records.
+    if not validation_tid_header(headers.get("X-Telemetry-Tid")):
+        errors.append(("tid_mismatch", "Telemetry ID mismatch"))
+    schema = RECORD_SCHEMAS.get(headers.get("Record-Format-Version"))
+    if schema is None:
+        errors.append(("invalid_record_format_version", "Record-Format-Version is invalid"))
     else:
-        return value == expected
+        record, schema_errors = schema.validate(headers)
+        errors.extend(schema_errors)
+    if errors:
+        messages = [e[1] for e in errors]
+        raise InvalidUsage('; '.join(messages), 400, payload={'errors': messages},
+                           reason=[e[0] for e in errors])
+    return record
 
 
 def validate_query(name, value):
@@ -14,23 +14,146 @@
 # limitations under the License.
 #
 
-from flask import request, current_app, app
+import os
+import json
+import time
+import queue
+import random
 import logging
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    WatchedFileHandler)
+from flask import (
+    request,
+    g)
+from . import app
+
+ACCESS_LOG_ENABLED = app.config.get("ACCESS_LOG_ENABLED", True)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """ Never blocks the request, lines are dropped when the writer
+        thread falls behind """
+
+    def __init__(self, log_queue):
+        QueueHandler.__init__(self, log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class AccessLog(object):
+    """ Writes one JSON object per request from a background thread. All
+        the workers append to the same file, which is rotated externally,
+        e.g. by logrotate: a worker reopens the file once it is moved. """
+
+    def __init__(self, filename, queue_size):
+        self.filename = filename
+        self.queue_size = queue_size
+        self.logger = logging.getLogger("collector.access")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.handler = None
+        self.listener = None
+        self.pid = None
+
+    def start(self):
+        # uWSGI forks the workers after the app is imported, each worker
+        # starts its own writer thread on its first request.
+        if self.listener is not None and self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        file_handler = WatchedFileHandler(self.filename)
+        file_handler.setFormatter(logging.Formatter("%(message)s"))
+        log_queue = queue.Queue(self.queue_size)
+        if self.handler is not None:
+            self.logger.removeHandler(self.handler)
+        self.handler = DroppingQueueHandler(log_queue)
+        self.logger.addHandler(self.handler)
+        self.listener = QueueListener(log_queue, file_handler)
+        self.listener.start()
+
+    def stop(self):
+        """ Writes the queued lines and stops the writer thread """
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+        self.listener = None
+
+    def log(self, entry):
+        self.start()
+        self.logger.info(json.dumps(entry))
+
+
+access_log = AccessLog(app.config.get("ACCESS_LOG_FILE", "access.log"),
+                       app.config.get("ACCESS_LOG_QUEUE_SIZE", 10000))
+
+
+def log_records(records):
+    """ Attaches the records of the current request to its access log line """
+    g.access_log_records = records
+
+
+def get_sample_rate(classification):
+    sampling = app.config.get("ACCESS_LOG_SAMPLING", {"default": 1.0})
+    return sampling.get(classification, sampling.get("default", 1.0))
+
+
+def get_logged_payload(payload):
+    mode = app.config.get("ACCESS_LOG_PAYLOAD", "truncate")
+    if mode == "omit" or payload is None:
+        return None
+    if mode == "truncate":
+        return payload[:app.config.get("ACCESS_LOG_PAYLOAD_MAX", 256)]
+    return payload
 
 
 @app.before_request
 def before_request():
-    headers = request.headers
-    payload = request.data
-    print('Before request')
-    current_app.logger.info('\t'.join([
-        datetime.datetime.today().ctime(),
-        request.remote_addr,
-        request.method,
-        request.url,
-        str(request.data),
-        ', '.join([': '.join(x) for x in request.headers])])
-    )
+    g.access_log_start = time.time()
+
+
+@app.after_request
+def after_request(response):
+    if not ACCESS_LOG_ENABLED:
+        return response
+    records = g.get("access_log_records", [])
+    classification = records[0].get("classification") if len(records) == 1 else None
+    sample_rate = get_sample_rate(classification)
+    is_error = response.status_code >= 400
+    if not (is_error and app.config.get("ACCESS_LOG_ERRORS", True)) and random.random() >= sample_rate:
+        return response
+    entry = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "remote_addr": request.remote_addr,
+        "method": request.method,
+        "path": request.path,
+        "status": response.status_code,
+        "latency_ms": round((time.time() - g.get("access_log_start", time.time())) * 1000, 3),
+        "content_length": request.content_length,
+        "content_encoding": request.content_encoding,
+        "sample_rate": sample_rate,
+        "records": len(records),
+    }
+    if len(records) == 1:
+        record = records[0]
+        entry.update({
+            "classification": record.get("classification"),
+            "machine_id": record.get("machine_id"),
+            "record_version": record.get("record_version"),
+            "event_id": record.get("event_id"),
+            "payload": get_logged_payload(record.get("payload")),
+        })
+    if is_error:
+        entry["response"] = response.get_data(as_text=True)[:app.config.get("ACCESS_LOG_PAYLOAD_MAX", 256)]
+    access_log.log(entry)
+    return response
 
 
 # vi: ts=4 et sw=4 sts=4
@@ -0,0 +1,58 @@
+# Copyright (C) 2015-2020 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+""" Metrics of the collector, see metrics.py for their aggregation across
+    the uWSGI workers """
+
+from .metrics import (
+    counter,
+    gauge,
+    histogram,
+    timed)
+
+# result is "created", "duplicate", "accepted" (write-behind or spooled)
+# or "rejected" (rate limited)
+records_received = counter("collector_records_total", "Records received",
+                           ["classification", "record_version", "result"])
+
+# reason is a fixed code given where the request is rejected, see
+# InvalidUsage, never a message that could hold client data
+validation_failures = counter("collector_validation_failures_total", "Requests and batch entries rejected",
+                              ["status", "reason"])
+
+# operation is "insert" for the requests, "copy" for the write-behind
+# flushes and "replay" for the spooled records
+db_write_seconds = histogram("collector_db_write_seconds", "Latency of the database writes, commit included",
+                             ["operation"])
+
+# Admission state of the workers, see AdmissionControl: the requests in
+# progress add up over the workers, the commit latency and the overloaded
+# flag report the worst worker
+admission_inflight = gauge("collector_admission_inflight", "Requests in progress",
+                           multiprocess_mode='livesum')
+admission_commit_latency = gauge("collector_admission_commit_latency_seconds",
+                                 "Recent database commit latency seen by admission control")
+admission_overloaded = gauge("collector_admission_overloaded", "1 while a worker turns requests away")
+
+
+def count_records(records, result):
+    for record in records:
+        records_received.labels(record.get('classification'), str(record.get('record_version')), result).inc()
+
+
+def count_failure(status, reason):
+    validation_failures.labels(str(status), reason).inc()
+
+
+def report_admission(admission):
+    state = admission.get_state()
+    admission_inflight.set(state['inflight'])
+    admission_commit_latency.set(state['commit_latency'])
+    admission_overloaded.set(1 if state['overloaded'] else 0)
+
+
+def timed_write(operation):
+    return timed(db_write_seconds, operation)
+
+
+# vi: ts=4 et sw=4 sts=4
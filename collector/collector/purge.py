@@ -15,6 +15,9 @@
 #
 
 from .model import Record
+from .purge_worker import (
+    run_purge,
+    print_summary)
 from . import app
 
 try:
@@ -22,16 +25,28 @@ try:
 
     PURGE_OLD_RECORDS = app.config.get("PURGE_OLD_RECORDS", True)
 
+    # Creates the records partitions of the coming days or months at 3:30
+    # every day
+    @cron(30, 3, -1, -1, -1, target='spooler')
+    def partition_task(signum):
+        with app.app_context():
+            created = Record.ensure_partitions()
+            if created:
+                app.logger.info("Created partitions {}".format(", ".join(created)))
+
     # Runs cron job at 4:30 every day
     @cron(30, 4, -1, -1, -1, target='spooler')
     def purge_task(signum):
         if PURGE_OLD_RECORDS:
             app.logger.info("Running cron job for purging records")
             with app.app_context():
-                Record.delete_records()
+                summary = run_purge()
+                if summary is not None:
+                    print_summary(summary)
 
 except ImportError:
-        app.logger.info("Import error for uwsgidecorators")
+        app.logger.warning("Import error for uwsgidecorators, records are not purged "
+                           "unless collector.purge_worker runs")
 
 
 # vi: ts=4 et sw=4 sts=4
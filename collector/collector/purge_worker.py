@@ -0,0 +1,182 @@
+# Copyright (C) 2015-2020 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+""" Purges the records past their retention outside of uWSGI:
+
+        python3 -m collector.purge_worker [--interval SECONDS]
+
+    A Postgres advisory lock makes sure a single purge runs at a time, be
+    it this worker or the spooler cron of the collector. The purge pauses
+    between chunks while the replicas lag behind or the database is slow,
+    then the tables are vacuumed and analyzed.
+"""
+
+import sys
+import time
+import argparse
+from contextlib import contextmanager
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from . import app
+from .model import (
+    db,
+    Record)
+from .archive import RecordArchive
+
+# Key of the advisory lock held while purging
+PURGE_LOCK_ID = 7352381
+
+PURGED_TABLES = ('records', 'payloads', 'record_events')
+
+REPLICATION_LAG = """
+  SELECT COALESCE(EXTRACT(EPOCH FROM max(replay_lag)), 0) FROM pg_stat_replication
+"""
+
+# The partitioned records table has no storage of its own
+TABLES_SIZE = """
+  SELECT COALESCE(sum(pg_total_relation_size(c.oid)), 0) FROM pg_class c
+  WHERE c.relname IN ('payloads', 'record_events')
+  OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'records'::regclass)
+"""
+
+
+class PurgeThrottle(object):
+    """ Pauses the purge after a chunk slower than max_latency seconds for
+        as long as the chunk took, and while the replicas are more than
+        max_lag seconds behind, checking every pause seconds. A chunk is
+        never held back more than max_pause seconds.
+    """
+
+    def __init__(self, max_lag, max_latency, pause, max_pause):
+        self.max_lag = max_lag
+        self.max_latency = max_latency
+        self.pause = pause
+        self.max_pause = max_pause
+        self.paused = 0.0
+
+    def get_replication_lag(self):
+        try:
+            lag = db.session.execute(text(REPLICATION_LAG)).scalar()
+            db.session.commit()
+            return float(lag or 0)
+        except SQLAlchemyError as e:
+            app.logger.error(e)
+            db.session.rollback()
+            return 0.0
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+        self.paused += seconds
+
+    def wait(self, seconds):
+        waited = 0
+        if self.max_latency and seconds > self.max_latency:
+            waited = min(seconds, self.max_pause)
+            self.sleep(waited)
+        while self.max_lag and waited < self.max_pause and self.get_replication_lag() > self.max_lag:
+            self.sleep(self.pause)
+            waited += self.pause
+
+
+@contextmanager
+def purge_lock():
+    """ Yields whether the advisory lock was acquired, the lock is held by
+        its own connection so the purge can commit as it goes """
+    conn = db.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    locked = False
+    try:
+        locked = conn.execute(text("SELECT pg_try_advisory_lock(:id)"), id=PURGE_LOCK_ID).scalar()
+        yield locked
+    finally:
+        if locked:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), id=PURGE_LOCK_ID)
+        conn.close()
+
+
+def get_tables_size():
+    size = db.session.execute(text(TABLES_SIZE)).scalar()
+    db.session.commit()
+    return int(size)
+
+
+def vacuum():
+    # VACUUM cannot run inside a transaction
+    conn = db.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    try:
+        for table in PURGED_TABLES:
+            conn.execute(text("VACUUM ANALYZE {}".format(table)))
+    finally:
+        conn.close()
+
+
+def get_archive():
+    if not app.config.get("ARCHIVE_ENABLED", False):
+        return None
+    return RecordArchive(app.config.get("ARCHIVE_DIR", "archive"),
+                         app.config.get("ARCHIVE_COMPRESSION", "zstd"))
+
+
+def run_purge(time_budget=None, vacuum_tables=True):
+    """ Purges the records unless another purge is running, returns the
+        summary of the purge or None """
+    start = time.time()
+    with purge_lock() as locked:
+        if not locked:
+            app.logger.info("Another purge is running")
+            return None
+        created = Record.ensure_partitions()
+        if created:
+            app.logger.info("Created partitions {}".format(", ".join(created)))
+        size = get_tables_size()
+        throttle = PurgeThrottle(app.config.get("PURGE_MAX_REPLICATION_LAG", 30),
+                                 app.config.get("PURGE_MAX_CHUNK_LATENCY", 2),
+                                 app.config.get("PURGE_THROTTLE_PAUSE", 5),
+                                 app.config.get("PURGE_MAX_PAUSE", 300))
+        rules = Record.delete_records(get_archive(), throttle, time_budget)
+        if vacuum_tables:
+            vacuum()
+    return {
+        'rules': rules,
+        'deleted': sum([r['deleted'] for r in rules]),
+        'complete': all([r['complete'] for r in rules]),
+        'bytes_reclaimed': size - get_tables_size(),
+        'paused': throttle.paused,
+        'seconds': time.time() - start,
+    }
+
+
+def print_summary(summary):
+    for rule in summary['rules']:
+        print("{rule}: {deleted} records deleted in {chunks} chunks, {seconds:.1f}s ({rate:.0f}/s)".format(**rule))
+    print("Deleted {} records, reclaimed {} bytes in {:.1f}s ({:.1f}s throttled){}".format(
+        summary['deleted'], summary['bytes_reclaimed'], summary['seconds'], summary['paused'],
+        "" if summary['complete'] else ", purge incomplete"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Purges the records past their retention")
+    parser.add_argument("--interval", type=int, default=0,
+                        help="purge every INTERVAL seconds instead of once")
+    parser.add_argument("--time-budget", type=int, default=None,
+                        help="stop purging after TIME_BUDGET seconds, overrides PURGE_TIME_BUDGET")
+    parser.add_argument("--no-vacuum", action="store_true",
+                        help="do not vacuum the tables after the purge")
+    args = parser.parse_args(argv)
+    while True:
+        with app.app_context():
+            summary = run_purge(args.time_budget, not args.no_vacuum)
+        if summary is None:
+            print("Another purge is running")
+        else:
+            print_summary(summary)
+        sys.stdout.flush()
+        if not args.interval:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
+
+
+# vi: ts=4 et sw=4 sts=4
@@ -16,50 +16,109 @@
 
 import re
 import time
-import datetime
+import json
+import redis
+import atexit
+import base64
+import functools
 import importlib
+from datetime import datetime
+from contextlib import contextmanager
 from flask import request
 from flask import jsonify
 from flask import redirect
+from flask import Response
+from flask import stream_with_context
+from werkzeug.datastructures import Headers
+from werkzeug import http as werkzeug_http
 from .lib.validation import (
-    validate_header,
     validate_query,
+    validate_record_headers,
     MAX_NUM_RECORDS,
-    record_format_version_headers_validation,
     InvalidUsage)
-from .model import Record
+from .lib.body import read_body
+from .lib.dedup import RecentEventIds
+from .lib.admission import AdmissionControl
+from .lib.ratelimit import (
+    RateLimiter,
+    get_retry_after)
+from .log_requests import (
+    access_log,
+    log_records)
+from .metrics import get_metrics
+from .monitoring import (
+    count_records,
+    count_failure,
+    report_admission,
+    timed_write)
+from .model import (
+    RECORD_FIELDS,
+    DataVersion,
+    Record,
+    DuplicateRecordError)
+from .write_behind import write_behind_buffer
+from .spool import (
+    spool_fallback,
+    SPOOL_ENABLED)
 from .purge import *
 
 tm_version_regex = re.compile("^[0-9]+\.[0-9]+$")
 client_id_regex = re.compile(
     "^[0-9]+[ \t]+[-/.:_+*a-zA-Z0-9]+[ \t]+[-/.:_+*a-zA-Z0-9]+$")
 ts_v3_regex = re.compile("^[0-9]+$")
-# FIXME: configurable limits
-max_payload_len_inline = 30 * 1024	 # 30k
-max_payload_len = 300 * 1024		 # 300k
+MAX_PAYLOAD_LEN = app.config.get("MAX_PAYLOAD_LEN", 300 * 1024)
+MAX_BATCH_LEN = app.config.get("MAX_BATCH_LEN", 16 * 1024 * 1024)
 MAX_INTERVAL_SEC = 24 * 60 * 60 * 30    # 30 days in seconds
+# Records fetched from the server-side cursor and written out at a time
+API_STREAM_BATCH = app.config.get("API_STREAM_BATCH", 100)
+BATCH_MAX_RECORDS = app.config.get("BATCH_MAX_RECORDS", 1000)
+ETAG_MAX_AGE = app.config.get("ETAG_MAX_AGE", 60)
+PREPARED_INSERT_ENABLED = app.config.get("PREPARED_INSERT_ENABLED", True)
+
+recent_event_ids = RecentEventIds(app.config.get("RECENT_EVENT_IDS", 100000))
+
+admission = AdmissionControl(app.config.get("ADMISSION_MAX_INFLIGHT", 2),
+                             app.config.get("ADMISSION_MAX_COMMIT_LATENCY", 1.0),
+                             app.config.get("ADMISSION_LATENCY_HALF_LIFE", 5),
+                             app.config.get("ADMISSION_RETRY_AFTER", 5),
+                             app.config.get("ADMISSION_RETRY_JITTER", 10))
+
+rate_limiter = RateLimiter(redis.StrictRedis(decode_responses=True,
+                                             host=app.config.get("REDIS_HOSTNAME", "localhost"),
+                                             port=app.config.get("REDIS_PORT", 6379),
+                                             password=app.config.get("REDIS_PASSWD", None),
+                                             socket_timeout=app.config.get("RATE_LIMIT_REDIS_TIMEOUT", 0.1)),
+                           app.config.get("RATE_LIMIT_MACHINE", None),
+                           app.config.get("RATE_LIMIT_CLASSIFICATION", {}),
+                           app.logger)
+
+
+def shutdown_worker():
+    """ Writes the buffered records, then the queued access log lines """
+    write_behind_buffer.shutdown()
+    access_log.stop()
+
+
+try:
+    import uwsgi
+
+    # uWSGI does not run the atexit handlers of its workers, and keeps a
+    # single handler in uwsgi.atexit
+    uwsgi.atexit = shutdown_worker
+
+except ImportError:
+    atexit.register(shutdown_worker)
 
 
 @app.errorhandler(InvalidUsage)
 def handle_invalid_usage(error):
     response = jsonify(error.to_dict())
     response.status_code = error.status_code
+    if error.headers:
+        response.headers.extend(error.headers)
     return response
 
 
-@app.before_request
-def before_request():
-    headers = request.headers
-    payload = request.data
-    app.logger.info('\t'.join([
-        datetime.datetime.today().ctime(),
-        request.method,
-        request.url,
-        str(request.data),
-        ', '.join([': '.join(x) for x in request.headers])])
-    )
-
-
 def clean_build_n_value(build):
     # It is common to see the build numbers quoted in os-release. We don't
     # need the quotes, so strip them from the semantic value.
@@ -67,116 +126,249 @@ def clean_build_n_value(build):
     return _build
 
 
-def validate_header_value(header_value, record_name, err_msg):
+def decode_payload(data):
     try:
-        if validate_header(record_name, header_value) is True:
-            return header_value
-    except Exception as e:
-        err_msg = "Error parsing {}, {}".format(record_name, e)
-    raise InvalidUsage(err_msg, 400)
+        # prefer UTF-8, if possible
+        return data.decode('utf-8')
+    except UnicodeError:
+        # fallback to Latin-1, since it accepts all byte values
+        return data.decode('latin-1')
+
+
+def get_record_from_headers(headers, payload):
+    """ Validates the headers of a single record and returns the values
+        to store, keyed on the Record.create argument names """
+    record = validate_record_headers(headers)
+    record['ts_reception'] = time.time()
+    record['payload'] = payload
+    return record
+
+
+@contextmanager
+def admitted_request():
+    if not app.config.get("ADMISSION_ENABLED", False):
+        yield
+        return
+    admitted = admission.enter()
+    report_admission(admission)
+    if not admitted:
+        retry_after = admission.get_retry_after()
+        raise InvalidUsage("Collector is overloaded, retry later", 503,
+                           payload={'retry_after': retry_after},
+                           headers={'Retry-After': str(retry_after)}, reason="overloaded")
+    try:
+        yield
+    finally:
+        admission.leave()
+        report_admission(admission)
 
 
-def validate_record_v3_headers(board_name, cpu_model, bios_version):
-    validate_header_value(board_name, "board_name", "board name is invalid")
-    validate_header_value(cpu_model, "cpu_model", "cpu model is invalid")
-    validate_header_value(bios_version, "bios_version", "BIOS version is invalid")
+def insert_record(record):
+    """ Returns the id of the new record """
+    if PREPARED_INSERT_ENABLED:
+        return Record.insert_prepared(record)
+    return Record.create(**record).get_id()
 
 
-def collector_post_handler():
+def write_records(func):
+    # Every database write feeds the commit latency seen by admission control
+    start = time.time()
+    try:
+        with timed_write('insert'):
+            return func()
+    finally:
+        admission.observe(time.time() - start)
+        report_admission(admission)
+
+
+def already_stored_response():
+    # Retried events are acknowledged, but stored only once
+    resp = jsonify(message="Record already stored")
+    resp.status_code = 200
+    return resp
+
+
+def is_recent_event(record):
+    return Record.has_event_id(record) and record['event_id'] in recent_event_ids
 
-    # The collector only accepts records with the configured TID value.
-    # Make sure the TID in the collector config.py matches the TID
-    # configured for telemetrics-client on the systems from which this
-    # collector receives records.
-    tid_header = request.headers.get("X-Telemetry-TID")
-    validate_header_value(tid_header, "tid_header", "Telemetry ID mismatch")
-
-    record_format_version = request.headers.get("Record-Format-Version")
-    validate_header_value(record_format_version, "record_format_version", "Record-Format-Version is invalid")
-
-    record_format_version_headers_validation(record_format_version, request.headers)
-
-    severity = request.headers.get("Severity")
-    validate_header_value(severity, "severity", "severity value is out of range")
-
-    classification = request.headers.get("Classification")
-    validate_header_value(classification, "classification", "Classification value is invalid")
-
-    machine_id = request.headers.get("Machine-Id")
-    validate_header_value(machine_id, "machine_id", "Machine id value is invalid")
-
-    timestamp = request.headers.get("Creation-Timestamp")
-    validate_header_value(timestamp, "timestamp", "timestamp is invalid")
-
-    ts_capture = int(timestamp)
-    ts_reception = time.time()
-
-    architecture = request.headers.get("Arch")
-    validate_header_value(architecture, "architecture", "architecture is invalid")
-
-    host_type = request.headers.get("Host-Type")
-    validate_header_value(host_type, "host_type", "host type is invalid")
-
-    kernel_version = request.headers.get("Kernel-Version")
-    validate_header_value(kernel_version, "kernel_version", "kernel version is invalid")
-
-    # Record V3 format headers
-    board_name = "N/A"
-    cpu_model = "N/A"
-    bios_version = "N/A"
-    if record_format_version >= '3':
-        board_name = request.headers.get("Board-Name")
-        cpu_model = request.headers.get("Cpu-Model")
-        bios_version = request.headers.get("Bios-Version")
-        validate_record_v3_headers(board_name, cpu_model, bios_version)
-
-    # Record V4 format headers
-    event_id = "N/A"
-    if record_format_version >= '4':
-        event_id = request.headers.get("Event-Id")
-        validate_header_value(event_id, "event_id", "Event id is invalid")
-
-    os_name = request.headers.get('System-Name')
-    os_name = os_name.replace('"', '').replace("'", "")
-    build = request.headers.get('Build')
-    build = clean_build_n_value(build)
-    # The build number is stored as a string in the database, but if this
-    # record is from a Clear Linux OS system, only accept an integer.
-    # Otherwise, loosen the restriction to the characters listed for
-    # VERSION_ID in os-release(5) in addition to the capital letters A-Z.
-    if os_name == 'clear-linux-os':
-        build_regex = re.compile(r"^[0-9]+$")
-        if not build_regex.match(build):
-            raise InvalidUsage("Clear Linux OS build version has invalid characters")
-    else:
-        build_regex = re.compile(r"^[-_a-zA-Z0-9.]+$")
-        if not build_regex.match(build):
-            raise InvalidUsage("Build version has invalid characters")
 
-    payload_format_version = request.headers.get("Payload-Format-Version")
-    validate_header_value(payload_format_version, "payload_format_version",
-                          "Payload format version outside of range supported")
+def add_recent_events(records):
+    for record in records:
+        if Record.has_event_id(record):
+            recent_event_ids.add(record['event_id'])
 
-    external = request.headers.get('X-CLR-External')
-    if external and external == "true":
-        external = True
+
+def accepted_response():
+    # The record is stored, but it has no id yet
+    resp = jsonify(message="Record accepted")
+    resp.status_code = 202
+    return resp
+
+
+def get_response_mode(headers):
+    """ Returns the response mode for a created record and whether it was
+        asked for with a Prefer header (RFC 7240), which takes precedence
+        over COLLECTOR_RESPONSE_MODE """
+    for preference in headers.get('Prefer', '').split(','):
+        preference = preference.replace(' ', '').lower()
+        if preference == 'return=minimal':
+            return 'minimal', True
+        if preference == 'return=representation':
+            return 'representation', True
+    return app.config.get("COLLECTOR_RESPONSE_MODE", "representation"), False
+
+
+def created_response(record_id, record):
+    mode, preferred = get_response_mode(request.headers)
+    if mode == 'empty':
+        resp = app.response_class(status=204)
     else:
-        external = False
+        if mode == 'minimal':
+            resp = jsonify(id=record_id)
+        else:
+            resp = jsonify(Record.format_record(record_id, record))
+        resp.status_code = 201
+    if preferred:
+        resp.headers['Preference-Applied'] = 'return={}'.format(mode)
+    return resp
+
+
+def collector_post_handler():
+    data = read_body(request.stream, request.content_length, request.content_encoding, MAX_PAYLOAD_LEN)
+    record = get_record_from_headers(request.headers, decode_payload(data))
+    log_records([record])
+
+    if is_recent_event(record):
+        count_records([record], 'duplicate')
+        return already_stored_response()
+
+    if app.config.get("RATE_LIMIT_ENABLED", False):
+        retry_after = rate_limiter.check([record])[0]
+        if retry_after:
+            count_records([record], 'rejected')
+            raise InvalidUsage("Too many records, retry later", 429,
+                               headers={'Retry-After': get_retry_after(retry_after)}, reason="rate_limited")
+
+    if app.config.get("WRITE_BEHIND_ENABLED", False):
+        write_behind_buffer.append(record)
+        add_recent_events([record])
+        count_records([record], 'accepted')
+        return accepted_response()
 
     try:
-        # prefer UTF-8, if possible
-        payload = request.data.decode('utf-8')
-    except UnicodeError:
-        # fallback to Latin-1, since it accepts all byte values
-        payload = request.data.decode('latin-1')
+        if SPOOL_ENABLED:
+            record_id = write_records(lambda: spool_fallback.write(lambda: insert_record(record), [record]))
+        else:
+            record_id = write_records(lambda: insert_record(record))
+    except DuplicateRecordError:
+        add_recent_events([record])
+        count_records([record], 'duplicate')
+        return already_stored_response()
 
-    db_rec = Record.create(machine_id, host_type, severity, classification, build, architecture, kernel_version,
-                           record_format_version, ts_capture, ts_reception, payload_format_version, os_name,
-                           board_name, bios_version, cpu_model, event_id, external, payload)
+    add_recent_events([record])
+    if record_id is None:
+        count_records([record], 'accepted')
+        return accepted_response()
 
-    resp = jsonify(db_rec.to_dict())
-    resp.status_code = 201
-    return resp
+    count_records([record], 'created')
+    return created_response(record_id, record)
+
+
+def get_batch_entry_headers(entry):
+    """ Batch entries carry their headers in a JSON object, normalize the
+        names the same way the WSGI environ does for regular requests """
+    headers = entry.get('headers')
+    if not isinstance(headers, dict):
+        raise InvalidUsage("Batch entry headers are missing", reason="batch_entry_invalid")
+    return Headers([(str(k).replace('_', '-').title(), str(v)) for k, v in headers.items()])
+
+
+def collector_batch_post_handler():
+    """ Accepts a body of newline delimited JSON objects, one per record:
+
+        {"headers": {"Classification": "org.clearlinux/hello/world", ...}, "payload": "hello"}
+
+        Every entry is validated with the same rules as a single record POST,
+        valid entries are inserted with one statement and a status is
+        returned for each entry in the order they were received.
+    """
+    data = read_body(request.stream, request.content_length, request.content_encoding, MAX_BATCH_LEN)
+    lines = [line for line in data.splitlines() if line.strip()]
+    if not lines:
+        raise InvalidUsage("Batch request has no records", 400, reason="batch_empty")
+    if len(lines) > BATCH_MAX_RECORDS:
+        raise InvalidUsage("Batch request exceeds {} records".format(BATCH_MAX_RECORDS), 413, reason="batch_too_large")
+
+    statuses = []
+    records = []
+    for line in lines:
+        try:
+            entry = json.loads(decode_payload(line))
+            if not isinstance(entry, dict):
+                raise InvalidUsage("Batch entry is not a JSON object", reason="batch_entry_invalid")
+            payload = entry.get('payload', '')
+            if not isinstance(payload, str):
+                raise InvalidUsage("Batch entry payload is not a string", reason="batch_entry_invalid")
+            if len(payload) > MAX_PAYLOAD_LEN:
+                raise InvalidUsage("Payload exceeds {} bytes".format(MAX_PAYLOAD_LEN), 413, reason="payload_too_large")
+            record = get_record_from_headers(get_batch_entry_headers(entry), payload)
+            if is_recent_event(record):
+                count_records([record], 'duplicate')
+                statuses.append({'status': 200, 'message': "Record already stored"})
+                continue
+            records.append(record)
+            statuses.append({'status': 201})
+        except ValueError as e:
+            statuses.append({'status': 400, 'message': "Batch entry is not valid JSON, {}".format(e)})
+            count_failure(400, "batch_entry_invalid")
+        except InvalidUsage as e:
+            statuses.append({'status': e.status_code, 'message': e.message})
+
+    if app.config.get("RATE_LIMIT_ENABLED", False) and records:
+        admitted = []
+        retry_afters = iter(rate_limiter.check(records))
+        records = iter(records)
+        for status in statuses:
+            if status['status'] == 201:
+                record = next(records)
+                retry_after = next(retry_afters)
+                if retry_after:
+                    count_records([record], 'rejected')
+                    status.update({'status': 429, 'message': "Too many records, retry later",
+                                   'retry_after': get_retry_after(retry_after)})
+                else:
+                    admitted.append(record)
+        records = admitted
+
+    log_records(records)
+    ids = None
+    if app.config.get("WRITE_BEHIND_ENABLED", False):
+        for record in records:
+            write_behind_buffer.append(record)
+    elif SPOOL_ENABLED:
+        ids = write_records(lambda: spool_fallback.write(lambda: Record.create_many(records), records))
+    else:
+        ids = write_records(lambda: Record.create_many(records))
+
+    add_recent_events(records)
+    ids = iter(ids) if ids is not None else None
+    written = iter(records)
+    for status in statuses:
+        if status['status'] == 201:
+            record = next(written)
+            if ids is None:
+                count_records([record], 'accepted')
+                status['status'] = 202
+                continue
+            rid = next(ids)
+            if rid is None:
+                count_records([record], 'duplicate')
+                status.update({'status': 200, 'message': "Record already stored"})
+            else:
+                count_records([record], 'created')
+                status['id'] = rid
+
+    return jsonify(records=statuses)
 
 
 def validate_query_value(query_value, query_name, err_msg):
@@ -185,7 +377,7 @@ def validate_query_value(query_value, query_name, err_msg):
             return query_value
     except Exception as e:
         err_msg = "Error parsing {}, {}".format(query_name, e)
-    raise InvalidUsage(err_msg, 400)
+    raise InvalidUsage(err_msg, 400, reason="invalid_query")
 
 
 def get_records_api_handler():
@@ -219,6 +411,12 @@ def get_records_api_handler():
     from_id = request.args.get('from_id', None)
     if from_id is not None:
          validate_query_value(from_id, "id", "Provided record id value is invalid")
+         from_id = int(from_id)
+
+    cursor = request.args.get('cursor', None)
+    if cursor is not None:
+        cursor_id = decode_cursor(cursor)
+        from_id = cursor_id if from_id is None else min(from_id, cursor_id)
 
     ts_capture = request.args.get('ts_capture', None)
     if ts_capture is not None:
@@ -227,6 +425,15 @@ def get_records_api_handler():
     limit = request.args.get('limit', MAX_NUM_RECORDS)
     if limit != MAX_NUM_RECORDS:
         validate_query_value(limit, "limit", "Record limit value is invalid")
+    limit = int(limit)
+
+    ndjson = request.args.get('format') == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', '')
+
+    fields = get_fields(request.args.get('fields', None), request.args.get('metadata_only', None))
+    # The id of the last record makes the cursor
+    columns = [RECORD_FIELDS[f] for f in fields]
+    if 'id' not in fields:
+        columns.append('id')
 
     # Transform days interval to seconds
     if created_in_days is not None:
@@ -240,11 +447,108 @@ def get_records_api_handler():
     if interval_sec is not None and interval_sec > MAX_INTERVAL_SEC:
         interval_sec = MAX_INTERVAL_SEC
 
-    records = Record.query_records(build, classification, severity, machine_id, limit, interval_sec,
-                                   from_id=from_id, ts_capture=ts_capture)
-    record_list = [Record.to_dict(rec) for rec in records]
-
-    return jsonify(records=record_list)
+    records = Record.query_records(build, classification, severity, machine_id, limit=limit,
+                                   from_id=from_id, since=int(time.time()) - interval_sec,
+                                   ts_capture=int(ts_capture) if ts_capture is not None else None,
+                                   columns=columns)
+    # Rows are fetched from a server-side cursor as the response is sent
+    records = records.yield_per(API_STREAM_BATCH)
+    if ndjson:
+        return Response(stream_with_context(stream_records_ndjson(records, limit, fields)),
+                        mimetype='application/x-ndjson')
+    return Response(stream_with_context(stream_records_json(records, limit, fields)), mimetype='application/json')
+
+
+def get_fields(fields, metadata_only):
+    """ Fields of the records to return, all of them by default, all but
+        the payload in metadata only mode """
+    if fields is not None:
+        fields = [f.strip() for f in fields.split(',') if f.strip()]
+        unknown = [f for f in fields if f not in RECORD_FIELDS]
+        if unknown or not fields:
+            raise InvalidUsage("Fields value is invalid", 400, payload={'fields': unknown}, reason="invalid_query")
+        fields = [f for f in RECORD_FIELDS if f in fields]
+    else:
+        fields = list(RECORD_FIELDS)
+    if metadata_only is not None:
+        if metadata_only.lower() not in ('0', '1', 'false', 'true'):
+            raise InvalidUsage("Metadata only value is invalid", 400, reason="invalid_query")
+        if metadata_only.lower() in ('1', 'true'):
+            fields = [f for f in fields if f != 'payload']
+    return fields
+
+
+def conditional(view):
+    """ Answers 304 without running the query while the data version
+        matches the ETag or the Last-Modified time sent by the client """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version, modified = DataVersion.get_version(ETAG_MAX_AGE)
+        etag = werkzeug_http.generate_etag(version.encode('utf-8'))
+        last_modified = datetime.utcfromtimestamp(modified)
+        if werkzeug_http.is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = view(*args, **kwargs)
+        else:
+            response = Response(status=304)
+        response.cache_control.no_cache = True
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response
+    return wrapper
+
+
+def encode_cursor(record_id):
+    """ Opaque cursor of the page following record_id """
+    data = json.dumps({'id': record_id}).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode((cursor + '=' * (-len(cursor) % 4)).encode('ascii'))
+        return int(json.loads(data.decode('utf-8'))['id'])
+    except (ValueError, KeyError, TypeError):
+        raise InvalidUsage("Cursor value is invalid", 400, reason="invalid_query")
+
+
+def iter_batches(records, limit, fields):
+    """ Yields the records serialized by batches of API_STREAM_BATCH, then
+        the cursor of the next page, or None if this page is the last """
+    batch = []
+    count = 0
+    last_id = None
+    for rec in records:
+        batch.append(json.dumps(Record.format_fields(rec, fields)))
+        count += 1
+        last_id = rec.id
+        if len(batch) >= API_STREAM_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+    yield encode_cursor(last_id) if count == limit else None
+
+
+def stream_records_json(records, limit, fields):
+    """ {"records": [...], "next": cursor} """
+    yield '{"records": ['
+    first = True
+    for batch in iter_batches(records, limit, fields):
+        if not isinstance(batch, list):
+            yield '], "next": {}}}'.format(json.dumps(batch))
+            return
+        yield ('' if first else ', ') + ', '.join(batch)
+        first = False
+
+
+def stream_records_ndjson(records, limit, fields):
+    """ One record per line, then {"next": cursor} if there are more """
+    for batch in iter_batches(records, limit, fields):
+        if not isinstance(batch, list):
+            if batch is not None:
+                yield json.dumps({'next': batch}) + '\n'
+            return
+        yield '\n'.join(batch) + '\n'
 
 # ########## Routes ###########
 
@@ -253,12 +557,47 @@ def get_records_api_handler():
 @app.route("/v2/collector", methods=['GET', 'POST'])
 def handler():
     if request.method == 'POST':
-        return collector_post_handler()
+        with admitted_request():
+            return collector_post_handler()
     else:
         return redirect("/telemetryui", code=302)
 
 
+@app.route("/v2/collector/batch", methods=['POST'])
+def batch_handler():
+    with admitted_request():
+        return collector_batch_post_handler()
+
+
+def get_rate_limit_state():
+    enabled = app.config.get("RATE_LIMIT_ENABLED", False)
+    # The counters live in Redis, which only has to run with rate limiting
+    dropped = rate_limiter.get_dropped() if enabled else None
+    return {'enabled': enabled, 'dropped': dropped}
+
+
+@app.route("/v2/collector/status", methods=['GET'])
+def status_handler():
+    """ Admission state of the worker answering the request and records
+        dropped by the rate limiter of every worker """
+    state = admission.get_state()
+    state['enabled'] = app.config.get("ADMISSION_ENABLED", False)
+    return jsonify(admission=state, rate_limit=get_rate_limit_state())
+
+
+@app.route("/v2/collector/metrics", methods=['GET'])
+def metrics_handler():
+    """ Metrics of every worker in the Prometheus text format """
+    if not app.config.get("METRICS_ENABLED", True):
+        raise InvalidUsage("Metrics are disabled", 404, reason="metrics_disabled")
+    # The commit latency estimate decays between commits
+    report_admission(admission)
+    data, content_type = get_metrics()
+    return Response(data, content_type=content_type)
+
+
 @app.route("/api/records", methods=['GET'])
+@conditional
 def records_api_handler():
     """
     query filters for simple query:
@@ -268,8 +607,17 @@ def records_api_handler():
     machine_id
     created_in_days - records created after given days
     created_in_sec - records created after given seconds
+    ts_capture - records captured after given timestamp
+    limit - records per page
+    cursor - page following the page that returned this cursor
+    format - "ndjson" for one record per line
+    fields - comma separated fields of the records to return
+    metadata_only - "1" or "true" to leave out the payload
+
+    Responses carry an ETag and a Last-Modified time, the conditional
+    requests are answered with 304 while the records are unchanged.
 
-    TODO: Advanced query with pagination and following parameters?
+    TODO: Advanced query with following parameters?
     client_created_after - timestamp
     client_created_before - timestamp
     server_created_after - timestamp
@@ -0,0 +1,209 @@
+# Copyright (C) 2015-2020 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import json
+import time
+import fcntl
+import threading
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from . import app
+from .model import (
+    db,
+    Record)
+from .monitoring import timed_write
+
+SPOOL_ENABLED = app.config.get("SPOOL_ENABLED", False)
+SPOOL_REPLAY_INTERVAL = app.config.get("SPOOL_REPLAY_INTERVAL", 30)
+
+
+class Spool(object):
+    """ Append-only store for records that could not be written to the
+        database. Every worker appends to its own segment file, records
+        are written one JSON object per line and fsync'd before the client
+        gets an answer. A segment is locked while its writer has it open,
+        the replayer only loads segments it can lock. A segment is closed
+        once it holds segment_max_bytes or has been open for
+        segment_max_age seconds.
+    """
+
+    def __init__(self, path, segment_max_bytes, segment_max_age):
+        self.path = path
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_age = segment_max_age
+        self.lock = threading.Lock()
+        self.fd = None
+        self.pid = None
+        self.size = 0
+        self.opened = None
+
+    def append(self, records):
+        data = ''.join([json.dumps(r) + '\n' for r in records]).encode('utf-8')
+        with self.lock:
+            fd = self.open_segment()
+            os.write(fd, data)
+            os.fsync(fd)
+            self.size += len(data)
+            if self.size >= self.segment_max_bytes or self.is_expired():
+                self.close_segment()
+
+    def open_segment(self):
+        if self.fd is not None and self.pid == os.getpid():
+            return self.fd
+        # A forked worker must not share the segment of its parent
+        self.fd = None
+        os.makedirs(self.path, exist_ok=True)
+        name = "segment-{:020d}-{}.ndjson".format(time.time_ns(), os.getpid())
+        fd = os.open(os.path.join(self.path, name), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        # Make the new directory entry durable too
+        dir_fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        self.fd = fd
+        self.pid = os.getpid()
+        self.size = 0
+        self.opened = time.time()
+        return fd
+
+    def is_expired(self):
+        return self.fd is not None and time.time() - self.opened >= self.segment_max_age
+
+    def close_segment(self):
+        if self.fd is not None and self.pid == os.getpid():
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+        self.fd = None
+
+    def release(self, expired_only=False):
+        """ Closes the current segment so it can be replayed, with
+            expired_only only once it is segment_max_age seconds old """
+        with self.lock:
+            if not expired_only or self.is_expired():
+                self.close_segment()
+
+    def segments(self):
+        try:
+            names = sorted(os.listdir(self.path))
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.path, n) for n in names if n.startswith("segment-")]
+
+    def replay(self):
+        """ Loads every released segment into the records table, one COPY
+            per segment so a segment is either loaded completely or kept.
+            Returns the number of records stored.
+        """
+        count = 0
+        for segment in self.segments():
+            try:
+                fd = os.open(segment, os.O_RDONLY)
+            except FileNotFoundError:
+                # Replayed by another worker in the meantime
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Still being written
+                os.close(fd)
+                continue
+            try:
+                if not os.path.exists(segment):
+                    continue
+                records = []
+                with os.fdopen(os.dup(fd), 'rb') as f:
+                    for line in f:
+                        try:
+                            records.append(json.loads(line.decode('utf-8')))
+                        except ValueError:
+                            # A worker died halfway through a write
+                            app.logger.error("Skipping corrupted record in spool segment {}".format(segment))
+                with timed_write('replay'):
+                    # Events stored in the meantime are skipped
+                    count += Record.copy_many(records)
+                os.unlink(segment)
+            finally:
+                os.close(fd)
+        return count
+
+
+class SpoolFallback(object):
+    """ Writes to the database within a latency budget and falls back to
+        the spool when the write fails. After a failure the database is not
+        tried again for retry_interval seconds, so clients are answered
+        right away while the database is down.
+    """
+
+    def __init__(self, spool, latency_budget, retry_interval):
+        self.spool = spool
+        self.latency_budget = latency_budget
+        self.retry_interval = retry_interval
+        self.retry_at = 0
+
+    def is_db_available(self):
+        return time.time() >= self.retry_at
+
+    def write(self, func, records):
+        """ Returns the result of func, or None if records were spooled """
+        if self.is_db_available():
+            try:
+                if self.latency_budget:
+                    db.session.execute(text("SET LOCAL statement_timeout = {}".format(int(self.latency_budget * 1000))))
+                result = func()
+                # The database is healthy, let the replayer have the segment
+                self.spool.release()
+                return result
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                app.logger.error("Database write failed, spooling {} records".format(len(records)))
+                app.logger.error(e)
+                self.retry_at = time.time() + self.retry_interval
+        self.spool.append(records)
+        return None
+
+    def replay(self):
+        """ Releases the segment of this worker, right away once the
+            database is tried again or when it has expired while it is
+            down, and replays the released segments. Returns the number of
+            records replayed.
+        """
+        if not self.is_db_available():
+            self.spool.release(expired_only=True)
+            return 0
+        self.spool.release()
+        return self.spool.replay()
+
+
+spool = Spool(app.config.get("SPOOL_DIR", "spool"),
+              app.config.get("SPOOL_SEGMENT_MAX_BYTES", 16 * 1024 * 1024),
+              app.config.get("SPOOL_SEGMENT_MAX_AGE", 60))
+
+spool_fallback = SpoolFallback(spool,
+                               app.config.get("SPOOL_LATENCY_BUDGET", 2),
+                               app.config.get("SPOOL_RETRY_INTERVAL", 10))
+
+try:
+    from uwsgidecorators import timer
+
+    # Every worker runs the task to release its own segment, even when it
+    # does not get any more requests
+    @timer(SPOOL_REPLAY_INTERVAL, target='workers')
+    def replay_task(signum):
+        if SPOOL_ENABLED:
+            with app.app_context():
+                try:
+                    count = spool_fallback.replay()
+                    if count:
+                        app.logger.info("Replayed {} spooled records".format(count))
+                except Exception as e:
+                    app.logger.error("Spool replay failed")
+                    app.logger.error(e)
+
+except ImportError:
+        app.logger.info("Import error for uwsgidecorators")
+
+
+# vi: ts=4 et sw=4 sts=4
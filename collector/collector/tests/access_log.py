@@ -0,0 +1,111 @@
+#
+# Copyright 2015-2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import os
+import json
+import queue
+import random
+import logging
+import unittest
+import tempfile
+from collector import (
+    app,
+    log_requests)
+from collector.log_requests import (
+    AccessLog,
+    DroppingQueueHandler)
+from collector.tests.testcase import (
+    RecordTestCases,
+    get_record)
+
+
+class TestAccessLog(RecordTestCases):
+    """
+        Requests are sampled by classification and written as JSON lines
+    """
+
+    def setUp(self):
+        super(TestAccessLog, self).setUp()
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.log_dir.name, "access.log")
+        self.saved_access_log = log_requests.access_log
+        log_requests.access_log = AccessLog(self.filename, 1000)
+
+    def tearDown(self):
+        log_requests.access_log.stop()
+        log_requests.access_log = self.saved_access_log
+        self.log_dir.cleanup()
+        super(TestAccessLog, self).tearDown()
+
+    def get_entries(self):
+        log_requests.access_log.stop()
+        if not os.path.exists(self.filename):
+            return []
+        with open(self.filename) as f:
+            return [json.loads(line) for line in f]
+
+    def test_sampling_by_classification(self):
+        app.config["ACCESS_LOG_SAMPLING"] = {"default": 1.0, "org.clearlinux/hello/world": 0.0}
+        self.client.post('/', headers=get_record(), data='test')
+        self.assertEqual(self.get_entries(), [])
+
+    def test_sampling_rate(self):
+        app.config["ACCESS_LOG_SAMPLING"] = {"default": 0.25}
+        random.seed(0)
+        for _ in range(200):
+            self.client.post('/', headers=get_record(), data='test')
+        entries = self.get_entries()
+        self.assertTrue(20 <= len(entries) <= 80, len(entries))
+        self.assertTrue(all([e["sample_rate"] == 0.25 for e in entries]))
+
+    def test_errors_always_logged(self):
+        app.config["ACCESS_LOG_SAMPLING"] = {"default": 0.0}
+        rec = get_record()
+        rec['severity'] = 10
+        self.client.post('/', headers=rec, data='test')
+        entries = self.get_entries()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]["status"], 400)
+        self.assertIn("severity value is out of range", entries[0]["response"])
+
+    def test_payload_truncated(self):
+        app.config["ACCESS_LOG_PAYLOAD_MAX"] = 4
+        self.client.post('/', headers=get_record(), data='hello world')
+        entries = self.get_entries()
+        self.assertEqual(entries[0]["payload"], "hell")
+        self.assertEqual(entries[0]["classification"], "org.clearlinux/hello/world")
+
+    def test_payload_omitted(self):
+        app.config["ACCESS_LOG_PAYLOAD"] = "omit"
+        self.client.post('/', headers=get_record(), data='hello world')
+        self.assertIsNone(self.get_entries()[0]["payload"])
+
+    def test_queue_full_dropped(self):
+        handler = DroppingQueueHandler(queue.Queue(1))
+        for i in range(3):
+            handler.emit(logging.makeLogRecord({"msg": "line {}".format(i)}))
+        self.assertEqual(handler.dropped, 2)
+        self.assertEqual(handler.queue.get_nowait().getMessage(), "line 0")
+
+
+if __name__ == '__main__' and __package__ is None:
+    from os import sys, path
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    unittest.main()
+
+
+# vi: ts=4 et sw=4 sts=4
@@ -0,0 +1,70 @@
+#
+# Copyright 2015-2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import unittest
+from collector import app
+from collector import report_handler
+from collector.model import Record
+from collector.tests.testcase import (
+    RecordTestCases,
+    get_record_v4,)
+
+
+class TestAdmission(RecordTestCases):
+    """
+        Workers shed load with HTTP 503 while the database is slow
+    """
+
+    def setUp(self):
+        super(TestAdmission, self).setUp()
+        app.config["ADMISSION_ENABLED"] = True
+        report_handler.admission.latency = 0.0
+
+    def tearDown(self):
+        app.config["ADMISSION_ENABLED"] = False
+        report_handler.admission.latency = 0.0
+        super(TestAdmission, self).tearDown()
+
+    def test_post_admitted(self):
+        response = self.client.post('/', headers=get_record_v4(), data='')
+        self.assertTrue(response.status_code == 201, response.data.decode('utf-8'))
+        self.assertEqual(report_handler.admission.inflight, 0)
+
+    def test_post_rejected_on_slow_commits(self):
+        report_handler.admission.observe(1000)
+        response = self.client.post('/', headers=get_record_v4(), data='')
+        self.assertTrue(response.status_code == 503, response.data.decode('utf-8'))
+        self.assertTrue(int(response.headers.get('Retry-After')) >= 5)
+        self.assertEqual(Record.query.count(), 0)
+        self.assertEqual(report_handler.admission.inflight, 0)
+
+    def test_status(self):
+        report_handler.admission.observe(1000)
+        response = self.client.get('/v2/collector/status')
+        self.assertEqual(response.status_code, 200)
+        state = json.loads(response.data.decode('utf-8'))['admission']
+        self.assertTrue(state['enabled'])
+        self.assertTrue(state['overloaded'])
+
+
+if __name__ == '__main__' and __package__ is None:
+    from os import sys, path
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    unittest.main()
+
+
+# vi: ts=4 et sw=4 sts=4
@@ -16,6 +16,8 @@
 
 import json
 import unittest
+from collector import db
+from collector.model import Guilty
 from collector.tests.testcase import (
     RecordTestCases,
     get_record)
@@ -40,6 +42,78 @@ class TestHandler(RecordTestCases):
         resp_obj = json.loads(response.data.decode('utf-8'))
         self.assertEqual(len(resp_obj['records']), 0)
 
+    def test_query_pages(self):
+        for _ in range(3):
+            response = self.client.post('/', headers=get_record(), data='test')
+            self.assertTrue(response.status_code == 201)
+        response = self.client.get('/api/records', query_string={'limit': 2})
+        page = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(len(page['records']), 2)
+        self.assertIsNotNone(page['next'])
+        response = self.client.get('/api/records', query_string={'limit': 2, 'cursor': page['next']})
+        last_page = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(len(last_page['records']), 1)
+        self.assertIsNone(last_page['next'])
+        self.assertLess(last_page['records'][0]['id'], page['records'][-1]['id'])
+
+    def test_query_ndjson(self):
+        for _ in range(2):
+            self.client.post('/', headers=get_record(), data='test')
+        response = self.client.get('/api/records', query_string={'limit': 1, 'format': 'ndjson'})
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+        self.assertEqual(len(lines), 2)
+        self.assertIn('next', lines[-1])
+
+    def test_query_time_window(self):
+        self.client.post('/', headers=get_record(), data='test')
+        response = self.client.get('/api/records', query_string={'ts_capture': 2000000000})
+        self.assertEqual(len(json.loads(response.data.decode('utf-8'))['records']), 0)
+        response = self.client.get('/api/records', query_string={'created_in_sec': 3600})
+        self.assertEqual(len(json.loads(response.data.decode('utf-8'))['records']), 1)
+
+    def test_query_invalid_cursor(self):
+        response = self.client.get('/api/records', query_string={'cursor': 'not a cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_fields(self):
+        self.client.post('/', headers=get_record(), data='test')
+        response = self.client.get('/api/records', query_string={'fields': 'machine_id,ts_capture,build'})
+        rec = json.loads(response.data.decode('utf-8'))['records'][0]
+        self.assertEqual(list(rec.keys()), ['machine_id', 'build', 'ts_capture'])
+        self.assertTrue(rec['ts_capture'].endswith('UTC'))
+        response = self.client.get('/api/records', query_string={'fields': 'id,nope'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_metadata_only(self):
+        self.client.post('/', headers=get_record(), data='test')
+        response = self.client.get('/api/records', query_string={'metadata_only': 'true'})
+        rec = json.loads(response.data.decode('utf-8'))['records'][0]
+        self.assertNotIn('payload', rec)
+        self.assertIn('classification', rec)
+
+    def test_query_not_modified(self):
+        self.client.post('/', headers=get_record(), data='test')
+        response = self.client.get('/api/records')
+        etag = response.headers['ETag']
+        response = self.client.get('/api/records', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        response = self.client.get('/api/records', headers={'If-Modified-Since': response.headers['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+        self.client.post('/', headers=get_record(), data='test')
+        response = self.client.get('/api/records', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_query_guilty_modified(self):
+        self.client.post('/', headers=get_record(), data='test')
+        etag = self.client.get('/api/records').headers['ETag']
+        db.session.add(Guilty('func', 'mod'))
+        db.session.commit()
+        response = self.client.get('/api/records', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,84 @@
+#
+# Copyright 2015-2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+from collector.model import (
+    app,
+    Record)
+from collector.archive import RecordArchive
+from collector.tests.purging import get_insert_params
+from collector.tests.testcase import RecordTestCases
+
+
+class FailingArchive(object):
+
+    def write(self, rows):
+        raise OSError("No space left on device")
+
+
+class TestArchive(RecordTestCases):
+    """
+        Purged records are archived before they are deleted
+    """
+
+    def setUp(self):
+        RecordTestCases.setUp(self)
+        app.config["MAX_DAYS_KEEP_UNFILTERED_RECORDS"] = 5
+        app.config["PURGE_FILTERED_RECORDS"] = {}
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        RecordTestCases.tearDown(self)
+
+    def read_manifest(self):
+        with open(os.path.join(self.path, "manifest.ndjson")) as f:
+            return [json.loads(line) for line in f]
+
+    def test_archive_purged_records(self):
+        Record.create(*get_insert_params(6, 2, "test/archive/one"))
+        Record.create(*get_insert_params(6, 2, "test/archive/two"))
+        Record.create(*get_insert_params(2, 2, "test/archive/one"))
+        Record.delete_records(RecordArchive(self.path, 'gzip'))
+        self.assertEqual(Record.query.count(), 1)
+        manifest = self.read_manifest()
+        self.assertEqual(sorted([e['classification'] for e in manifest]), ["test/archive/one", "test/archive/two"])
+        for entry in manifest:
+            self.assertIn("classification=test%2Farchive%2F", entry['file'])
+            with gzip.open(os.path.join(self.path, entry['file']), 'rt') as f:
+                rows = [json.loads(line) for line in f]
+            self.assertEqual(len(rows), entry['records'])
+            self.assertEqual(rows[0]['classification'], entry['classification'])
+            self.assertEqual(rows[0]['payload'], "Test")
+
+    def test_records_kept_on_archive_failure(self):
+        Record.create(*get_insert_params(6, 2, "test/archive/one"))
+        Record.delete_records(FailingArchive())
+        self.assertEqual(Record.query.count(), 1)
+
+
+if __name__ == '__main__' and __package__ is None:
+    from os import sys, path
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    unittest.main()
+
+
+# vi: ts=4 et sw=4 sts=4
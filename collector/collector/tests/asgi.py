@@ -0,0 +1,94 @@
+#
+# Copyright 2015-2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import asyncio
+import unittest
+from collector import app
+from collector.asgi import (
+    application,
+    record_writer)
+from collector.model import Record
+from collector.tests.testcase import (
+    RecordTestCases,
+    get_record_v4,)
+
+
+async def call(method, path, headers, body):
+    """ Runs one request through the ASGI application """
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'headers': [(k.replace('_', '-').lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in headers.items()],
+    }
+    await record_writer.open(app.config['SQLALCHEMY_DATABASE_URI'], 1, 1)
+    try:
+        await application(scope, receive, send)
+    finally:
+        await record_writer.close()
+    return sent[0]['status'], sent[1]['body']
+
+
+def post(headers, body=b''):
+    status, body = asyncio.get_event_loop().run_until_complete(call('POST', '/v2/collector', headers, body))
+    return status, json.loads(body.decode('utf-8')) if body else None
+
+
+class TestAsgi(RecordTestCases):
+    """
+        The asyncio entrypoint stores records like the Flask application
+    """
+
+    def test_record_created(self):
+        status, json_resp = post(get_record_v4(), b'hello')
+        self.assertEqual(status, 201, json_resp)
+        records = Record.query.all()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].id, json_resp['id'])
+        self.assertEqual(records[0].payload, 'hello')
+
+    def test_duplicated_event(self):
+        status, json_resp = post(get_record_v4())
+        self.assertEqual(status, 201, json_resp)
+        status, json_resp = post(get_record_v4())
+        self.assertEqual(status, 200, json_resp)
+        self.assertEqual(Record.query.count(), 1)
+
+    def test_invalid_record(self):
+        headers = get_record_v4()
+        del headers['Event-Id']
+        status, json_resp = post(headers)
+        self.assertEqual(status, 400, json_resp)
+        self.assertEqual(Record.query.count(), 0)
+
+
+if __name__ == '__main__' and __package__ is None:
+    from os import sys, path
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    unittest.main()
+
+
+# vi: ts=4 et sw=4 sts=4
@@ -0,0 +1,72 @@
+#
+# Copyright 2015-2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import json
+from collector.model import Record
+from collector.tests.testcase import (
+    RecordTestCases,
+    severity,
+    get_record_v3,
+    get_record_v4,)
+
+
+def get_batch(*entries):
+    return '\n'.join([json.dumps({'headers': headers, 'payload': payload}) for headers, payload in entries])
+
+
+class TestBatchHandler(RecordTestCases):
+    """
+        Tests the batch endpoint, each entry is validated on its own
+    """
+
+    def test_batch_created(self):
+        data = get_batch((get_record_v3(), 'hello'), (get_record_v4(), 'world'))
+        response = self.client.post('/v2/collector/batch', data=data)
+        self.assertTrue(response.status_code == 200, response.data.decode('utf-8'))
+        json_resp = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(len(json_resp['records']), 2)
+        self.assertTrue(all([r['status'] == 201 for r in json_resp['records']]))
+        self.assertNotEqual(json_resp['records'][0]['id'], json_resp['records'][1]['id'])
+
+    def test_batch_ids_match_entries(self):
+        entries = [(get_record_v3(), 'payload {}'.format(i)) for i in range(20)]
+        response = self.client.post('/v2/collector/batch', data=get_batch(*entries))
+        json_resp = json.loads(response.data.decode('utf-8'))
+        for (_, payload), status in zip(entries, json_resp['records']):
+            self.assertEqual(Record.query.filter(Record.id == status['id']).one().payload, payload)
+
+    def test_batch_partial_failure(self):
+        invalid = get_record_v3()
+        invalid.update({severity: 9})
+        data = get_batch((get_record_v3(), 'hello'), (invalid, 'world'))
+        response = self.client.post('/v2/collector/batch', data=data + '\nnot json')
+        json_resp = json.loads(response.data.decode('utf-8'))
+        statuses = [r['status'] for r in json_resp['records']]
+        self.assertEqual(statuses, [201, 400, 400])
+
+    def test_batch_empty(self):
+        response = self.client.post('/v2/collector/batch', data='')
+        self.assertTrue(response.status_code == 400)
+
+
+if __name__ == '__main__' and __package__ is None:
+    from os import sys, path
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    unittest.main()
+
+
+# vi: ts=4 et sw=4 sts=4
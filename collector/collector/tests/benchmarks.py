@@ -0,0 +1,186 @@
+# Copyright (C) 2015-2020 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+    Micro-benchmarks for the collector hot path, run with:
+
+    python -m collector.tests.benchmarks
+
+    The insert benchmarks need the test database of the unit tests:
+
+    python -m collector.tests.benchmarks inserts
+"""
+
+import re
+import sys
+import time
+import string
+import timeit
+from werkzeug.test import EnvironBuilder
+from werkzeug.datastructures import EnvironHeaders
+from collector.lib.validation import (
+    validate_record_headers,
+    REQUIRED_HEADERS_V1,
+    REQUIRED_HEADERS_V2,
+    REQUIRED_HEADERS_V3,
+    REQUIRED_HEADERS_V4,
+    TELEMETRY_ID)
+from collector.tests.testcase import get_record_v4
+
+ITERATIONS = 20000
+INSERTS = 2000
+
+
+def get_request_headers():
+    # Same header object the collector sees for a real request
+    environ = EnvironBuilder(method='POST', headers=get_record_v4(), data='test').get_environ()
+    return EnvironHeaders(environ)
+
+
+# Header by header validation as it was before the schemas were compiled,
+# frozen here as the baseline of the benchmark
+
+def legacy_is_a_number(n):
+    return str(n).isdigit()
+
+
+def legacy_validate_kernel_version(kernel_version):
+    try:
+        version, major_revision, _ = str(kernel_version).split('.', maxsplit=2)
+        return all([legacy_is_a_number(x) for x in [version, major_revision]])
+    except ValueError:
+        return False
+
+
+def legacy_validate_x_header(header_value):
+    return header_value is not None and len(header_value) < 200 and all([x in string.printable for x in header_value])
+
+
+def legacy_validate_header(name, value):
+    return {
+        'tid_header': lambda v: v == TELEMETRY_ID,
+        'record_format_version': lambda v: all([v is not None, legacy_is_a_number(v)]) and int(v) in [1, 2, 3, 4],
+        'payload_format_version': lambda v: int(v) < 2147483647,
+        'severity': lambda v: legacy_is_a_number(v) and int(v) in [1, 2, 3, 4],
+        'classification': lambda v: v is not None and len(v.split('/')) == 3,
+        'machine_id': lambda v: v is not None and len(v) <= 32,
+        'timestamp': lambda v: all([v is not None, legacy_is_a_number(v)]),
+        'architecture': lambda v: v in ["armv7l", "armv6l", "aarch64", "amd64", "sparc64", "ppc64",
+                                        "i686", "i386", "x86_64", "ppc"],
+        'host_type': lambda v: v is not None and len(v) < 250,
+        'kernel_version': legacy_validate_kernel_version,
+        'board_name': legacy_validate_x_header,
+        'cpu_model': legacy_validate_x_header,
+        'bios_version': legacy_validate_x_header,
+        'event_id': lambda v: len(v) == 32 and len([c for c in v if c in "0123456789abcdef"]) == 32,
+    }.get(name, lambda x: False)(value)
+
+
+def legacy_validate_header_value(header_value, record_name, err_msg):
+    try:
+        if legacy_validate_header(record_name, header_value) is True:
+            return header_value
+    except Exception as e:
+        err_msg = "Error parsing {}, {}".format(record_name, e)
+    raise ValueError(err_msg)
+
+
+def legacy_validate_required_headers(record_format_version, headers):
+    reqs = {
+        '1': REQUIRED_HEADERS_V1,
+        '2': REQUIRED_HEADERS_V2,
+        '3': REQUIRED_HEADERS_V3,
+        '4': REQUIRED_HEADERS_V4,
+    }.get(record_format_version, None)
+    if reqs is None:
+        return False
+    req_headers_keys = dict(headers).keys()
+    for header in reqs:
+        if header not in req_headers_keys:
+            raise ValueError("Record-Format-Version headers are invalid, {} missing".format(header))
+    return True
+
+
+def validate_per_header(headers):
+    legacy_validate_header_value(headers.get("X-Telemetry-TID"), "tid_header", "Telemetry ID mismatch")
+    record_format_version = headers.get("Record-Format-Version")
+    legacy_validate_header_value(record_format_version, "record_format_version", "Record-Format-Version is invalid")
+    legacy_validate_required_headers(record_format_version, headers)
+    for name, header, err_msg in [('severity', 'Severity', "severity value is out of range"),
+                                  ('classification', 'Classification', "Classification value is invalid"),
+                                  ('machine_id', 'Machine-Id', "Machine id value is invalid"),
+                                  ('timestamp', 'Creation-Timestamp', "timestamp is invalid"),
+                                  ('architecture', 'Arch', "architecture is invalid"),
+                                  ('host_type', 'Host-Type', "host type is invalid"),
+                                  ('kernel_version', 'Kernel-Version', "kernel version is invalid")]:
+        legacy_validate_header_value(headers.get(header), name, err_msg)
+    int(headers.get("Creation-Timestamp"))
+    if record_format_version >= '3':
+        legacy_validate_header_value(headers.get("Board-Name"), "board_name", "board name is invalid")
+        legacy_validate_header_value(headers.get("Cpu-Model"), "cpu_model", "cpu model is invalid")
+        legacy_validate_header_value(headers.get("Bios-Version"), "bios_version", "BIOS version is invalid")
+    if record_format_version >= '4':
+        legacy_validate_header_value(headers.get("Event-Id"), "event_id", "Event id is invalid")
+    os_name = headers.get('System-Name').replace('"', '').replace("'", "")
+    build = headers.get('Build').replace('"', '').replace("'", "")
+    if os_name == 'clear-linux-os':
+        if not re.compile(r"^[0-9]+$").match(build):
+            raise ValueError("Clear Linux OS build version has invalid characters")
+    elif not re.compile(r"^[-_a-zA-Z0-9.]+$").match(build):
+        raise ValueError("Build version has invalid characters")
+    legacy_validate_header_value(headers.get("Payload-Format-Version"), "payload_format_version",
+                                 "Payload format version outside of range supported")
+
+
+def report(name, seconds):
+    print("{:<40} {:>8.2f} us/request".format(name, seconds / ITERATIONS * 1e6))
+
+
+def time_inserts(insert, first_event):
+    """ Returns the wall clock and CPU seconds of INSERTS inserts, each
+        record has its own event """
+    record = validate_record_headers(get_request_headers())
+    record.update({'ts_reception': time.time(), 'payload': 'test'})
+    records = [dict(record, event_id='{:032x}'.format(first_event + i)) for i in range(INSERTS)]
+    wall, cpu = time.time(), time.process_time()
+    for rec in records:
+        insert(rec)
+    return time.time() - wall, time.process_time() - cpu
+
+
+def report_inserts(name, seconds):
+    wall, cpu = seconds
+    print("{:<40} {:>8.2f} us/record, {:>8.2f} us CPU/record".format(
+        name, wall / INSERTS * 1e6, cpu / INSERTS * 1e6))
+
+
+def benchmark_inserts():
+    from collector import app, db
+    from collector.model import Record
+    app.config.from_object('collector.config_local.Testing')
+    with app.app_context():
+        db.create_all()
+        try:
+            # Warm up the pool, the dimension cache and the prepared statements
+            time_inserts(Record.insert_prepared, 10 * INSERTS)
+            report_inserts("insert with the ORM", time_inserts(lambda r: Record.create(**r).get_id(), 0))
+            report_inserts("insert with prepared statements", time_inserts(Record.insert_prepared, INSERTS))
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+def main():
+    if sys.argv[1:] == ['inserts']:
+        benchmark_inserts()
+        return
+    headers = get_request_headers()
+    report("validate per header", timeit.timeit(lambda: validate_per_header(headers), number=ITERATIONS))
+    report("validate compiled schema", timeit.timeit(lambda: validate_record_headers(headers), number=ITERATIONS))
+
+
+if __name__ == '__main__':
+    main()
+
+
+# vi: ts=4 et sw=4 sts=4
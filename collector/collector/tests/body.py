@@ -0,0 +1,67 @@
+#
+# Copyright 2015-2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import gzip
+import json
+import unittest
+from collector.tests.testcase import (
+    RecordTestCases,
+    get_record_v4,)
+
+
+class TestRequestBody(RecordTestCases):
+    """
+        Tests compressed request bodies and body size limits
+    """
+
+    def test_gzip_payload(self):
+        headers = get_record_v4()
+        headers.update({'Content-Encoding': 'gzip'})
+        response = self.client.post('/', headers=headers, data=gzip.compress(b'hello'))
+        self.assertTrue(response.status_code == 201, response.data.decode('utf-8'))
+        json_resp = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_resp['payload'], 'hello')
+
+    def test_corrupted_gzip_payload(self):
+        headers = get_record_v4()
+        headers.update({'Content-Encoding': 'gzip'})
+        response = self.client.post('/', headers=headers, data=b'hello')
+        self.assertTrue(response.status_code == 400)
+
+    def test_unsupported_encoding(self):
+        headers = get_record_v4()
+        headers.update({'Content-Encoding': 'br'})
+        response = self.client.post('/', headers=headers, data=b'hello')
+        self.assertTrue(response.status_code == 415)
+
+    def test_payload_too_large(self):
+        response = self.client.post('/', headers=get_record_v4(), data=b'x' * (300 * 1024 + 1))
+        self.assertTrue(response.status_code == 413)
+
+    def test_decompressed_payload_too_large(self):
+        headers = get_record_v4()
+        headers.update({'Content-Encoding': 'gzip'})
+        response = self.client.post('/', headers=headers, data=gzip.compress(b'x' * (300 * 1024 + 1)))
+        self.assertTrue(response.status_code == 413)
+
+
+if __name__ == '__main__' and __package__ is None:
+    from os import sys, path
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    unittest.main()
+
+
+# vi: ts=4 et sw=4 sts=4
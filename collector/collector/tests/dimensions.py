@@ -0,0 +1,90 @@
+#
+# Copyright 2015-2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+from collector.model import (
+    dimension_cache,
+    Build,
+    Classification,
+    Record)
+from collector.tests.testcase import (
+    RecordTestCases,
+    classification,
+    build,
+    system_name,
+    get_record_v3,)
+
+
+class TestDimensions(RecordTestCases):
+    """
+        Repeated record attributes are stored once in their own tables
+    """
+
+    def post(self, **values):
+        headers = get_record_v3()
+        headers.update(values)
+        response = self.client.post('/', headers=headers, data='test')
+        self.assertTrue(response.status_code == 201, response.data.decode('utf-8'))
+
+    def test_values_stored_once(self):
+        self.post()
+        self.post()
+        self.post(**{classification: 'a/b/d'})
+        self.assertEqual(Record.query.count(), 3)
+        self.assertEqual(Build.query.count(), 1)
+        self.assertEqual(sorted([c.classification for c in Classification.query.all()]), ['a/b/c', 'a/b/d'])
+        record = Record.query.first()
+        self.assertEqual(record.build, get_record_v3()[build])
+
+    def test_value_filters(self):
+        self.post()
+        self.post(**{classification: 'a/b/d'})
+        self.assertEqual(Record.query.filter(Record.classification == 'a/b/d').count(), 1)
+        self.assertEqual(Record.query.filter(Record.classification.like('a/b/%')).count(), 2)
+        self.assertEqual(Record.query.filter(~Record.classification.like('a/b/c')).count(), 1)
+        self.assertEqual(Record.query.filter(Record.classification.in_(['a/b/c', 'x/y/z'])).count(), 1)
+
+    def test_list_of_values(self):
+        self.post()
+        self.post(**{classification: 'a/b/d'})
+        self.assertEqual(sorted([c[0] for c in Record.get_classifications()]), ['a/b/c', 'a/b/d'])
+        self.assertEqual(Record.get_os_map(), {'clear-linux-os': [get_record_v3()[build]]})
+
+    def test_cache_insert_on_miss(self):
+        dimension_cache.clear()
+        build_id = dimension_cache.get_id(Build, '31000')
+        self.assertEqual(dimension_cache.get_id(Build, '31000'), build_id)
+        self.assertEqual(Build.query.filter_by(build='31000').first().id, build_id)
+
+    def test_build_number(self):
+        self.post(**{build: '9'})
+        self.post(**{build: '31000'})
+        self.post(**{build: '31000'})
+        # Only Clear Linux OS builds must be numbers
+        self.post(**{build: 'master', system_name: 'other-os'})
+        self.assertEqual(Build.query.filter_by(build='31000').first().build_number, 31000)
+        self.assertIsNone(Build.query.filter_by(build='master').first().build_number)
+        self.assertEqual([b[0] for b in Record.get_builds()], ['31000', '9'])
+        self.assertEqual([tuple(b) for b in Record.get_recordcnts_by_build()], [('9', 1), ('31000', 2)])
+
+
+if __name__ == '__main__' and __package__ is None:
+    from os import sys, path
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    unittest.main()
+
+
+# vi: ts=4 et sw=4 sts=4
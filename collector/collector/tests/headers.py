@@ -16,6 +16,8 @@
 
 import unittest
 import json
+from collector import app
+from collector import report_handler
 from collector.tests.testcase import (
     RecordTestCases,
     classification,
@@ -163,6 +165,35 @@ class TestHandlerRecordV4(RecordTestCases):
     def test_post_missing_eid(self):
        self.missing_header('Event-Id', event_id)
 
+    def test_post_duplicated_event(self):
+       headers = get_record_v4()
+       response = self.client.post('/', headers=headers, data='test')
+       self.assertTrue(response.status_code == 201, response.data.decode('utf-8'))
+       response = self.client.post('/', headers=headers, data='test')
+       self.assertTrue(response.status_code == 200, response.data.decode('utf-8'))
+       # Not answered from the recent events of this worker
+       report_handler.recent_event_ids.clear()
+       response = self.client.post('/', headers=headers, data='test')
+       self.assertTrue(response.status_code == 200, response.data.decode('utf-8'))
+
+    def test_post_prefer_minimal(self):
+       headers = get_record_v4()
+       headers['Prefer'] = 'return=minimal'
+       response = self.client.post('/', headers=headers, data='test')
+       self.assertTrue(response.status_code == 201, response.data.decode('utf-8'))
+       self.assertEqual(response.headers.get('Preference-Applied'), 'return=minimal')
+       json_resp = json.loads(response.data.decode('utf-8'))
+       self.assertEqual(list(json_resp.keys()), ['id'])
+
+    def test_post_response_mode_empty(self):
+       app.config["COLLECTOR_RESPONSE_MODE"] = "empty"
+       try:
+           response = self.client.post('/', headers=get_record_v4(), data='test')
+       finally:
+           app.config["COLLECTOR_RESPONSE_MODE"] = "representation"
+       self.assertTrue(response.status_code == 204, response.data.decode('utf-8'))
+       self.assertEqual(response.data, b'')
+
 
 if __name__ == '__main__' and __package__ is None:
     from os import sys, path
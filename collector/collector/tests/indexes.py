@@ -0,0 +1,107 @@
+#
+# Copyright 2015-2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from collector import db
+from collector.model import (
+    Build,
+    Classification,
+    Guilty,
+    Record)
+from collector.tests.testcase import RecordTestCases
+
+# The queries of the processing job
+LAST_PROCESSED = """
+  SELECT MAX(id) AS last_id FROM records WHERE processed = True
+"""
+
+CRASHES = """
+  SELECT r.id, c.classification FROM records r
+  JOIN classifications c ON c.id = r.classification_id
+  WHERE c.classification in ('org.clearlinux/crash/clr') AND r.id > 100 ORDER BY r.id ASC
+"""
+
+
+def get_scans(plan):
+    """ Returns the node type and relation of every scan in a plan """
+    scans = []
+    if 'Relation Name' in plan:
+        scans.append((plan['Node Type'], plan['Relation Name']))
+    for child in plan.get('Plans', []):
+        scans.extend(get_scans(child))
+    return scans
+
+
+class TestIndexes(RecordTestCases):
+    """
+        The queries of the apps read the records through an index
+    """
+
+    def explain(self, query):
+        # The tables are empty, make any usable index cheaper than a scan
+        db.session.execute(text("SET LOCAL enable_seqscan = off"))
+        if isinstance(query, str):
+            sql, params = query, {}
+        else:
+            stmt = query.statement.compile(dialect=postgresql.dialect())
+            sql, params = str(stmt), stmt.params
+        plan = db.session.connection().execute("EXPLAIN (FORMAT JSON) " + sql, params).scalar()
+        return get_scans(plan[0]['Plan'])
+
+    def assertIndexScans(self, query):
+        scans = [s for s in self.explain(query) if s[1].startswith('records')]
+        self.assertTrue(scans)
+        for node_type, relation in scans:
+            self.assertNotEqual(node_type, 'Seq Scan', relation)
+
+    def test_query_records_machine_id(self):
+        self.assertIndexScans(Record.query_records(None, None, None, 'clr-linux-avj01', limit=10))
+
+    def test_filter_records_classification(self):
+        self.assertIndexScans(Record.filter_records(None, 'org.clearlinux/crash/%', None, limit=10))
+
+    def test_filter_records_dates(self):
+        self.assertIndexScans(Record.filter_records(None, None, None, from_date='2020-06-01', to_date='2020-06-08'))
+
+    def test_guilty_records(self):
+        q = db.session.query(Build.build, Record.machine_id, db.func.count(Record.id))
+        q = q.join(Record, Record.build_id == Build.id)
+        q = q.filter(Record.guilty_id == 1)
+        q = q.group_by(Build.build, Record.machine_id)
+        self.assertIndexScans(q)
+
+    def test_top_crash_guilties(self):
+        q = db.session.query(Guilty.function, Guilty.module, db.func.count(Record.id))
+        q = q.join(Record, Record.guilty_id == Guilty.id)
+        q = q.join(Classification, Classification.id == Record.classification_id)
+        q = q.filter(Classification.classification == 'org.clearlinux/crash/clr')
+        q = q.group_by(Guilty.function, Guilty.module)
+        self.assertIndexScans(q)
+
+    def test_processing_queries(self):
+        self.assertIndexScans(LAST_PROCESSED)
+        self.assertIndexScans(CRASHES)
+
+
+if __name__ == '__main__' and __package__ is None:
+    from os import sys, path
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    unittest.main()
+
+
+# vi: ts=4 et sw=4 sts=4
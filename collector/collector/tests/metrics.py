@@ -0,0 +1,72 @@
+#
+# Copyright 2015-2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+from collector import report_handler
+from collector.metrics import prometheus_client
+from collector.tests.testcase import (
+    RecordTestCases,
+    get_record)
+
+
+@unittest.skipIf(prometheus_client is None, "prometheus_client is not installed")
+class TestMetrics(RecordTestCases):
+
+    def get_metrics(self):
+        response = self.client.get('/v2/collector/metrics')
+        self.assertEqual(response.status_code, 200)
+        return response.data.decode('utf-8')
+
+    def test_records_counted(self):
+        rec = get_record()
+        self.client.post('/', headers=rec, data='test')
+        metrics = self.get_metrics()
+        self.assertIn('collector_records_total{{classification="{}",record_version="{}",result="created"}}'.format(
+            rec['classification'], rec['record_format_version']), metrics)
+        self.assertIn('collector_db_write_seconds_count{operation="insert"}', metrics)
+
+    def test_validation_failures_counted(self):
+        rec = get_record()
+        rec['severity'] = 10
+        response = self.client.post('/', headers=rec, data='test')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('reason="invalid_severity"', self.get_metrics())
+
+    def test_reasons_fixed(self):
+        # The value in the message of the failure is not a label
+        response = self.client.get('/api/records?limit=client-value')
+        self.assertEqual(response.status_code, 400)
+        metrics = self.get_metrics()
+        self.assertIn('reason="invalid_query"', metrics)
+        self.assertNotIn('client-value', metrics)
+
+    def test_admission_reported(self):
+        report_handler.admission.observe(1000)
+        try:
+            metrics = self.get_metrics()
+        finally:
+            report_handler.admission.latency = 0.0
+        self.assertIn('collector_admission_overloaded 1.0', metrics)
+        self.assertIn('collector_admission_inflight 0.0', metrics)
+
+
+if __name__ == '__main__' and __package__ is None:
+    from os import sys, path
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    unittest.main()
+
+
+# vi: ts=4 et sw=4 sts=4
@@ -0,0 +1,95 @@
+#
+# Copyright 2015-2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import time
+import unittest
+from collector import (
+    app,
+    report_handler,)
+from collector.model import (
+    Record,
+    RecordEvent,
+    RecordPurge,
+    get_partition,
+    EVENT_ID_RETENTION_DAYS)
+from collector.tests.testcase import (
+    RecordTestCases,
+    get_record_v4,)
+
+# 2020-06-15 12:00:00 UTC
+NOW = 1592222400
+
+
+class TestPartitions(RecordTestCases):
+    """
+        Records are stored in partitions of their reception time
+    """
+
+    def test_get_partition(self):
+        self.assertEqual(get_partition(NOW, "month"), ("records_p202006", 1590969600, 1593561600))
+        self.assertEqual(get_partition(NOW, "day"), ("records_p20200615", 1592179200, 1592265600))
+
+    def test_ensure_partitions(self):
+        created = Record.ensure_partitions(NOW)
+        self.assertEqual(created, ["records_p202006", "records_p202007", "records_p202008", "records_p202009"])
+        self.assertEqual(Record.ensure_partitions(NOW), [])
+        self.assertEqual([p[0] for p in Record.get_partitions()], created)
+
+    def test_drop_partitions(self):
+        Record.ensure_partitions(NOW)
+        dropped = Record.drop_partitions(1593561600)
+        self.assertEqual(dropped, ["records_p202006"])
+        self.assertEqual(len(Record.get_partitions()), 3)
+
+    def test_duplicate_event_across_partitions(self):
+        Record.ensure_partitions()
+        headers = get_record_v4()
+        for status in (201, 200):
+            # Skip the in-memory check, the event is found in record_events
+            report_handler.recent_event_ids.clear()
+            response = self.client.post('/', headers=headers, data='test')
+            self.assertEqual(response.status_code, status, response.data.decode('utf-8'))
+        self.assertEqual(Record.query.count(), 1)
+        self.assertEqual(RecordEvent.query.count(), 1)
+
+    def test_old_events_dropped(self):
+        self.client.post('/', headers=get_record_v4(), data='test')
+        self.assertEqual(RecordEvent.purge(time.time() - 60), 0)
+        self.assertEqual(RecordEvent.purge(time.time() + 1), 1)
+        self.assertEqual(RecordEvent.query.count(), 0)
+        self.assertEqual(Record.query.count(), 1)
+
+    def test_events_purged_with_records_kept(self):
+        config = {k: app.config.get(k) for k in ("MAX_DAYS_KEEP_UNFILTERED_RECORDS", "PURGE_FILTERED_RECORDS")}
+        # Records are kept forever, no partition is ever dropped
+        app.config.update(MAX_DAYS_KEEP_UNFILTERED_RECORDS=0, PURGE_FILTERED_RECORDS={})
+        try:
+            self.client.post('/', headers=get_record_v4(), data='test')
+            purge = RecordPurge(RecordPurge.get_rules(), 1000, 0)
+            purge.run(time.time() + EVENT_ID_RETENTION_DAYS * 24 * 60 * 60 + 1)
+            self.assertEqual(RecordEvent.query.count(), 0)
+            self.assertEqual(Record.query.count(), 1)
+        finally:
+            app.config.update(config)
+
+
+if __name__ == '__main__' and __package__ is None:
+    from os import sys, path
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    unittest.main()
+
+
+# vi: ts=4 et sw=4 sts=4
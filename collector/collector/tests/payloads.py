@@ -0,0 +1,73 @@
+#
+# Copyright 2015-2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+from collector.model import (
+    Payload,
+    Record)
+from collector.tests.testcase import (
+    RecordTestCases,
+    get_record_v3,)
+
+LONG_PAYLOAD = "Backtrace (TID 1234):\n" + "#0 frame_function() - [/usr/lib64/libfoo.so.1]\n" * 10
+
+
+class TestPayloads(RecordTestCases):
+    """
+        Long payloads are stored once and resolved transparently
+    """
+
+    def test_long_payload_deduplicated(self):
+        for _ in range(2):
+            response = self.client.post('/', headers=get_record_v3(), data=LONG_PAYLOAD)
+            self.assertTrue(response.status_code == 201, response.data.decode('utf-8'))
+        self.assertEqual(Payload.query.count(), 1)
+        records = Record.query.all()
+        self.assertEqual(len(records), 2)
+        for record in records:
+            self.assertIsNone(record.payload_inline)
+            self.assertEqual(record.payload, LONG_PAYLOAD)
+            self.assertEqual(record.to_dict()['payload'], LONG_PAYLOAD)
+
+    def test_short_payload_inline(self):
+        response = self.client.post('/', headers=get_record_v3(), data='hello')
+        self.assertTrue(response.status_code == 201, response.data.decode('utf-8'))
+        self.assertEqual(Payload.query.count(), 0)
+        record = Record.query.first()
+        self.assertEqual(record.payload_inline, 'hello')
+        self.assertEqual(record.payload, 'hello')
+
+    def test_payload_filter(self):
+        self.client.post('/', headers=get_record_v3(), data=LONG_PAYLOAD)
+        self.client.post('/', headers=get_record_v3(), data='hello')
+        records = Record.query_records(None, None, None, None, payload='frame_function').all()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].payload, LONG_PAYLOAD)
+
+    def test_unreferenced_payload_deleted(self):
+        self.client.post('/', headers=get_record_v3(), data=LONG_PAYLOAD)
+        Record.query.delete()
+        self.assertEqual(Payload.delete_unreferenced(), 1)
+        self.assertEqual(Payload.query.count(), 0)
+
+
+if __name__ == '__main__' and __package__ is None:
+    from os import sys, path
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    unittest.main()
+
+
+# vi: ts=4 et sw=4 sts=4
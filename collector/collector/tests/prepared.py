@@ -0,0 +1,85 @@
+#
+# Copyright 2015-2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import time
+import unittest
+from werkzeug.test import EnvironBuilder
+from werkzeug.datastructures import EnvironHeaders
+from collector.model import (
+    db,
+    DuplicateRecordError,
+    Payload,
+    Record)
+from collector.lib.validation import validate_record_headers
+from collector.tests.payloads import LONG_PAYLOAD
+from collector.tests.testcase import (
+    RecordTestCases,
+    get_record_v4,)
+
+
+def get_create_args(payload='hello'):
+    environ = EnvironBuilder(method='POST', headers=get_record_v4(), data=payload).get_environ()
+    record = validate_record_headers(EnvironHeaders(environ))
+    record.update({'ts_reception': time.time(), 'payload': payload})
+    return record
+
+
+class TestPreparedInsert(RecordTestCases):
+    """
+        Records inserted with prepared statements are stored as Record.create
+        stores them
+    """
+
+    def test_insert_prepared(self):
+        record = get_create_args()
+        record_id = Record.insert_prepared(record)
+        stored = Record.query.get((record_id, int(record['ts_reception'])))
+        self.assertEqual(stored.classification, record['classification'])
+        self.assertEqual(stored.build, record['build'])
+        self.assertEqual(stored.payload, 'hello')
+        self.assertEqual(stored.event_id, record['event_id'])
+        self.assertFalse(stored.processed)
+
+    def test_insert_prepared_long_payload(self):
+        Record.insert_prepared(get_create_args(LONG_PAYLOAD))
+        self.assertEqual(Payload.query.count(), 1)
+        self.assertEqual(Record.query.first().payload, LONG_PAYLOAD)
+
+    def test_insert_prepared_duplicate(self):
+        record = get_create_args()
+        Record.insert_prepared(record)
+        with self.assertRaises(DuplicateRecordError):
+            Record.insert_prepared(record)
+        # The connection prepares its statements again if it needs to
+        Record.insert_prepared(dict(record, event_id='0' * 32))
+        self.assertEqual(Record.query.count(), 2)
+
+    def test_statements_prepared_once(self):
+        record = get_create_args()
+        Record.insert_prepared(record)
+        Record.insert_prepared(dict(record, event_id='0' * 32))
+        # The event and the record inserts, the short payload is inline
+        names = [r[0] for r in db.session.execute("SELECT name FROM pg_prepared_statements")]
+        self.assertEqual(len([n for n in names if n.startswith('telemetry_')]), 2)
+
+
+if __name__ == '__main__' and __package__ is None:
+    from os import sys, path
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    unittest.main()
+
+
+# vi: ts=4 et sw=4 sts=4
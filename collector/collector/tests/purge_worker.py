@@ -0,0 +1,91 @@
+#
+# Copyright 2015-2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+from collector.model import (
+    app,
+    Record)
+from collector.purge_worker import (
+    PurgeThrottle,
+    purge_lock,
+    run_purge)
+from collector.tests.purging import get_insert_params
+from collector.tests.testcase import RecordTestCases
+
+
+class LaggingThrottle(PurgeThrottle):
+
+    def __init__(self, lags, *args):
+        PurgeThrottle.__init__(self, *args)
+        self.lags = lags
+        self.sleeps = []
+
+    def get_replication_lag(self):
+        return self.lags.pop(0) if self.lags else 0.0
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.paused += seconds
+
+
+class TestPurgeWorker(RecordTestCases):
+    """
+        Standalone purge worker
+    """
+
+    def setUp(self):
+        RecordTestCases.setUp(self)
+        app.config["MAX_DAYS_KEEP_UNFILTERED_RECORDS"] = 5
+        app.config["PURGE_FILTERED_RECORDS"] = {}
+
+    def test_run_purge(self):
+        Record.create(*get_insert_params(6, 2, "test/test/one"))
+        Record.create(*get_insert_params(2, 2, "test/test/one"))
+        summary = run_purge(vacuum_tables=False)
+        self.assertEqual(summary['deleted'], 1)
+        self.assertTrue(summary['complete'])
+        self.assertEqual(Record.query.count(), 1)
+
+    def test_single_purge(self):
+        Record.create(*get_insert_params(6, 2, "test/test/one"))
+        with purge_lock() as locked:
+            self.assertTrue(locked)
+            self.assertIsNone(run_purge(vacuum_tables=False))
+        self.assertEqual(Record.query.count(), 1)
+
+    def test_throttle_latency(self):
+        throttle = LaggingThrottle([], 0, 1, 5, 10)
+        throttle.wait(0.5)
+        self.assertEqual(throttle.sleeps, [])
+        throttle.wait(3)
+        self.assertEqual(throttle.sleeps, [3])
+
+    def test_throttle_replication_lag(self):
+        throttle = LaggingThrottle([60, 45, 10], 30, 0, 5, 10)
+        throttle.wait(0.5)
+        self.assertEqual(throttle.sleeps, [5, 5])
+        throttle = LaggingThrottle([60, 60, 60, 60], 30, 0, 5, 10)
+        throttle.wait(0.5)
+        self.assertEqual(throttle.paused, 10)
+
+
+if __name__ == '__main__' and __package__ is None:
+    from os import sys, path
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    unittest.main()
+
+
+# vi: ts=4 et sw=4 sts=4
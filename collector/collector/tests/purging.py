@@ -21,8 +21,10 @@ from flask import current_app
 from collector.model import (
     app,
     Record,
+    RecordPurge,
     Classification,
-    Build)
+    Build,
+    dimension_cache)
 
 from collector.tests.testcase import (
     RecordTestCases,
@@ -83,6 +85,8 @@ class TestPurging(RecordTestCases):
         self.app_context.push()
         db.init_app(current_app)
         db.create_all()
+        # The ids of the dimension tables dropped by the previous test
+        dimension_cache.clear()
         self.client = app.test_client()
 
     def test_purge_delete(self):
@@ -108,6 +112,24 @@ class TestPurging(RecordTestCases):
         Record.delete_records()
         self.assertTrue(len(Record.query.all()) == 3)
 
+    def test_purge_chunks(self):
+        app.config["PURGE_CHUNK_SIZE"] = 2
+        for _ in range(5):
+            Record.create(*get_insert_params(6, 2, "test/test/one"))
+        Record.create(*get_insert_params(2, 2, "test/test/one"))
+        stats = {s['rule']: s for s in Record.delete_records()}
+        self.assertEqual(Record.query.count(), 1)
+        self.assertEqual(stats['old']['deleted'], 5)
+        self.assertEqual(stats['old']['chunks'], 3)
+        self.assertTrue(stats['old']['complete'])
+
+    def test_purge_time_budget(self):
+        Record.create(*get_insert_params(6, 2, "test/test/one"))
+        purge = RecordPurge(RecordPurge.get_rules(), 1, 1)
+        stats = purge.run(time.time() - 10)
+        self.assertTrue(Record.query.count() == 1)
+        self.assertFalse(stats[-1]['complete'])
+
 
 if __name__ == '__main__' and __package__ is None:
     from os import sys, path
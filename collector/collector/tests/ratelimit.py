@@ -0,0 +1,145 @@
+#
+# Copyright 2015-2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import json
+import uuid
+import unittest
+from collector import (
+    app,
+    report_handler)
+from collector.lib.ratelimit import (
+    RateLimiter,
+    DROPPED_KEY)
+from collector.model import Record
+from collector.tests.testcase import (
+    RecordTestCases,
+    get_record)
+
+# 2020-06-15 12:00:00 UTC
+NOW = 1592222400
+
+
+def is_redis_available():
+    try:
+        return report_handler.rate_limiter.redis_client.ping()
+    except Exception:
+        return False
+
+
+def get_limited_record(machine_id, classification='org.clearlinux/hello/world'):
+    return {'machine_id': machine_id, 'classification': classification}
+
+
+@unittest.skipUnless(is_redis_available(), "Redis is not available")
+class TestRateLimit(RecordTestCases):
+    """
+        Records are admitted from token buckets per machine and classification
+    """
+
+    def setUp(self):
+        super(TestRateLimit, self).setUp()
+        self.redis_client = report_handler.rate_limiter.redis_client
+        # Buckets of their own for every test
+        self.machine_id = uuid.uuid4().hex
+        self.classification = 'test/{}/ratelimit'.format(uuid.uuid4().hex)
+        self.limiter = RateLimiter(self.redis_client, (1, 2), {"default": None}, app.logger)
+
+    def tearDown(self):
+        for key in self.redis_client.scan_iter("collector:ratelimit:*:*{}*".format(self.machine_id)):
+            self.redis_client.delete(key)
+        super(TestRateLimit, self).tearDown()
+
+    def test_burst_exhausted(self):
+        record = get_limited_record(self.machine_id)
+        self.assertEqual(self.limiter.check([record, record], NOW), [0, 0])
+        retry_after = self.limiter.check([record], NOW)[0]
+        self.assertAlmostEqual(retry_after, 1)
+
+    def test_refill(self):
+        record = get_limited_record(self.machine_id)
+        self.limiter.check([record, record], NOW)
+        self.assertTrue(self.limiter.check([record], NOW + 0.5)[0] > 0)
+        self.assertEqual(self.limiter.check([record], NOW + 1.5), [0])
+        # Never more than the burst
+        self.assertEqual(self.limiter.check([record, record, record], NOW + 100)[:2], [0, 0])
+        self.assertTrue(self.limiter.check([record], NOW + 100)[0] > 0)
+
+    def test_keys_isolated(self):
+        record = get_limited_record(self.machine_id)
+        other = get_limited_record(self.machine_id + "-other")
+        self.limiter.check([record, record], NOW)
+        self.assertTrue(self.limiter.check([record], NOW)[0] > 0)
+        self.assertEqual(self.limiter.check([other], NOW), [0])
+
+    def test_classification_limit(self):
+        limiter = RateLimiter(self.redis_client, None, {self.classification: (1, 1), "default": None}, app.logger)
+        record = get_limited_record(self.machine_id, self.classification)
+        self.assertEqual(limiter.check([record], NOW), [0])
+        self.assertTrue(limiter.check([get_limited_record(self.machine_id + "-other", self.classification)], NOW)[0] > 0)
+        # Other classifications are not limited
+        self.assertEqual(limiter.check([get_limited_record(self.machine_id)] * 3, NOW), [0, 0, 0])
+        self.redis_client.delete("collector:ratelimit:classification:{}".format(self.classification))
+
+    def test_rejected_not_charged(self):
+        dropped = int(self.redis_client.hget(DROPPED_KEY, "machine") or 0)
+        record = get_limited_record(self.machine_id)
+        self.limiter.check([record, record], NOW)
+        for _ in range(5):
+            self.limiter.check([record], NOW)
+        self.assertEqual(int(self.redis_client.hget(DROPPED_KEY, "machine")), dropped + 5)
+        # Rejections do not consume tokens, one is back after a second
+        self.assertEqual(self.limiter.check([record], NOW + 1), [0])
+
+    def test_dropped_reported(self):
+        record = get_limited_record(self.machine_id)
+        self.limiter.check([record, record, record], NOW)
+        app.config["RATE_LIMIT_ENABLED"] = True
+        try:
+            response = self.client.get('/v2/collector/status')
+        finally:
+            app.config["RATE_LIMIT_ENABLED"] = False
+        self.assertEqual(response.status_code, 200)
+        state = json.loads(response.data.decode('utf-8'))['rate_limit']
+        self.assertTrue(state['enabled'])
+        self.assertTrue(state['dropped']['machine'] >= 1)
+
+    def test_post_rejected_with_retry_after(self):
+        app.config["RATE_LIMIT_ENABLED"] = True
+        saved = report_handler.rate_limiter
+        report_handler.rate_limiter = self.limiter
+        try:
+            rec = get_record()
+            rec['machine_id'] = self.machine_id
+            for _ in range(2):
+                response = self.client.post('/', headers=rec, data='test')
+                self.assertEqual(response.status_code, 201, response.data.decode('utf-8'))
+            response = self.client.post('/', headers=rec, data='test')
+            self.assertEqual(response.status_code, 429, response.data.decode('utf-8'))
+            self.assertEqual(response.headers.get('Retry-After'), '1')
+            self.assertEqual(Record.query.count(), 2)
+        finally:
+            report_handler.rate_limiter = saved
+            app.config["RATE_LIMIT_ENABLED"] = False
+
+
+if __name__ == '__main__' and __package__ is None:
+    from os import sys, path
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    unittest.main()
+
+
+# vi: ts=4 et sw=4 sts=4
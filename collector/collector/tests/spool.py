@@ -0,0 +1,109 @@
+#
+# Copyright 2015-2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import tempfile
+from sqlalchemy.exc import OperationalError
+from collector.model import Record
+from collector.spool import (
+    Spool,
+    SpoolFallback)
+from collector.tests.testcase import RecordTestCases
+
+
+def get_spooled_record(payload):
+    return {
+        'machine_id': 'clr-linux-avj01',
+        'host_type': 'blank|blank|blank',
+        'severity': '1',
+        'classification': 'org.clearlinux/hello/world',
+        'build': '17700',
+        'architecture': 'x86_64',
+        'kernel_version': '4.12.5-374.native',
+        'record_version': '4',
+        'ts_capture': 1505235249,
+        'ts_reception': 1505235250.5,
+        'payload_version': '1',
+        'system_name': 'clear-linux-os',
+        'board_name': 'D54250WYK|Intel Corporation',
+        'bios_version': 'WYLPT10H.86A.0041.2015.0720.1108',
+        'cpu_model': 'Intel(R) Core(TM) i5-4250U CPU @ 1.30GHz',
+        'event_id': '39cc109a1079df96376693ebc7a0f632',
+        'external': False,
+        'payload': payload,
+    }
+
+
+class TestSpool(RecordTestCases):
+    """
+        Records are spooled when the database write fails and replayed later
+    """
+
+    def setUp(self):
+        super(TestSpool, self).setUp()
+        self.spool_dir = tempfile.TemporaryDirectory()
+        self.spool = Spool(self.spool_dir.name, 1024 * 1024, 60)
+
+    def tearDown(self):
+        self.spool_dir.cleanup()
+        super(TestSpool, self).tearDown()
+
+    def test_spool_on_failure(self):
+        def failing_write():
+            raise OperationalError("INSERT", {}, Exception("database is down"))
+        fallback = SpoolFallback(self.spool, 0, 60)
+        records = [get_spooled_record('hello'), dict(get_spooled_record('world'), event_id='0' * 32)]
+        self.assertIsNone(fallback.write(failing_write, records))
+        self.assertFalse(fallback.is_db_available())
+        # The segment is still held by its writer
+        self.assertEqual(self.spool.replay(), 0)
+        self.spool.release()
+        self.assertEqual(self.spool.replay(), 2)
+        self.assertEqual(Record.query.count(), 2)
+        self.assertEqual(self.spool.segments(), [])
+
+    def test_idle_segment_replayed(self):
+        def failing_write():
+            raise OperationalError("INSERT", {}, Exception("database is down"))
+        fallback = SpoolFallback(self.spool, 0, 60)
+        fallback.write(failing_write, [get_spooled_record('hello')])
+        # The database is back but the worker does not write again
+        fallback.retry_at = 0
+        self.assertEqual(fallback.replay(), 1)
+        self.assertEqual(Record.query.count(), 1)
+        self.assertEqual(self.spool.segments(), [])
+
+    def test_expired_segment_released(self):
+        def failing_write():
+            raise OperationalError("INSERT", {}, Exception("database is down"))
+        fallback = SpoolFallback(self.spool, 0, 60)
+        fallback.write(failing_write, [get_spooled_record('hello')])
+        # Still down for this worker, the segment is kept until it expires
+        self.assertEqual(fallback.replay(), 0)
+        self.assertEqual(self.spool.replay(), 0)
+        self.spool.segment_max_age = 0
+        self.assertEqual(fallback.replay(), 0)
+        self.assertEqual(self.spool.replay(), 1)
+        self.assertEqual(Record.query.count(), 1)
+
+
+if __name__ == '__main__' and __package__ is None:
+    from os import sys, path
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    unittest.main()
+
+
+# vi: ts=4 et sw=4 sts=4
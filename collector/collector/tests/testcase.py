@@ -19,6 +19,7 @@ from collector import (
     app,
     db,
     report_handler,)
+from collector.model import dimension_cache
 from flask import current_app
 
 classification = 'classification'
@@ -129,6 +130,8 @@ class RecordTestCases(unittest.TestCase):
         self.app_context.push()
         db.init_app(current_app)
         db.create_all()
+        report_handler.recent_event_ids.clear()
+        dimension_cache.clear()
         self.client = app.test_client()
 
     def tearDown(self):
@@ -0,0 +1,65 @@
+#
+# Copyright 2015-2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+from collector.model import Record
+from collector.tests.testcase import (
+    RecordTestCases,
+    classification,
+    timestamp,
+    get_record_v3,)
+
+# Sunday 2017-01-01 00:00:00 UTC
+JANUARY_1ST = 1483228800
+
+
+class TestTimestamps(RecordTestCases):
+    """
+        Timestamps are whole seconds, the day and week of capture are
+        computed by the database
+    """
+
+    def post(self, **values):
+        headers = get_record_v3()
+        headers.update(values)
+        response = self.client.post('/', headers=headers, data='test')
+        self.assertTrue(response.status_code == 201, response.data.decode('utf-8'))
+
+    def test_capture_buckets(self):
+        self.post()
+        record = Record.query.first()
+        self.assertIsInstance(record.timestamp_server, int)
+        self.assertEqual(record.timestamp_client, get_record_v3()[timestamp])
+        self.assertEqual(record.client_day, JANUARY_1ST)
+        self.assertEqual(record.client_week, JANUARY_1ST)
+
+    def test_weekly_counts(self):
+        self.post()
+        self.post()
+        self.post(**{timestamp: JANUARY_1ST + 7 * 86400 + 3600})
+        self.post(**{classification: 'a/b/d'})
+        counts = Record.get_weekly_counts(['a/b/c'], JANUARY_1ST)
+        self.assertEqual(sorted([tuple(c) for c in counts]),
+                         [('a/b/c', JANUARY_1ST, 2), ('a/b/c', JANUARY_1ST + 7 * 86400, 1)])
+
+
+if __name__ == '__main__' and __package__ is None:
+    from os import sys, path
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    unittest.main()
+
+
+# vi: ts=4 et sw=4 sts=4
@@ -14,10 +14,14 @@
 # limitations under the License.
 #
 
+import json
 import unittest
 from collector.tests.testcase import (
     RecordTestCases,
     get_record_v3,
+    severity,
+    machine_id,
+    cpu_model,
     kernel_version)
 
 
@@ -35,6 +39,15 @@ class TestHandlerRecordValidation(RecordTestCases):
         response = self.client.post('/', headers=headers, data='test')
         self.assertTrue(response.status_code == 201, response.data.decode('utf-8'))
 
+    def test_post_all_errors_reported(self):
+        headers = get_record_v3()
+        headers.update({severity: 9, machine_id: 'x' * 33})
+        del headers[cpu_model]
+        response = self.client.post('/', headers=headers, data='test')
+        self.assertTrue(response.status_code == 400)
+        json_resp = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(len(json_resp['errors']), 3, json_resp['errors'])
+
 
 if __name__ == '__main__' and __package__ is None:
     from os import sys, path
@@ -0,0 +1,91 @@
+#
+# Copyright 2015-2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import time
+import unittest
+import threading
+from collector import app
+from collector.model import Record
+from collector.write_behind import (
+    write_behind_buffer,
+    WriteBehindBuffer)
+from collector.tests.spool import get_spooled_record
+from collector.tests.testcase import (
+    RecordTestCases,
+    get_record_v4,)
+
+
+class BlockingBuffer(WriteBehindBuffer):
+    """ Holds the flusher thread in its write until proceed is set """
+
+    def __init__(self):
+        super(BlockingBuffer, self).__init__(1, 60, 100)
+        self.writing = threading.Event()
+        self.proceed = threading.Event()
+
+    def write(self, records, final=False):
+        if threading.current_thread() is self.flusher:
+            self.writing.set()
+            self.proceed.wait(10)
+        return super(BlockingBuffer, self).write(records, final)
+
+
+class TestWriteBehind(RecordTestCases):
+    """
+        Records are buffered and loaded with COPY when the buffer is flushed
+    """
+
+    def setUp(self):
+        super(TestWriteBehind, self).setUp()
+        app.config["WRITE_BEHIND_ENABLED"] = True
+
+    def tearDown(self):
+        app.config["WRITE_BEHIND_ENABLED"] = False
+        super(TestWriteBehind, self).tearDown()
+
+    def test_record_buffered(self):
+        response = self.client.post('/', headers=get_record_v4(), data='')
+        self.assertTrue(response.status_code == 202, response.data.decode('utf-8'))
+        write_behind_buffer.flush()
+        records = Record.query.all()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].payload, '')
+        self.assertFalse(records[0].processed)
+
+    def test_shutdown_while_flushing(self):
+        buffer = BlockingBuffer()
+        buffer.append(get_spooled_record('hello'))
+        self.assertTrue(buffer.writing.wait(10))
+        buffer.append(dict(get_spooled_record('world'), event_id='0' * 32))
+        shutdown = threading.Thread(target=buffer.shutdown)
+        shutdown.start()
+        # The final flush waits for the batch of the flusher thread
+        time.sleep(0.1)
+        self.assertTrue(shutdown.is_alive())
+        buffer.proceed.set()
+        shutdown.join(10)
+        self.assertFalse(shutdown.is_alive())
+        self.assertFalse(buffer.flusher.is_alive())
+        self.assertEqual(Record.query.count(), 2)
+
+
+if __name__ == '__main__' and __package__ is None:
+    from os import sys, path
+    sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+    unittest.main()
+
+
+# vi: ts=4 et sw=4 sts=4
@@ -0,0 +1,141 @@
+# Copyright (C) 2015-2020 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import time
+import threading
+from . import app
+from .model import Record
+from .monitoring import timed_write
+from .spool import (
+    spool,
+    SPOOL_ENABLED)
+
+
+class WriteBehindBuffer(object):
+    """ Holds validated records in memory and loads them into the records
+        table with COPY once max_records are pending or the oldest pending
+        record has waited max_delay seconds, whichever comes first. A
+        batch is written by one thread at a time, so flush returns once
+        the batch the flusher thread is writing is done too.
+    """
+
+    def __init__(self, max_records, max_delay, max_pending):
+        self.max_records = max_records
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.records = []
+        self.oldest = None
+        self.cond = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.flusher = None
+        self.pid = None
+        self.stopping = False
+
+    def append(self, record):
+        with self.cond:
+            self.start_flusher()
+            self.records.append(record)
+            if len(self.records) == 1:
+                self.oldest = time.time()
+                self.cond.notify()
+            elif len(self.records) >= self.max_records:
+                self.cond.notify()
+
+    def start_flusher(self):
+        # uWSGI forks the workers after the app is imported, so each worker
+        # starts its own flusher thread the first time a record is buffered.
+        if self.stopping or (self.flusher is not None and self.pid == os.getpid()):
+            return
+        self.pid = os.getpid()
+        self.flusher = threading.Thread(target=self.run, name="write-behind", daemon=True)
+        self.flusher.start()
+
+    def is_due(self):
+        if not self.records:
+            return False
+        return len(self.records) >= self.max_records or time.time() - self.oldest >= self.max_delay
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.stopping and not self.is_due():
+                    timeout = None
+                    if self.records:
+                        timeout = max(self.oldest + self.max_delay - time.time(), 0)
+                    self.cond.wait(timeout)
+                if self.stopping:
+                    return
+            with self.write_lock:
+                with self.cond:
+                    records = self.take()
+                written = not records or self.write(records)
+            if not written:
+                # Back off instead of retrying a full buffer right away
+                with self.cond:
+                    self.cond.wait_for(lambda: self.stopping, self.max_delay)
+
+    def take(self):
+        records = self.records[:self.max_records]
+        self.records = self.records[self.max_records:]
+        self.oldest = time.time() if self.records else None
+        return records
+
+    def flush(self, final=False):
+        """ Writes every pending record, with final the records of a
+            failed write are spooled instead of kept in the buffer """
+        with self.write_lock:
+            while True:
+                with self.cond:
+                    records = self.take()
+                if not records:
+                    return
+                if not self.write(records, final):
+                    return
+
+    def shutdown(self):
+        """ Stops the flusher thread once its current batch is written
+            and flushes the rest, used on worker shutdown """
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        if self.flusher is not None and self.pid == os.getpid():
+            self.flusher.join()
+        self.flush(final=True)
+        # Let the replayer have the records spooled by this worker
+        spool.release()
+
+    def write(self, records, final=False):
+        try:
+            with app.app_context(), timed_write('copy'):
+                Record.copy_many(records)
+            return True
+        except Exception as e:
+            app.logger.error("Write-behind flush of {} records failed".format(len(records)))
+            app.logger.error(e)
+            if SPOOL_ENABLED or final:
+                # Nothing would retry the records of an exiting worker
+                try:
+                    spool.append(records)
+                    return True
+                except OSError as e:
+                    app.logger.error("Spooling {} records failed".format(len(records)))
+                    app.logger.error(e)
+            with self.cond:
+                # Keep the records for the next flush, the oldest ones are
+                # dropped once more than max_pending are waiting.
+                self.records[:0] = records
+                dropped = len(self.records) - self.max_pending
+                if dropped > 0:
+                    del self.records[:dropped]
+                    app.logger.error("Write-behind buffer full, dropped {} records".format(dropped))
+                self.oldest = time.time()
+            return False
+
+
+write_behind_buffer = WriteBehindBuffer(app.config.get("WRITE_BEHIND_MAX_RECORDS", 500),
+                                        app.config.get("WRITE_BEHIND_MAX_DELAY", 2),
+                                        app.config.get("WRITE_BEHIND_MAX_PENDING", 50000))
+
+
+# vi: ts=4 et sw=4 sts=4
@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import os
+import time
 import luigi
 import psycopg2
 from processing.main import (
@@ -13,6 +14,18 @@ from processing.main import (
 )
 
 from processing import crash
+from processing.metrics import (
+    gauge,
+    new_registry,
+    push_metrics)
+
+# Pushed to PROMETHEUS_PUSHGATEWAY after every batch, the job does not
+# live long enough to be scraped
+registry = new_registry()
+batch_records = gauge("processing_batch_records", "Crash records processed by the last batch", registry=registry)
+batch_seconds = gauge("processing_batch_seconds", "Duration of the last batch", registry=registry)
+batch_rate = gauge("processing_batch_records_per_second", "Throughput of the last batch", registry=registry)
+last_success = gauge("processing_last_success_timestamp_seconds", "End time of the last batch", registry=registry)
 
 
 class GlobalParams(luigi.Config):
@@ -21,6 +34,7 @@ class GlobalParams(luigi.Config):
     db_host = os.environ['POSTGRES_HOSTNAME']
     db_user = os.environ['POSTGRES_USER']
     db_passwd = os.environ['POSTGRES_PASSWORD']
+    pushgateway = os.environ.get('PROMETHEUS_PUSHGATEWAY')
 
 
 class ProcessCrashes(luigi.Task):
@@ -33,7 +47,9 @@ class ProcessCrashes(luigi.Task):
         return self.is_complete
 
     def run(self):
-        db = connect(GlobalParams())
+        start = time.time()
+        conf = GlobalParams()
+        db = connect(conf)
         cur = db.cursor()
         crash.GUILTY_BLACKLIST = init_guilty_blacklist(cur)
         last_id = get_latest_id(cur)
@@ -45,6 +61,17 @@ class ProcessCrashes(luigi.Task):
         cur.close()
         db.close()
         self.is_complete = True
+        self.push_metrics(conf, len(crashes), time.time() - start)
+
+    def push_metrics(self, conf, count, seconds):
+        batch_records.set(count)
+        batch_seconds.set(seconds)
+        batch_rate.set(count / seconds if seconds else 0)
+        last_success.set(time.time())
+        try:
+            push_metrics(conf.pushgateway, "processing", registry)
+        except OSError as e:
+            print("# Could not push metrics, {}".format(e))
 
 
 if __name__ == "__main__":
@@ -13,7 +13,10 @@ from .crash import (
 PROCESSED_VIEW = """last_processed"""
 
 CRASHES = """
-  SELECT id, payload, classification FROM records WHERE classification in {} AND id > {} ORDER BY id ASC
+  SELECT r.id, COALESCE(r.payload, p.payload), c.classification FROM records r
+  JOIN classifications c ON c.id = r.classification_id
+  LEFT JOIN payloads p ON p.hash = r.payload_hash
+  WHERE c.classification in {} AND r.id > {} ORDER BY r.id ASC
 """
 
 INSERT_GUILTY = """
@@ -0,0 +1,27 @@
+"""integer number of the numeric builds
+
+Revision ID: 0d3e7a5c8b12
+Revises: f2b8c6d41e97
+Create Date: 2020-07-02 10:12:44.905317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0d3e7a5c8b12'
+down_revision = 'f2b8c6d41e97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('builds', sa.Column('build_number', sa.Integer(), nullable=True))
+    op.execute("UPDATE builds SET build_number = build::integer WHERE build ~ '^[0-9]{1,9}$'")
+    op.create_index(op.f('ix_builds_build_number'), 'builds', ['build_number'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_builds_build_number'), table_name='builds')
+    op.drop_column('builds', 'build_number')
@@ -0,0 +1,32 @@
+"""unique event_id for record format v4
+
+Revision ID: 3f6a9c1d2b7e
+Revises: ac1c5921bf2f
+Create Date: 2020-06-02 10:12:31.402113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6a9c1d2b7e'
+down_revision = 'ac1c5921bf2f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Client retries may already have stored the same event more than once,
+    # keep the first copy of each event.
+    op.execute("""
+        DELETE FROM records r USING records d
+        WHERE r.record_version >= 4 AND d.record_version >= 4
+          AND r.event_id = d.event_id AND r.id > d.id
+    """)
+    op.create_index('ix_records_event_id_unique', 'records', ['event_id'], unique=True,
+                    postgresql_where=sa.text('record_version >= 4'))
+
+
+def downgrade():
+    op.drop_index('ix_records_event_id_unique', table_name='records')
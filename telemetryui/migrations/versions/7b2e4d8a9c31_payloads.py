@@ -0,0 +1,60 @@
+"""content addressed payload storage
+
+Revision ID: 7b2e4d8a9c31
+Revises: 3f6a9c1d2b7e
+Create Date: 2020-06-09 15:41:07.218334
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b2e4d8a9c31'
+down_revision = '3f6a9c1d2b7e'
+branch_labels = None
+depends_on = None
+
+# Same as PAYLOAD_DEDUP_MIN_LEN in the collector configuration
+PAYLOAD_DEDUP_MIN_LEN = 64
+
+
+def upgrade():
+    op.create_table('payloads',
+                    sa.Column('hash', sa.LargeBinary(), nullable=False),
+                    sa.Column('payload', sa.Text(), nullable=False),
+                    sa.PrimaryKeyConstraint('hash'))
+    # lz4 compresses faster than the default pglz, available since Postgres 14
+    op.execute("""
+        DO $$ BEGIN
+            IF current_setting('server_version_num')::int >= 140000 THEN
+                ALTER TABLE payloads ALTER COLUMN payload SET COMPRESSION lz4;
+            END IF;
+        END $$
+    """)
+    op.add_column('records', sa.Column('payload_hash', sa.LargeBinary(), nullable=True))
+    op.alter_column('records', 'payload', existing_type=sa.Text(), nullable=True)
+    op.execute("""
+        INSERT INTO payloads (hash, payload)
+        SELECT sha256(convert_to(payload, 'UTF8')), payload FROM records
+        WHERE length(payload) >= {}
+        ON CONFLICT (hash) DO NOTHING
+    """.format(PAYLOAD_DEDUP_MIN_LEN))
+    op.execute("""
+        UPDATE records SET payload_hash = sha256(convert_to(payload, 'UTF8')), payload = NULL
+        WHERE length(payload) >= {}
+    """.format(PAYLOAD_DEDUP_MIN_LEN))
+    op.create_foreign_key('records_payload_hash_fkey', 'records', 'payloads', ['payload_hash'], ['hash'])
+    op.create_index(op.f('ix_records_payload_hash'), 'records', ['payload_hash'], unique=False)
+
+
+def downgrade():
+    op.execute("""
+        UPDATE records r SET payload = p.payload, payload_hash = NULL
+        FROM payloads p WHERE p.hash = r.payload_hash
+    """)
+    op.drop_index(op.f('ix_records_payload_hash'), table_name='records')
+    op.drop_constraint('records_payload_hash_fkey', 'records', type_='foreignkey')
+    op.alter_column('records', 'payload', existing_type=sa.Text(), nullable=False)
+    op.drop_column('records', 'payload_hash')
+    op.drop_table('payloads')
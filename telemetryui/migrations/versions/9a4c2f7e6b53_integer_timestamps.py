@@ -0,0 +1,137 @@
+"""integer epoch timestamps and capture day and week
+
+Revision ID: 9a4c2f7e6b53
+Revises: 0d3e7a5c8b12
+Create Date: 2020-07-07 16:38:21.104859
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4c2f7e6b53'
+down_revision = '0d3e7a5c8b12'
+branch_labels = None
+depends_on = None
+
+# The partition key cannot change type, the records are copied to a new
+# partitioned table with the same partitions
+
+CREATE_RECORDS = """
+  CREATE TABLE records_bigint (
+    id integer NOT NULL DEFAULT nextval('records_id_seq'),
+    architecture_id integer,
+    bios_version_id integer,
+    board_name_id integer,
+    build_id integer NOT NULL,
+    classification_id integer NOT NULL,
+    cpu_model_id integer,
+    event_id text,
+    external boolean,
+    host_type_id integer,
+    kernel_version_id integer,
+    machine_id text,
+    payload_version integer,
+    record_version integer,
+    severity integer,
+    system_name_id integer,
+    timestamp_client bigint,
+    timestamp_server bigint NOT NULL,
+    client_day bigint GENERATED ALWAYS AS (timestamp_client / 86400 * 86400) STORED,
+    client_week bigint GENERATED ALWAYS AS ((timestamp_client - 259200) / 604800 * 604800 + 259200) STORED,
+    payload text,
+    payload_hash bytea,
+    processed boolean,
+    guilty_id integer,
+    CONSTRAINT records_bigint_pkey PRIMARY KEY (id, timestamp_server)
+  ) PARTITION BY RANGE (timestamp_server)
+"""
+
+COLUMNS = """
+    id, architecture_id, bios_version_id, board_name_id, build_id, classification_id,
+    cpu_model_id, event_id, external, host_type_id, kernel_version_id, machine_id,
+    payload_version, record_version, severity, system_name_id, payload, payload_hash,
+    processed, guilty_id
+"""
+
+PARTITIONS = """
+  SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+  WHERE i.inhparent = 'records'::regclass ORDER BY c.relname
+"""
+
+FOREIGN_KEYS = (
+    ('architecture_id', 'architectures'),
+    ('bios_version_id', 'bios_versions'),
+    ('board_name_id', 'board_names'),
+    ('build_id', 'builds'),
+    ('classification_id', 'classifications'),
+    ('cpu_model_id', 'cpu_models'),
+    ('host_type_id', 'host_types'),
+    ('kernel_version_id', 'kernel_versions'),
+    ('system_name_id', 'system_names'),
+    ('payload_hash', 'payloads'),
+    ('guilty_id', 'guilty'),
+)
+
+# name, method, columns, predicate
+INDEXES = (
+    ('ix_records_build_id', 'btree', 'build_id', None),
+    ('ix_records_payload_hash', 'btree', 'payload_hash', None),
+    ('ix_records_system_name_id_build_id', 'btree', 'system_name_id, build_id', None),
+    ('ix_records_classification_id_id', 'btree', 'classification_id, id', None),
+    ('ix_records_machine_id_id', 'btree', 'machine_id, id', None),
+    ('ix_records_guilty_id_build_id', 'btree', 'guilty_id, build_id', 'guilty_id IS NOT NULL'),
+    ('ix_records_processed_id', 'btree', 'id', 'processed'),
+    ('ix_records_timestamp_client_brin', 'brin', 'timestamp_client', None),
+    ('ix_records_timestamp_server_brin', 'brin', 'timestamp_server', None),
+)
+
+# The view of the processing service depends on the records table
+LAST_PROCESSED = """
+    CREATE VIEW last_processed AS
+    SELECT MAX(id) AS last_id FROM records WHERE processed = True
+"""
+
+
+def swap_records(create_sql, timestamp_type):
+    """ Copies the records to a table created by create_sql, with the
+        timestamps cast to timestamp_type, and replaces the records table """
+    conn = op.get_bind()
+    partitions = conn.execute(PARTITIONS).fetchall()
+    op.execute(create_sql)
+    for name, bounds in partitions:
+        op.execute("CREATE TABLE records_bigint_{} PARTITION OF records_bigint {}".format(name[len("records_"):], bounds))
+    op.execute("""
+        INSERT INTO records_bigint ({0}, timestamp_client, timestamp_server)
+        SELECT {0}, floor(timestamp_client)::{1}, floor(timestamp_server)::{1} FROM records
+    """.format(COLUMNS, timestamp_type))
+    op.execute("ALTER SEQUENCE records_id_seq OWNED BY records_bigint.id")
+    last_processed = conn.execute("SELECT to_regclass('last_processed')").scalar() is not None
+    op.execute("DROP VIEW IF EXISTS last_processed")
+    op.execute("DROP TABLE records")
+    op.execute("ALTER TABLE records_bigint RENAME TO records")
+    op.execute("ALTER TABLE records RENAME CONSTRAINT records_bigint_pkey TO records_pkey")
+    for name, _ in partitions:
+        op.execute("ALTER TABLE records_bigint_{} RENAME TO {}".format(name[len("records_"):], name))
+    for name, method, columns, predicate in INDEXES:
+        op.execute("CREATE INDEX {} ON records USING {} ({}){}".format(
+            name, method, columns, " WHERE {}".format(predicate) if predicate else ""))
+    for column, table in FOREIGN_KEYS:
+        op.create_foreign_key('records_{}_fkey'.format(column), 'records', table, [column],
+                              ['hash' if table == 'payloads' else 'id'])
+    if last_processed:
+        op.execute(LAST_PROCESSED)
+
+
+def upgrade():
+    swap_records(CREATE_RECORDS, 'bigint')
+    op.alter_column('record_events', 'timestamp_server', type_=sa.BigInteger(),
+                    postgresql_using='floor(timestamp_server)::bigint')
+
+
+def downgrade():
+    create_sql = CREATE_RECORDS.replace(' bigint', ' numeric')
+    create_sql = "\n".join([line for line in create_sql.split("\n") if "GENERATED" not in line])
+    swap_records(create_sql, 'numeric')
+    op.alter_column('record_events', 'timestamp_server', type_=sa.Numeric())
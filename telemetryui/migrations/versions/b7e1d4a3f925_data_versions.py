@@ -0,0 +1,55 @@
+"""data version counters for conditional requests
+
+Revision ID: b7e1d4a3f925
+Revises: 9a4c2f7e6b53
+Create Date: 2020-07-09 11:24:53.318472
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e1d4a3f925'
+down_revision = '9a4c2f7e6b53'
+branch_labels = None
+depends_on = None
+
+CREATE_BUMP_FUNCTION = """
+  CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+  BEGIN
+    INSERT INTO data_versions (name, version, modified)
+    VALUES (TG_ARGV[0], 1, extract(epoch FROM now())::bigint)
+    ON CONFLICT (name) DO UPDATE SET version = data_versions.version + 1, modified = EXCLUDED.modified;
+    RETURN NULL;
+  END
+  $$ LANGUAGE plpgsql
+"""
+
+# table, events, counter
+TRIGGERS = (
+    ('records', 'UPDATE OF guilty_id OR DELETE', 'records'),
+    ('guilty', 'INSERT OR UPDATE OR DELETE', 'guilty'),
+    ('guilty_blacklisted', 'INSERT OR UPDATE OR DELETE', 'blacklist'),
+)
+
+
+def upgrade():
+    op.create_table('data_versions',
+                    sa.Column('name', sa.Text(), nullable=False),
+                    sa.Column('version', sa.BigInteger(), nullable=False),
+                    sa.Column('modified', sa.BigInteger(), nullable=False),
+                    sa.PrimaryKeyConstraint('name'))
+    op.execute(CREATE_BUMP_FUNCTION)
+    for table, events, counter in TRIGGERS:
+        op.execute("""
+          CREATE TRIGGER {0}_data_version AFTER {1} ON {0}
+          FOR EACH STATEMENT EXECUTE PROCEDURE bump_data_version('{2}')
+        """.format(table, events, counter))
+
+
+def downgrade():
+    for table, _, _ in TRIGGERS:
+        op.execute("DROP TRIGGER {0}_data_version ON {0}".format(table))
+    op.execute("DROP FUNCTION bump_data_version()")
+    op.drop_table('data_versions')
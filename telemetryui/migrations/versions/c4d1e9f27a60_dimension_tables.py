@@ -0,0 +1,67 @@
+"""dimension tables for the repeated record attributes
+
+Revision ID: c4d1e9f27a60
+Revises: 7b2e4d8a9c31
+Create Date: 2020-06-16 11:02:54.730915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d1e9f27a60'
+down_revision = '7b2e4d8a9c31'
+branch_labels = None
+depends_on = None
+
+# records column, dimension table
+DIMENSIONS = (
+    ('architecture', 'architectures'),
+    ('bios_version', 'bios_versions'),
+    ('board_name', 'board_names'),
+    ('build', 'builds'),
+    ('classification', 'classifications'),
+    ('cpu_model', 'cpu_models'),
+    ('host_type', 'host_types'),
+    ('kernel_version', 'kernel_versions'),
+    ('system_name', 'system_names'),
+)
+
+
+def upgrade():
+    for column, table in DIMENSIONS:
+        op.create_table(table,
+                        sa.Column('id', sa.Integer(), nullable=False),
+                        sa.Column(column, sa.Text(), nullable=False),
+                        sa.PrimaryKeyConstraint('id'),
+                        sa.UniqueConstraint(column))
+        op.execute("INSERT INTO {1} ({0}) SELECT DISTINCT {0} FROM records WHERE {0} IS NOT NULL".format(column, table))
+        op.add_column('records', sa.Column('{}_id'.format(column), sa.Integer(), nullable=True))
+    # A single pass over the records
+    op.execute("UPDATE records r SET {}".format(", ".join([
+        "{0}_id = (SELECT id FROM {1} d WHERE d.{0} = r.{0})".format(column, table) for column, table in DIMENSIONS])))
+    for column, table in DIMENSIONS:
+        op.create_foreign_key('records_{}_id_fkey'.format(column), 'records', table, ['{}_id'.format(column)], ['id'])
+        op.drop_column('records', column)
+    op.alter_column('records', 'build_id', existing_type=sa.Integer(), nullable=False)
+    op.alter_column('records', 'classification_id', existing_type=sa.Integer(), nullable=False)
+    op.create_index(op.f('ix_records_build_id'), 'records', ['build_id'], unique=False)
+    op.create_index(op.f('ix_records_classification_id'), 'records', ['classification_id'], unique=False)
+    op.create_index('ix_records_system_name_id_build_id', 'records', ['system_name_id', 'build_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_records_system_name_id_build_id', table_name='records')
+    op.drop_index(op.f('ix_records_classification_id'), table_name='records')
+    op.drop_index(op.f('ix_records_build_id'), table_name='records')
+    for column, table in DIMENSIONS:
+        op.add_column('records', sa.Column(column, sa.Text(), nullable=True))
+    op.execute("UPDATE records r SET {}".format(", ".join([
+        "{0} = (SELECT {0} FROM {1} d WHERE d.id = r.{0}_id)".format(column, table) for column, table in DIMENSIONS])))
+    op.alter_column('records', 'build', existing_type=sa.Text(), nullable=False)
+    op.alter_column('records', 'classification', existing_type=sa.Text(), nullable=False)
+    for column, table in DIMENSIONS:
+        op.drop_constraint('records_{}_id_fkey'.format(column), 'records', type_='foreignkey')
+        op.drop_column('records', '{}_id'.format(column))
+        op.drop_table(table)
@@ -0,0 +1,142 @@
+"""partition records by reception time
+
+Revision ID: e5a7b3c90d14
+Revises: c4d1e9f27a60
+Create Date: 2020-06-23 09:47:12.551820
+
+"""
+import calendar
+from datetime import (
+    datetime,
+    timedelta)
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a7b3c90d14'
+down_revision = 'c4d1e9f27a60'
+branch_labels = None
+depends_on = None
+
+# Monthly partitions are created up to this many months ahead, see
+# RECORDS_PARTITION_INTERVAL and RECORDS_PARTITIONS_AHEAD
+PARTITIONS_AHEAD = 3
+
+COLUMNS = """
+    id, architecture_id, bios_version_id, board_name_id, build_id, classification_id,
+    cpu_model_id, event_id, external, host_type_id, kernel_version_id, machine_id,
+    payload_version, record_version, severity, system_name_id, timestamp_client,
+    timestamp_server, payload, payload_hash, processed, guilty_id
+"""
+
+FOREIGN_KEYS = (
+    ('architecture_id', 'architectures'),
+    ('bios_version_id', 'bios_versions'),
+    ('board_name_id', 'board_names'),
+    ('build_id', 'builds'),
+    ('classification_id', 'classifications'),
+    ('cpu_model_id', 'cpu_models'),
+    ('host_type_id', 'host_types'),
+    ('kernel_version_id', 'kernel_versions'),
+    ('system_name_id', 'system_names'),
+    ('payload_hash', 'payloads'),
+    ('guilty_id', 'guilty'),
+)
+
+INDEXES = (
+    ('ix_records_build_id', ['build_id']),
+    ('ix_records_classification_id', ['classification_id']),
+    ('ix_records_payload_hash', ['payload_hash']),
+    ('ix_records_system_name_id_build_id', ['system_name_id', 'build_id']),
+)
+
+# The view of the processing service depends on the records table, it is
+# recreated on the new table when the service created it
+LAST_PROCESSED = """
+    CREATE VIEW last_processed AS
+    SELECT MAX(id) AS last_id FROM records WHERE processed = True
+"""
+
+
+def get_months(first, last):
+    """ Yields the name and bounds of the monthly partitions from the month
+        of timestamp first to the month of timestamp last """
+    month = datetime.utcfromtimestamp(float(first)).date().replace(day=1)
+    while calendar.timegm(month.timetuple()) <= last:
+        end = (month + timedelta(days=32)).replace(day=1)
+        yield month.strftime("records_p%Y%m"), calendar.timegm(month.timetuple()), calendar.timegm(end.timetuple())
+        month = end
+
+
+def drop_last_processed(conn):
+    """ Drops the last_processed view, returns whether it existed """
+    exists = conn.execute("SELECT to_regclass('last_processed')").scalar() is not None
+    op.execute("DROP VIEW IF EXISTS last_processed")
+    return exists
+
+
+def create_indexes():
+    for name, columns in INDEXES:
+        op.create_index(name, 'records', columns, unique=False)
+    for column, table in FOREIGN_KEYS:
+        op.create_foreign_key('records_{}_fkey'.format(column), 'records', table, [column],
+                              ['hash' if table == 'payloads' else 'id'])
+
+
+def upgrade():
+    conn = op.get_bind()
+    op.create_table('record_events',
+                    sa.Column('event_id', sa.Text(), nullable=False),
+                    sa.Column('timestamp_server', sa.Numeric(), nullable=False),
+                    sa.PrimaryKeyConstraint('event_id'))
+    op.create_index(op.f('ix_record_events_timestamp_server'), 'record_events', ['timestamp_server'], unique=False)
+    op.execute("""
+        INSERT INTO record_events (event_id, timestamp_server)
+        SELECT event_id, min(timestamp_server) FROM records WHERE record_version >= 4 GROUP BY event_id
+    """)
+
+    # Copy the records to a new partitioned table and swap the tables
+    last_processed = drop_last_processed(conn)
+    op.execute("ALTER TABLE records RENAME TO records_old")
+    op.execute("ALTER TABLE records_old RENAME CONSTRAINT records_pkey TO records_old_pkey")
+    for name, _ in INDEXES:
+        op.execute("ALTER INDEX {0} RENAME TO {0}_old".format(name))
+    op.execute("""
+        CREATE TABLE records (LIKE records_old INCLUDING DEFAULTS, PRIMARY KEY (id, timestamp_server))
+        PARTITION BY RANGE (timestamp_server)
+    """)
+    op.execute("ALTER SEQUENCE records_id_seq OWNED BY records.id")
+    op.execute("CREATE TABLE records_default PARTITION OF records DEFAULT")
+    first, last = conn.execute("SELECT min(timestamp_server), max(timestamp_server) FROM records_old").first()
+    now = datetime.utcnow()
+    current = calendar.timegm(now.timetuple())
+    ahead = calendar.timegm((now + timedelta(days=31 * PARTITIONS_AHEAD)).timetuple())
+    # Every month up to the look-ahead gets its partition, rows of a month
+    # in the default partition would keep its partition from being created
+    for name, start, end in get_months(min(first, current) if first is not None else current, ahead):
+        op.execute("CREATE TABLE {} PARTITION OF records FOR VALUES FROM ({}) TO ({})".format(name, start, end))
+    op.execute("INSERT INTO records ({0}) SELECT {0} FROM records_old".format(COLUMNS))
+    op.drop_table('records_old')
+    create_indexes()
+    if last_processed:
+        op.execute(LAST_PROCESSED)
+
+
+def downgrade():
+    last_processed = drop_last_processed(op.get_bind())
+    op.execute("ALTER TABLE records RENAME TO records_partitioned")
+    for name, _ in INDEXES:
+        op.execute("ALTER INDEX {0} RENAME TO {0}_partitioned".format(name))
+    op.execute("CREATE TABLE records (LIKE records_partitioned INCLUDING DEFAULTS)")
+    op.execute("ALTER SEQUENCE records_id_seq OWNED BY records.id")
+    op.execute("INSERT INTO records ({0}) SELECT {0} FROM records_partitioned".format(COLUMNS))
+    op.execute("DROP TABLE records_partitioned")
+    op.create_primary_key('records_pkey', 'records', ['id'])
+    create_indexes()
+    if last_processed:
+        op.execute(LAST_PROCESSED)
+    op.create_index('ix_records_event_id_unique', 'records', ['event_id'], unique=True,
+                    postgresql_where=sa.text('record_version >= 4'))
+    op.drop_index(op.f('ix_record_events_timestamp_server'), table_name='record_events')
+    op.drop_table('record_events')
@@ -0,0 +1,60 @@
+"""indexes for the record queries of the apps
+
+Revision ID: f2b8c6d41e97
+Revises: e5a7b3c90d14
+Create Date: 2020-06-30 14:21:08.316472
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b8c6d41e97'
+down_revision = 'e5a7b3c90d14'
+branch_labels = None
+depends_on = None
+
+# name, method, columns, predicate
+INDEXES = (
+    ('ix_records_classification_id_id', 'btree', 'classification_id, id', None),
+    ('ix_records_machine_id_id', 'btree', 'machine_id, id', None),
+    ('ix_records_guilty_id_build_id', 'btree', 'guilty_id, build_id', 'guilty_id IS NOT NULL'),
+    ('ix_records_processed_id', 'btree', 'id', 'processed'),
+    ('ix_records_timestamp_client_brin', 'brin', 'timestamp_client', None),
+    ('ix_records_timestamp_server_brin', 'brin', 'timestamp_server', None),
+)
+
+PARTITIONS = """
+  SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+  WHERE i.inhparent = 'records'::regclass ORDER BY c.relname
+"""
+
+
+def create_index(name, method, columns, predicate, table, concurrently=False):
+    op.execute("CREATE INDEX {} IF NOT EXISTS {} ON {} USING {} ({}){}".format(
+        "CONCURRENTLY" if concurrently else "", name, table, method, columns,
+        " WHERE {}".format(predicate) if predicate else ""))
+
+
+def upgrade():
+    partitions = [row[0] for row in op.get_bind().execute(PARTITIONS)]
+    # A partitioned index cannot be built concurrently. It is created on
+    # the records table alone, the index of each partition is built
+    # concurrently and attached, and the partitioned index becomes valid
+    # once every partition has one.
+    # CREATE INDEX CONCURRENTLY cannot run inside the migration transaction
+    with op.get_context().autocommit_block():
+        for name, method, columns, predicate in INDEXES:
+            create_index(name, method, columns, predicate, "ONLY records")
+            for partition in partitions:
+                partition_index = "{}_{}".format(partition, name[len("ix_records_"):])
+                create_index(partition_index, method, columns, predicate, partition, concurrently=True)
+                op.execute("ALTER INDEX {} ATTACH PARTITION {}".format(name, partition_index))
+    # Superseded by ix_records_classification_id_id
+    op.execute("DROP INDEX IF EXISTS ix_records_classification_id")
+
+
+def downgrade():
+    op.create_index('ix_records_classification_id', 'records', ['classification_id'], unique=False)
+    for name, _, _, _ in INDEXES:
+        op.drop_index(name, table_name='records')
@@ -4,11 +4,16 @@
 import ast
 import redis
 from . import app
+from .metrics import counter
 
 REDIS_HOSTNAME = app.config.get('REDIS_HOSTNAME', 'localhost')
 REDIS_PORT = app.config.get('REDIS_PORT', 6379)
 REDIS_PASSWD = app.config.get('REDIS_PASSWD', None)
 
+# result is "hit", "miss" or "error" when Redis is unavailable, the hit
+# ratio of a key is hit / (hit + miss + error)
+cache_requests = counter("telemetryui_cache_requests_total", "Lookups of cached queries", ["key", "result"])
+
 
 def get_cached_data(varname, expiration, funct, *args, **kwargs):
     try:
@@ -21,13 +26,16 @@ def get_cached_data(varname, expiration, funct, *args, **kwargs):
         if ret is not None:
             # Convert to original type if successful
             ret = ast.literal_eval(ret)
+            cache_requests.labels(varname, "hit").inc()
         else:
             # If nothing was found, query the database
+            cache_requests.labels(varname, "miss").inc()
             ret = funct(*args, **kwargs)
             # Convert to string representation and cache via redis
             redis_client.set(varname, repr(ret), ex=expiration)
     except redis.exceptions.ConnectionError as e:
         print("%s Redis probably isn't running?" % str(e))
+        cache_requests.labels(varname, "error").inc()
         # If we can't connect to redis, just query directly
         ret = funct(*args, **kwargs)
     return ret 
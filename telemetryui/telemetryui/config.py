@@ -23,5 +23,12 @@ class Config(object):
     REDIS_HOSTNAME = redis_hostname
     REDIS_PORT = 6379
     REDIS_PASSWD = redis_passwd
+    # The dashboards answer 304 Not Modified until the data changes, or
+    # for at most the lifetime of their cached queries
+    ETAG_MAX_AGE = 600
+    # /metrics exposes the view latencies, SQL counts and cache hits in the
+    # Prometheus text format, aggregated across the uWSGI workers when
+    # PROMETHEUS_MULTIPROC_DIR is set
+    METRICS_ENABLED = True
 
 # vi: ts=4 et sw=4 sts=4
@@ -2,17 +2,56 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import time
+import functools
+from datetime import datetime
+from werkzeug import http as werkzeug_http
 from . import (
      crash,
      app,)
-from .model import Record
+from .model import (
+     Record,
+     DataVersion)
 from flask import (
+     request,
+     session,
      redirect,
      url_for,
-     render_template)
+     make_response,
+     render_template,
+     Response)
 
 
 RECORDS_PER_PAGE = app.config.get('RECORDS_PER_PAGE', 25)
+# Views are served from caches of this age, the ETag changes as often
+ETAG_MAX_AGE = app.config.get('ETAG_MAX_AGE', 600)
+# Columns shown in the records list
+RECORDS_LIST_COLUMNS = ('id', 'external', 'machine_id', 'timestamp_server', 'severity',
+                        'classification', 'system_name', 'payload')
+
+
+def conditional(view):
+    """ Answers GET and HEAD requests with 304 without running the view
+        while the data version matches the ETag or is not more recent than
+        the Last-Modified time held by the client """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # Pending flashed messages are shown by the next page rendered
+        if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+            return view(*args, **kwargs)
+        version, modified = DataVersion.get_version(ETAG_MAX_AGE)
+        etag = werkzeug_http.generate_etag(version.encode('utf-8'))
+        last_modified = datetime.utcfromtimestamp(modified)
+        if werkzeug_http.is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = make_response(view(*args, **kwargs))
+        else:
+            response = Response(status=304)
+        # The pages embed the CSRF token of the session
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response
+    return wrapper
 
 
 def records_get(form, request, lastid=None):
@@ -43,13 +82,13 @@ def records_get(form, request, lastid=None):
     return Record.query_records(build, classification, severity, machine_id,
                                 payload=payload, not_payload=not_payload,
                                 data_source=data_source, from_id=lastid,
-                                limit=RECORDS_PER_PAGE)
+                                limit=RECORDS_PER_PAGE, columns=RECORDS_LIST_COLUMNS)
 
 
 def records_post(form, request):
 
     if form.validate_on_submit() is False:
-        out_records = Record.query.order_by(Record.id.desc()).limit(RECORDS_PER_PAGE).all()
+        out_records = Record.query_columns(RECORDS_LIST_COLUMNS).order_by(Record.id.desc()).limit(RECORDS_PER_PAGE).all()
         return render_template('records.html', records=out_records, form=form)
     else:
         classification = request.form.get('classification')
@@ -3,6 +3,7 @@
 
 import re
 import time
+import calendar
 import json
 import datetime
 from flask import (
@@ -12,9 +13,13 @@ from flask import (
     redirect,
     flash,
     abort,
+    g,
+    has_request_context,
     Blueprint)
-from werkzeug import http as werkzeug_http
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from . import (
+    app,
     crash,
     utils,
     forms)
@@ -26,14 +31,52 @@ from flask import Response
 from .cache import (
     get_cached_data,
     uncache_data)
+from .metrics import (
+    histogram,
+    get_metrics,
+    COUNT_BUCKETS)
 
 
 GUILTY_CACHE_KEY = "tmp_top_crash_guilties"
 
 views_bp = Blueprint('views_bp', __name__, template_folder='templates')
 
+view_seconds = histogram("telemetryui_view_seconds", "Latency of the views", ["endpoint"])
+view_queries = histogram("telemetryui_view_queries", "SQL statements run by a view", ["endpoint"],
+                         buckets=COUNT_BUCKETS)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_queries = g.get('sql_queries', 0) + 1
+
+
+@views_bp.before_request
+def start_view():
+    g.view_start = time.time()
+    g.sql_queries = 0
+
+
+@views_bp.after_request
+def observe_view(response):
+    endpoint = request.endpoint or 'unknown'
+    view_seconds.labels(endpoint).observe(time.time() - g.view_start)
+    view_queries.labels(endpoint).observe(g.sql_queries)
+    return response
+
+
+@views_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """ Metrics of every worker in the Prometheus text format """
+    if not app.config.get('METRICS_ENABLED', True):
+        abort(404)
+    data, content_type = get_metrics()
+    return Response(data, content_type=content_type)
+
 
 @views_bp.route('/records/lastid/<int:lastid>', methods=['GET'])
+@utils.conditional
 def records_page(lastid):
     form = forms.RecordFilterForm()
     if lastid == 0:
@@ -44,6 +87,7 @@ def records_page(lastid):
 
 @views_bp.route('/', methods=['GET', 'POST'])
 @views_bp.route('/records', methods=['GET', 'POST', 'HEAD'])
+@utils.conditional
 def records():
     form = forms.RecordFilterForm()
 
@@ -68,9 +112,8 @@ def records():
         out_records = utils.records_get(form, request)
         return render_template('records.html', records=out_records, form=form, os_map=json.dumps(os_map))
     elif request.method == 'HEAD':
-        last_timestamp = Record.get_latest_timestamp_server()
-        etag = werkzeug_http.generate_etag(int(last_timestamp).to_bytes(4, byteorder='big'))
-        return Response(headers={'Etag': etag})
+        # The ETag of the data version is set by utils.conditional
+        return Response()
     else:
         return Response('Invalid request method', status_code=404)
 
@@ -84,12 +127,14 @@ def record_details(record_id):
 
 
 @views_bp.route('/builds')
+@utils.conditional
 def builds():
     build_rec_pairs = get_cached_data("build_rec_pairs", 600, Record.get_recordcnts_by_build)
     return render_template('builds.html', build_stats=build_rec_pairs)
 
 
 @views_bp.route('/stats')
+@utils.conditional
 def stats():
     # Display records per classification and records per machine type for now
     class_rec_pairs = get_cached_data("class_rec_pairs", 600, Record.get_recordcnts_by_classification)
@@ -113,6 +158,7 @@ def crashes_page(offset=0):
 
 @views_bp.route('/crashes', methods=['GET', 'POST'])
 @views_bp.route('/crashes/<string:filter>', methods=['GET', 'POST'])
+@utils.conditional
 def crashes(filter=None):
     form = forms.GuiltyDetailsForm()
     backtrace_classes = crash.get_backtrace_classes()
@@ -368,6 +414,7 @@ def guilty_reset():
 
 
 @views_bp.route('/mce', methods=['GET', 'POST'])
+@utils.conditional
 def mce():
     mce_classes = [
         "org.clearlinux/mce/corrected",
@@ -375,7 +422,8 @@ def mce():
         "org.clearlinux/mce/SRAR",
         "org.clearlinux/mce/UCNA",
     ]
-    records = Record.filter_records(None, mce_classes, None, from_date="{}-01-01".format(datetime.datetime.now().year)).all()
+    year_start = "{}-01-01".format(datetime.datetime.now().year)
+    records = Record.filter_records(None, mce_classes, None, from_date=year_start).all()
     top10 = []
     maxcnt = 0
     by_machine_id = {}
@@ -383,10 +431,14 @@ def mce():
     by_mce_status = {}
     week_rec_map = {}
     class_rec_map = {}
+    since = time.mktime(time.strptime(year_start, "%Y-%m-%d"))
+    first_day = calendar.timegm(time.strptime(year_start, "%Y-%m-%d"))
+    for classification, week, count in Record.get_weekly_counts(mce_classes, since):
+        # The first week of the year starts in the previous year
+        week = time.strftime("%U", time.gmtime(max(week, first_day)))
+        week_rec_map.setdefault(classification, {}).setdefault(week, 0)
+        week_rec_map[classification][week] += count
     for record in records:
-        week = time.strftime("%U", time.localtime(int(record.timestamp_client)))
-        week_rec_map.setdefault(record.classification, {}).setdefault(week, 0)
-        week_rec_map[record.classification][week] += 1
         class_rec_map.setdefault(record.classification, 0)
         class_rec_map[record.classification] += 1
         by_machine_id.setdefault(record.machine_id, {"builds": {}, "recordscnt": 0})
@@ -418,20 +470,19 @@ def mce():
 
 
 @views_bp.route('/thermal', methods=['GET', 'POST'])
+@utils.conditional
 def thermal():
     current_year = time.strftime("%Y", time.gmtime(time.time()))
     current_week = time.strftime("%U", time.gmtime(time.time()))
     from_date = time.strftime("%Y-%m-%d", time.localtime(time.mktime(time.strptime(current_year + current_week + "0", "%Y%U%w")) - 2419200))  # 2419200 = (604800 * 4)
-    records = Record.filter_records(None, ["org.clearlinux/mce/thermal"], None, from_date=from_date).all()
+    since = time.mktime(time.strptime(from_date, "%Y-%m-%d"))
     week_rec_map = {}
-    year_start = time.mktime(time.strptime(current_year + "000", "%Y%U%w"))
-    for r in records:
-        if r.timestamp_client >= year_start:
-            week = str(int((r.timestamp_client - year_start) / 604800) + ((r.timestamp_client - year_start) % 604800 > 0))
-            if week in week_rec_map:
-                week_rec_map[week] += 1
-            else:
-                week_rec_map[week] = 1
+    # Sunday of the first week of the year, weeks are numbered from 1
+    year_start = calendar.timegm(time.strptime(current_year + "000", "%Y%U%w"))
+    for _, week_start, count in Record.get_weekly_counts(["org.clearlinux/mce/thermal"], since):
+        if week_start >= year_start:
+            week = str((week_start - year_start) // 604800 + 1)
+            week_rec_map[week] = week_rec_map.get(week, 0) + count
     weeks = sorted(week_rec_map.keys(), key=lambda x: int(x), reverse=True)
     thermal_chart = [["Thermal records"] + ["Week: " + x for x in weeks]]
     weekly_records = ["org.clearlinux/mce/thermal"]
@@ -449,6 +500,7 @@ def updates():
 
 
 @views_bp.route('/population')
+@utils.conditional
 def population():
     charts = [{'id': 'Overall', 'time': None, 'timestr': 'Overall'},
               {'id': 'TwoWeeks', 'time': 14, 'timestr': 'Past Two Weeks'},
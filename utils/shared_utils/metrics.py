@@ -0,0 +1,105 @@
+# Copyright (C) 2015-2020 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+""" Prometheus metrics of the services. When PROMETHEUS_MULTIPROC_DIR is
+    set every uWSGI worker writes its samples to files in that directory
+    and the scrape endpoint aggregates the files of all the workers. The
+    directory must be emptied before the workers start. Without
+    prometheus_client installed the metrics are no-ops.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class NullMetric(object):
+    """ Stands in for a metric when prometheus_client is not installed """
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+def counter(name, documentation, labelnames=(), registry=None):
+    if prometheus_client is None:
+        return NullMetric()
+    return prometheus_client.Counter(name, documentation, labelnames,
+                                     registry=registry or prometheus_client.REGISTRY)
+
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+    if prometheus_client is None:
+        return NullMetric()
+    return prometheus_client.Histogram(name, documentation, labelnames, buckets=buckets,
+                                       registry=registry or prometheus_client.REGISTRY)
+
+
+def gauge(name, documentation, labelnames=(), multiprocess_mode='max', registry=None):
+    if prometheus_client is None:
+        return NullMetric()
+    # Aggregated across workers by their maximum unless told otherwise,
+    # "livesum" adds up the values of the running workers
+    return prometheus_client.Gauge(name, documentation, labelnames, multiprocess_mode=multiprocess_mode,
+                                   registry=registry or prometheus_client.REGISTRY)
+
+
+@contextmanager
+def timed(histogram, *labels):
+    start = time.time()
+    try:
+        yield
+    finally:
+        if labels:
+            histogram.labels(*labels).observe(time.time() - start)
+        else:
+            histogram.observe(time.time() - start)
+
+
+def is_multiprocess():
+    return bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir'))
+
+
+def get_metrics():
+    """ Returns the exposition of the metrics and its content type """
+    if prometheus_client is None:
+        return "", "text/plain; charset=utf-8"
+    if is_multiprocess():
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def new_registry():
+    """ Registry of the metrics of a batch job, pushed when it is done """
+    if prometheus_client is None:
+        return None
+    return prometheus_client.CollectorRegistry()
+
+
+def push_metrics(gateway, job, registry):
+    if prometheus_client is None or registry is None or not gateway:
+        return
+    prometheus_client.push_to_gateway(gateway, job=job, registry=registry)
+
+
+# vi: ts=4 et sw=4 sts=4
@@ -1,19 +1,111 @@
 # Copyright (C) 2015-2020 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import io
+import re
+import calendar
+import hashlib
 import itertools
+import threading
+from collections import OrderedDict
+from datetime import (
+    datetime,
+    timedelta)
+from functools import lru_cache
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.sql.expression import cast
 from sqlalchemy.sql.expression import desc
 from sqlalchemy.sql.expression import case
+from sqlalchemy.sql.expression import label
 from sqlalchemy import text
+from sqlalchemy import DDL
+from sqlalchemy import inspect
+from sqlalchemy import event
+from sqlalchemy import false
+from sqlalchemy import true
+from sqlalchemy import FetchedValue
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import undefer
+from sqlalchemy.sql import operators
+from sqlalchemy.ext.hybrid import (
+    hybrid_property,
+    Comparator)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import SQLAlchemyError
+from psycopg2.extras import execute_values
 from time import time, localtime, strftime, mktime, strptime, gmtime
-from distutils.version import LooseVersion
 
 from . import app
 
 db = SQLAlchemy(app)
 
+# Records are partitioned by reception time, one partition per "day" or
+# "month", created RECORDS_PARTITIONS_AHEAD intervals in advance
+RECORDS_PARTITION_INTERVAL = app.config.get("RECORDS_PARTITION_INTERVAL", "month")
+RECORDS_PARTITIONS_AHEAD = app.config.get("RECORDS_PARTITIONS_AHEAD", 3)
+PARTITION_BOUNDS = re.compile(r"FROM \('?([0-9.]+)'?\) TO \('?([0-9.]+)'?\)")
+
+# Start of the UTC day and of the week, from Sunday like strftime %U, of
+# the capture time of a record
+CLIENT_DAY = "timestamp_client / 86400 * 86400"
+CLIENT_WEEK = "(timestamp_client - 259200) / 604800 * 604800 + 259200"
+
+# Builds numbered within the range of an integer column
+BUILD_NUMBER = re.compile(r"^[0-9]{1,9}$")
+
+# Shorter payloads are stored inline in the records table
+PAYLOAD_DEDUP_MIN_LEN = app.config.get("PAYLOAD_DEDUP_MIN_LEN", 64)
+
+# Retried events are detected for this many days after their reception
+EVENT_ID_RETENTION_DAYS = app.config.get("EVENT_ID_RETENTION_DAYS", 35)
+
+# Moves the records loaded into records_copy to the records table, keeping
+# one copy of each event that is not stored yet
+COPY_NEW_RECORDS = """
+  WITH new_events AS (
+    INSERT INTO record_events (event_id, timestamp_server)
+    SELECT event_id, min(timestamp_server) FROM records_copy WHERE record_version >= 4 GROUP BY event_id
+    ON CONFLICT (event_id) DO NOTHING RETURNING event_id
+  )
+  INSERT INTO records ({0})
+  SELECT {0} FROM records_copy WHERE record_version < 4
+  UNION ALL
+  SELECT {0} FROM (
+    SELECT DISTINCT ON (event_id) {0} FROM records_copy
+    WHERE record_version >= 4 AND event_id IN (SELECT event_id FROM new_events)
+    ORDER BY event_id
+  ) AS events
+"""
+
+# Payloads already stored are locked until the records referencing them are
+# committed, so they cannot be purged in the meantime. Nothing is updated,
+# WHERE false only takes the lock.
+PAYLOAD_INSERT = """
+  INSERT INTO payloads (hash, payload) VALUES {} ON CONFLICT (hash) DO UPDATE SET hash = EXCLUDED.hash WHERE false
+"""
+
+EVENT_INSERT = """
+  INSERT INTO record_events (event_id, timestamp_server) VALUES ($1, $2) ON CONFLICT (event_id) DO NOTHING RETURNING event_id
+"""
+
+RECORD_INSERT = """
+  INSERT INTO records ({}) VALUES ({}) RETURNING id
+"""
+
+
+def copy_csv_value(value):
+    # Unquoted empty fields are loaded as NULL by COPY in CSV format, so
+    # strings are always quoted to keep empty strings apart from NULL.
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, bytes):
+        return '\\x' + value.hex()
+    return '"{}"'.format(str(value).replace('"', '""'))
+
 
 class Guilty(db.Model):
     __tablename__ = 'guilty'
@@ -65,33 +157,477 @@ class Guilty(db.Model):
         return q.all()
 
 
+class Payload(db.Model):
+    """ Record payloads stored once for each distinct content, keyed on
+        their SHA-256. Postgres compresses large values out of line, the
+        payloads stay text so they can be matched with regular expressions.
+    """
+    __tablename__ = 'payloads'
+    hash = db.Column(db.LargeBinary, primary_key=True)
+    payload = db.Column(db.Text, nullable=False)
+
+    @staticmethod
+    def split(payload):
+        """ Returns the inline payload and the hash of the shared payload,
+            one of them is None """
+        if payload is None or len(payload) < PAYLOAD_DEDUP_MIN_LEN:
+            return payload, None
+        return None, hashlib.sha256(payload.encode('utf-8')).digest()
+
+    @staticmethod
+    def get_rows(records, rows):
+        """ Returns the payloads to store for rows built from records,
+            once each and sorted so concurrent writers lock them in the
+            same order """
+        payloads = {}
+        for record, row in zip(records, rows):
+            if row['payload_hash'] is not None:
+                payloads[row['payload_hash']] = record['payload']
+        return [{'hash': h, 'payload': payloads[h]} for h in sorted(payloads)]
+
+    @staticmethod
+    def get_insert(rows):
+        stmt = postgresql.insert(Payload.__table__).values(rows)
+        return stmt.on_conflict_do_update(index_elements=['hash'], set_={'hash': stmt.excluded.hash}, where=false())
+
+    @staticmethod
+    def delete_unreferenced():
+        """ Deletes the payloads left behind by purged records """
+        sql = text("DELETE FROM payloads p WHERE NOT EXISTS (SELECT 1 FROM records r WHERE r.payload_hash = p.hash)")
+        try:
+            count = db.session.execute(sql).rowcount
+            db.session.commit()
+            return count
+        except Exception as e:
+            # A payload was referenced again while being deleted, the next
+            # purge gets it
+            app.logger.error("Payload purging failed")
+            app.logger.error(e)
+            db.session.rollback()
+            return 0
+
+
+class DimensionCache(object):
+    """ Bounded map of dimension values to their ids, shared by the threads
+        of a worker. A value missing from its table is inserted in its own
+        transaction, so a cached id stays valid whatever happens to the
+        record that needed it.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.ids = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_id(self, dimension, value):
+        if value is None:
+            return None
+        key = (dimension.__tablename__, value)
+        with self.lock:
+            dim_id = self.ids.get(key)
+            if dim_id is not None:
+                self.ids.move_to_end(key)
+                return dim_id
+        dim_id = dimension.get_or_create_id(value)
+        with self.lock:
+            self.ids[key] = dim_id
+            if len(self.ids) > self.maxsize:
+                self.ids.popitem(last=False)
+        return dim_id
+
+    def clear(self):
+        with self.lock:
+            self.ids.clear()
+
+
+dimension_cache = DimensionCache(app.config.get("DIMENSION_CACHE_SIZE", 10000))
+
+
+class PreparedStatements(object):
+    """ Statements prepared on the server, by their SQL. A connection
+        prepares a statement the first time it runs it and keeps it for as
+        long as it lives in the pool.
+    """
+
+    def __init__(self):
+        self.statements = {}
+        self.lock = threading.Lock()
+
+    def get_statement(self, sql, count):
+        """ Returns the name of the statement and its EXECUTE statement """
+        with self.lock:
+            statement = self.statements.get(sql)
+            if statement is None:
+                # Named after the SQL, the same in every worker
+                name = "telemetry_{}".format(hashlib.sha1(sql.encode('utf-8')).hexdigest()[:16])
+                params = ', '.join([':p{}'.format(i) for i in range(count)])
+                statement = (name, text("EXECUTE {} ({})".format(name, params)))
+                self.statements[sql] = statement
+        return statement
+
+    def execute(self, connection, sql, params):
+        """ Runs sql, with $n parameters, on the connection and returns the
+            result """
+        name, execute = self.get_statement(sql, len(params))
+        # Shared by every checkout of the same database connection
+        prepared = connection.info.get('prepared_statements')
+        if prepared is None:
+            rows = connection.execute(text("SELECT name FROM pg_prepared_statements"))
+            prepared = connection.info['prepared_statements'] = set([r[0] for r in rows])
+        if name not in prepared:
+            connection.execute(text("PREPARE {} AS {}".format(name, sql)))
+            prepared.add(name)
+        return connection.execute(execute, {'p{}'.format(i): p for i, p in enumerate(params)})
+
+
+prepared_statements = PreparedStatements()
+
+
+class Dimension(object):
+    """ A record attribute with few distinct values, stored once in its own
+        table and referenced from the records by id. value_name is the
+        column holding the value. """
+    id = db.Column(db.Integer, primary_key=True)
+
+    @classmethod
+    def get_value_column(cls):
+        return cls.__table__.c[cls.value_name]
+
+    @classmethod
+    def get_values(cls, value):
+        """ Returns the columns of a new row for value """
+        return {cls.value_name: value}
+
+    @classmethod
+    def get_or_create_id(cls, value):
+        table = cls.__table__
+        stmt = postgresql.insert(table).values(cls.get_values(value))
+        stmt = stmt.on_conflict_do_nothing(index_elements=[cls.value_name]).returning(table.c.id)
+        with db.engine.begin() as conn:
+            dim_id = conn.execute(stmt).scalar()
+            if dim_id is None:
+                # Inserted by someone else in the meantime
+                dim_id = conn.execute(db.select([table.c.id]).where(cls.get_value_column() == value)).scalar()
+        return dim_id
+
+
+class Architecture(Dimension, db.Model):
+    __tablename__ = 'architectures'
+    value_name = 'architecture'
+    architecture = db.Column(db.Text, nullable=False, unique=True)
+
+    def __init__(self, architecture):
+        self.architecture = architecture
+
+
+class BiosVersion(Dimension, db.Model):
+    __tablename__ = 'bios_versions'
+    value_name = 'bios_version'
+    bios_version = db.Column(db.Text, nullable=False, unique=True)
+
+    def __init__(self, bios_version):
+        self.bios_version = bios_version
+
+
+class BoardName(Dimension, db.Model):
+    __tablename__ = 'board_names'
+    value_name = 'board_name'
+    board_name = db.Column(db.Text, nullable=False, unique=True)
+
+    def __init__(self, board_name):
+        self.board_name = board_name
+
+
+class Build(Dimension, db.Model):
+    __tablename__ = 'builds'
+    value_name = 'build'
+    build = db.Column(db.Text, nullable=False, unique=True)
+    # Numeric builds, to filter and order on without casting
+    build_number = db.Column(db.Integer, index=True)
+
+    def __init__(self, build):
+        self.build = build
+        self.build_number = Build.get_number(build)
+
+    @staticmethod
+    def get_number(build):
+        if BUILD_NUMBER.match(build):
+            return int(build)
+        return None
+
+    @classmethod
+    def get_values(cls, value):
+        return {'build': value, 'build_number': Build.get_number(value)}
+
+
+class Classification(Dimension, db.Model):
+    __tablename__ = 'classifications'
+    value_name = 'classification'
+    classification = db.Column(db.Text, nullable=False, unique=True)
+
+    def __init__(self, classification):
+        self.classification = classification
+
+
+class CpuModel(Dimension, db.Model):
+    __tablename__ = 'cpu_models'
+    value_name = 'cpu_model'
+    cpu_model = db.Column(db.Text, nullable=False, unique=True)
+
+    def __init__(self, cpu_model):
+        self.cpu_model = cpu_model
+
+
+class HostType(Dimension, db.Model):
+    __tablename__ = 'host_types'
+    value_name = 'host_type'
+    host_type = db.Column(db.Text, nullable=False, unique=True)
+
+    def __init__(self, host_type):
+        self.host_type = host_type
+
+
+class KernelVersion(Dimension, db.Model):
+    __tablename__ = 'kernel_versions'
+    value_name = 'kernel_version'
+    kernel_version = db.Column(db.Text, nullable=False, unique=True)
+
+    def __init__(self, kernel_version):
+        self.kernel_version = kernel_version
+
+
+class SystemName(Dimension, db.Model):
+    __tablename__ = 'system_names'
+    value_name = 'system_name'
+    system_name = db.Column(db.Text, nullable=False, unique=True)
+
+    def __init__(self, system_name):
+        self.system_name = system_name
+
+
+# Operators filtering records on the value of a dimension
+DIMENSION_FILTERS = frozenset([
+    operators.eq, operators.ne, operators.lt, operators.le, operators.gt, operators.ge,
+    operators.like_op, operators.notlike_op, operators.ilike_op, operators.notilike_op,
+    operators.in_op, operators.notin_op,
+    operators.startswith_op, operators.endswith_op, operators.contains_op,
+])
+
+
+class DimensionComparator(Comparator):
+    """ Compares the dimension value of records through its id, a filter
+        on the value becomes id IN (SELECT id FROM dimension WHERE ...) and
+        is answered from the small dimension table and the index on the
+        records column. Selected, grouped or ordered on, the value is a
+        correlated subquery; helpers aggregating many records join the
+        dimension table instead.
+    """
+
+    def __init__(self, dimension, column):
+        self.dimension = dimension
+        self.column = column
+        value = db.select([dimension.get_value_column()]).where(dimension.id == column)
+        Comparator.__init__(self, value.correlate_except(dimension.__table__).as_scalar())
+
+    def operate(self, op, *other, **kwargs):
+        if op not in DIMENSION_FILTERS and not isinstance(op, operators.custom_op):
+            return op(self.expression, *other, **kwargs)
+        if other and other[0] is None:
+            # IS NULL / IS NOT NULL
+            return op(self.column, *other, **kwargs)
+        ids = db.select([self.dimension.id]).where(op(self.dimension.get_value_column(), *other, **kwargs))
+        return self.column.in_(ids)
+
+
+def dimension_property(dimension, relationship, column):
+    """ Record attribute holding the value of a dimension, assigning a value
+        stores its id, a dimension row can be assigned too """
+
+    def fget(self):
+        value = getattr(self, relationship)
+        return getattr(value, dimension.value_name) if value is not None else None
+
+    def fset(self, value):
+        if isinstance(value, dimension):
+            setattr(self, relationship, value)
+        else:
+            setattr(self, column, dimension_cache.get_id(dimension, value))
+
+    fget.__name__ = dimension.value_name
+    return hybrid_property(fget, fset, custom_comparator=lambda cls: DimensionComparator(dimension, getattr(cls, column)))
+
+
+@lru_cache(maxsize=4096)
+def format_timestamp(seconds):
+    # Records received in the same second share their reception time
+    return strftime('%Y-%m-%d %H:%M:%S UTC', gmtime(seconds))
+
+
+# Fields of a record in the API, by the attribute they are read from
+RECORD_FIELDS = OrderedDict([
+    ('id', 'id'),
+    ('machine_id', 'machine_id'),
+    ('machine_type', 'host_type'),
+    ('arch', 'architecture'),
+    ('build', 'build'),
+    ('kernel_version', 'kernel_version'),
+    ('ts_capture', 'timestamp_client'),
+    ('ts_reception', 'timestamp_server'),
+    ('severity', 'severity'),
+    ('classification', 'classification'),
+    ('record_version', 'record_version'),
+    ('payload', 'payload'),
+    ('board_name', 'board_name'),
+    ('bios_version', 'bios_version'),
+    ('cpu_model', 'cpu_model'),
+    ('event_id', 'event_id'),
+    ('external', 'external'),
+])
+
+TIMESTAMP_FIELDS = frozenset(['ts_capture', 'ts_reception'])
+
+
+def to_epoch(timestamp):
+    """ Timestamps are stored in whole seconds """
+    return int(timestamp) if timestamp is not None else None
+
+
+@compiles(CreateColumn, 'postgresql')
+def create_generated_column(element, compiler, **kw):
+    """ A column with a 'generated' expression in its info is a stored
+        generated column """
+    column = element.element
+    ddl = compiler.visit_create_column(element, **kw)
+    if 'generated' in column.info:
+        ddl += " GENERATED ALWAYS AS ({}) STORED".format(column.info['generated'])
+    return ddl
+
+
+def get_partition(timestamp, interval):
+    """ Returns the name and the bounds of the records partition holding
+        timestamp """
+    start = datetime.utcfromtimestamp(timestamp).date()
+    if interval == "day":
+        end = start + timedelta(days=1)
+        name = start.strftime("records_p%Y%m%d")
+    else:
+        start = start.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+        name = start.strftime("records_p%Y%m")
+    return name, calendar.timegm(start.timetuple()), calendar.timegm(end.timetuple())
+
+
+class DuplicateRecordError(Exception):
+    """ The record has an Event-Id that is already stored """
+
+
+class RecordEvent(db.Model):
+    """ Event-Ids of the stored records. The records table is partitioned by
+        reception time, so it cannot have a unique index on Event-Id. """
+    __tablename__ = 'record_events'
+    event_id = db.Column(db.Text, primary_key=True)
+    timestamp_server = db.Column(db.BigInteger, nullable=False, index=True)
+
+    @staticmethod
+    def add_new(rows):
+        """ Stores the events of record rows in the current transaction and
+            returns the set of Event-Ids that were not stored yet """
+        events = {}
+        for row in rows:
+            if Record.has_event_id(row):
+                events.setdefault(row['event_id'], row['timestamp_server'])
+        if not events:
+            return set()
+        # Sorted so concurrent writers lock the events in the same order
+        stmt = postgresql.insert(RecordEvent.__table__)
+        stmt = stmt.values([{'event_id': e, 'timestamp_server': events[e]} for e in sorted(events)])
+        stmt = stmt.on_conflict_do_nothing(index_elements=['event_id'])
+        stmt = stmt.returning(RecordEvent.__table__.c.event_id)
+        return set([r[0] for r in db.session.execute(stmt).fetchall()])
+
+    @staticmethod
+    def purge(before):
+        """ Deletes the events received before `before`, whether their
+            records are kept or not, returns the number of events deleted """
+        count = db.session.query(RecordEvent).filter(RecordEvent.timestamp_server < before).delete(synchronize_session=False)
+        db.session.commit()
+        return count
+
+
 class Record(db.Model):
     __tablename__ = 'records'
-    id = db.Column(db.Integer, primary_key=True)
-    architecture = db.Column(db.Text)
-    bios_version = db.Column(db.Text, default='')
-    board_name = db.Column(db.Text, default='')
-    build = db.Column(db.Text, nullable=False)
-    classification = db.Column(db.Text, nullable=False)
-    cpu_model = db.Column(db.Text, default='')
+    __table_args__ = (
+        # Lists the systems and their builds without reading the records
+        db.Index('ix_records_system_name_id_build_id', 'system_name_id', 'build_id'),
+        # Latest records of a classification or a machine
+        db.Index('ix_records_classification_id_id', 'classification_id', 'id'),
+        db.Index('ix_records_machine_id_id', 'machine_id', 'id'),
+        # Crash reports of a guilty function, by build
+        db.Index('ix_records_guilty_id_build_id', 'guilty_id', 'build_id',
+                 postgresql_where=text('guilty_id IS NOT NULL')),
+        # Last record handled by the processing job, only crashes are processed
+        db.Index('ix_records_processed_id', 'id', postgresql_where=text('processed')),
+        # Records are appended in time order, block ranges are enough
+        db.Index('ix_records_timestamp_client_brin', 'timestamp_client', postgresql_using='brin'),
+        db.Index('ix_records_timestamp_server_brin', 'timestamp_server', postgresql_using='brin'),
+        {'postgresql_partition_by': 'RANGE (timestamp_server)'},
+            )
+    # The partition key is part of the primary key of a partitioned table
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    architecture_id = db.Column(db.Integer, db.ForeignKey('architectures.id'))
+    architecture_dim = db.relationship(Architecture)
+    architecture = dimension_property(Architecture, 'architecture_dim', 'architecture_id')
+    bios_version_id = db.Column(db.Integer, db.ForeignKey('bios_versions.id'))
+    bios_version_dim = db.relationship(BiosVersion)
+    bios_version = dimension_property(BiosVersion, 'bios_version_dim', 'bios_version_id')
+    board_name_id = db.Column(db.Integer, db.ForeignKey('board_names.id'))
+    board_name_dim = db.relationship(BoardName)
+    board_name = dimension_property(BoardName, 'board_name_dim', 'board_name_id')
+    build_id = db.Column(db.Integer, db.ForeignKey('builds.id'), nullable=False, index=True)
+    build_dim = db.relationship(Build)
+    build = dimension_property(Build, 'build_dim', 'build_id')
+    classification_id = db.Column(db.Integer, db.ForeignKey('classifications.id'), nullable=False)
+    classification_dim = db.relationship(Classification)
+    classification = dimension_property(Classification, 'classification_dim', 'classification_id')
+    cpu_model_id = db.Column(db.Integer, db.ForeignKey('cpu_models.id'))
+    cpu_model_dim = db.relationship(CpuModel)
+    cpu_model = dimension_property(CpuModel, 'cpu_model_dim', 'cpu_model_id')
     event_id = db.Column(db.Text, default='')
     external = db.Column(db.Boolean, default=False)
-    host_type = db.Column(db.Text, default='')
-    kernel_version = db.Column(db.Text, default=0)
+    host_type_id = db.Column(db.Integer, db.ForeignKey('host_types.id'))
+    host_type_dim = db.relationship(HostType)
+    host_type = dimension_property(HostType, 'host_type_dim', 'host_type_id')
+    kernel_version_id = db.Column(db.Integer, db.ForeignKey('kernel_versions.id'))
+    kernel_version_dim = db.relationship(KernelVersion)
+    kernel_version = dimension_property(KernelVersion, 'kernel_version_dim', 'kernel_version_id')
     machine_id = db.Column(db.Text, default='')
     payload_version = db.Column(db.Integer)
     record_version = db.Column(db.Integer, default=0)
     severity = db.Column(db.Integer)
-    system_name = db.Column(db.Text)
-    timestamp_client = db.Column(db.Numeric)
-    timestamp_server = db.Column(db.Numeric, nullable=False)
-    payload = db.Column(db.Text, nullable=False)
+    system_name_id = db.Column(db.Integer, db.ForeignKey('system_names.id'))
+    system_name_dim = db.relationship(SystemName)
+    system_name = dimension_property(SystemName, 'system_name_dim', 'system_name_id')
+    timestamp_client = db.Column(db.BigInteger)
+    timestamp_server = db.Column(db.BigInteger, primary_key=True)
+    # Computed by the database, time-bucketed charts group on them
+    client_day = db.Column(db.BigInteger, server_default=FetchedValue(), info={'generated': CLIENT_DAY})
+    client_week = db.Column(db.BigInteger, server_default=FetchedValue(), info={'generated': CLIENT_WEEK})
+    # Either the payload itself, or the hash of a payload in the payloads table
+    payload_inline = db.Column('payload', db.Text)
+    payload_hash = db.Column(db.LargeBinary, db.ForeignKey('payloads.hash'), index=True)
+    payload = db.column_property(db.func.coalesce(payload_inline,
+                                                  db.select([Payload.payload])
+                                                  .where(Payload.hash == payload_hash)
+                                                  .correlate_except(Payload.__table__)
+                                                  .as_scalar()),
+                                 deferred=True)
 
     processed = db.Column(db.Boolean, default=False)
     guilty_id = db.Column(db.Integer, db.ForeignKey('guilty.id'))
 
     guilty = db.Column(db.Text, default='')
-    guilty = db.relationship('Guilty', backref=db.backref('records', lazy='dynamic'), lazy='joined')
+    # Only the crash views need the guilty function, loaded on access
+    guilty = db.relationship('Guilty', backref=db.backref('records', lazy='dynamic'))
 
     def __init__(self, machine_id, host_type, severity, classification, build, architecture, kernel_version,
                  record_version, ts_capture, ts_reception, payload_version, system_name,
@@ -104,8 +640,8 @@ class Record(db.Model):
         self.kernel_version = kernel_version
         self.record_version = record_version
         self.severity = severity
-        self.timestamp_client = ts_capture
-        self.timestamp_server = ts_reception
+        self.timestamp_client = to_epoch(ts_capture)
+        self.timestamp_server = to_epoch(ts_reception)
         self.payload_version = payload_version
         self.system_name = system_name
         self.external = external
@@ -113,7 +649,9 @@ class Record(db.Model):
         self.bios_version = bios_version
         self.cpu_model = cpu_model
         self.event_id = event_id
-        self.payload = payload
+        self.payload_inline, self.payload_hash = Payload.split(payload)
+        # Stored by insert_payload ahead of the record
+        self.new_payload = payload if self.payload_hash is not None else None
 
 
     def __repr__(self):
@@ -122,28 +660,50 @@ class Record(db.Model):
     def __str__(self):
         return str(self.to_dict())
 
-    def to_dict(self):
-        record = {
-            'id': self.id,
-            'machine_id': self.machine_id,
-            'machine_type': self.host_type,
-            'arch': self.architecture,
-            'build': self.build,
-            'kernel_version': self.kernel_version,
-            'ts_capture': strftime('%Y-%m-%d %H:%M:%S UTC', gmtime(self.timestamp_client)),
-            'ts_reception': strftime('%Y-%m-%d %H:%M:%S UTC', gmtime(self.timestamp_server)),
-            'severity': self.severity,
-            'classification': self.classification,
-            'record_version': self.record_version,
-            'payload': self.payload,
-            'board_name': self.board_name,
-            'bios_version': self.bios_version,
-            'cpu_model': self.cpu_model,
-            'event_id': self.event_id,
-            'external': self.external,
-        }
+    def to_dict(self, fields=None):
+        return Record.format_fields(self, fields)
+
+    @staticmethod
+    def format_fields(row, fields=None):
+        """ Fields of a record, or of a row of the columns selected by
+            query_records, all of them by default """
+        record = {}
+        for field in (fields or RECORD_FIELDS):
+            value = getattr(row, RECORD_FIELDS[field])
+            if field in TIMESTAMP_FIELDS:
+                value = format_timestamp(int(value))
+            record[field] = value
         return record
 
+    def get_id(self):
+        """ Primary key of a stored record. Unlike self.id it does not
+            reload the whole row when the instance expired on commit """
+        return inspect(self).identity[0]
+
+    @staticmethod
+    def format_record(record_id, record):
+        """ Same representation as to_dict, built from the values a record
+            was created with instead of from the stored row """
+        return {
+            'id': record_id,
+            'machine_id': record['machine_id'],
+            'machine_type': record['host_type'],
+            'arch': record['architecture'],
+            'build': record['build'],
+            'kernel_version': record['kernel_version'],
+            'ts_capture': format_timestamp(int(record['ts_capture'])),
+            'ts_reception': format_timestamp(int(record['ts_reception'])),
+            'severity': int(record['severity']),
+            'classification': record['classification'],
+            'record_version': int(record['record_version']),
+            'payload': record['payload'],
+            'board_name': record['board_name'],
+            'bios_version': record['bios_version'],
+            'cpu_model': record['cpu_model'],
+            'event_id': record['event_id'],
+            'external': record['external'],
+        }
+
     # for the exported CSV rows
     def to_list(self):
         record = [
@@ -167,6 +727,9 @@ class Record(db.Model):
                record_version, ts_capture, ts_reception, payload_version, system_name,
                board_name, bios_version, cpu_model, event_id, external, payload):
         try:
+            event = {'record_version': record_version, 'event_id': event_id, 'timestamp_server': to_epoch(ts_reception)}
+            if Record.has_event_id(event) and not RecordEvent.add_new([event]):
+                raise DuplicateRecordError(event_id)
             record = Record(machine_id, host_type, severity, classification, build, architecture, kernel_version,
                             record_version, ts_capture, ts_reception, payload_version, system_name,
                             board_name, bios_version, cpu_model, event_id, external, payload)
@@ -177,16 +740,154 @@ class Record(db.Model):
             db.session.rollback()
             raise
 
+    @staticmethod
+    def insert_prepared(record):
+        """ Inserts a record without the ORM unit of work, its event, its
+            payload and the record itself go through statements prepared on
+            the connection of the session. record has the same keys as the
+            arguments of Record.create. Returns the id of the new row.
+        """
+        row = Record.get_row_values(record)
+        row['processed'] = False
+        names = tuple(sorted(row))
+        info = {}
+        try:
+            connection = db.session.connection()
+            info = connection.info
+            if Record.has_event_id(row):
+                result = prepared_statements.execute(connection, EVENT_INSERT, (row['event_id'], row['timestamp_server']))
+                if result.first() is None:
+                    raise DuplicateRecordError(row['event_id'])
+            for payload in Payload.get_rows([record], [row]):
+                prepared_statements.execute(connection, PAYLOAD_INSERT.format('($1, $2)'),
+                                            (payload['hash'], payload['payload']))
+            sql = RECORD_INSERT.format(', '.join(names), ', '.join(['${}'.format(i + 1) for i in range(len(names))]))
+            record_id = prepared_statements.execute(connection, sql, [row[n] for n in names]).scalar()
+            db.session.commit()
+            return record_id
+        except:
+            db.session.rollback()
+            # Looked up again, statements prepared by a failed transaction
+            # may or may not be there
+            info.pop('prepared_statements', None)
+            raise
+
+    @staticmethod
+    def create_many(records):
+        """ Inserts many records with a single multi-row INSERT statement.
+
+            Every element of records is a dict with the same keys as the
+            arguments of Record.create. Returns the ids assigned to the new
+            rows, in the same order as the input, with None for the records
+            whose Event-Id is already stored.
+        """
+        if not records:
+            return []
+        rows = [Record.get_row_values(rec) for rec in records]
+        table = Record.__table__
+        try:
+            new_events = RecordEvent.add_new(rows)
+            # Only the first copy of a new event is stored
+            stored = []
+            for row in rows:
+                if Record.has_event_id(row):
+                    stored.append(row['event_id'] in new_events)
+                    new_events.discard(row['event_id'])
+                else:
+                    stored.append(True)
+            new_records = [rec for rec, keep in zip(records, stored) if keep]
+            new_rows = [row for row, keep in zip(rows, stored) if keep]
+            payload_rows = Payload.get_rows(new_records, new_rows)
+            if payload_rows:
+                db.session.execute(Payload.get_insert(payload_rows))
+            if new_rows:
+                # RETURNING does not follow the order of the VALUES list, the
+                # ids are drawn from the sequence and assigned beforehand
+                ids = db.session.execute(text("SELECT nextval('records_id_seq') FROM generate_series(1, :count)"),
+                                         {'count': len(new_rows)}).fetchall()
+                for row, (record_id,) in zip(new_rows, ids):
+                    row['id'] = record_id
+                db.session.execute(postgresql.insert(table).values(new_rows))
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+        new_ids = iter([row['id'] for row in new_rows])
+        return [next(new_ids) if keep else None for keep in stored]
+
+    @staticmethod
+    def has_event_id(record):
+        return int(record['record_version']) >= 4
+
+    @staticmethod
+    def copy_many(records):
+        """ Bulk loads records with COPY ... FROM STDIN, which is much cheaper
+            than INSERT for large numbers of rows but does not return ids.
+            Returns the number of records stored, events already stored are
+            skipped.
+        """
+        if not records:
+            return 0
+        rows = [Record.get_row_values(rec) for rec in records]
+        payload_rows = Payload.get_rows(records, rows)
+        columns = sorted(rows[0].keys()) + ['processed']
+        data = io.StringIO()
+        for row in rows:
+            row['processed'] = False
+            data.write(','.join([copy_csv_value(row[c]) for c in columns]))
+            data.write('\n')
+        data.seek(0)
+        column_list = ', '.join(columns)
+        conn = db.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            if payload_rows:
+                execute_values(cursor, PAYLOAD_INSERT.format('%s'), [(r['hash'], r['payload']) for r in payload_rows])
+            # COPY cannot skip duplicated events, load a staging table first
+            cursor.execute("CREATE TEMP TABLE records_copy ON COMMIT DROP AS "
+                           "SELECT {} FROM records WITH NO DATA".format(column_list))
+            cursor.copy_expert("COPY records_copy ({}) FROM STDIN WITH (FORMAT csv)".format(column_list), data)
+            cursor.execute(COPY_NEW_RECORDS.format(column_list))
+            count = cursor.rowcount
+            cursor.close()
+            conn.commit()
+            return count
+        except:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def get_row_values(record):
+        # Maps Record.create arguments to column names
+        row = dict(record)
+        row['timestamp_client'] = to_epoch(row.pop('ts_capture'))
+        row['timestamp_server'] = to_epoch(row.pop('ts_reception'))
+        row['payload'], row['payload_hash'] = Payload.split(row['payload'])
+        for name, dimension in RECORD_DIMENSIONS:
+            row[name + '_id'] = dimension_cache.get_id(dimension, row.pop(name))
+        return row
+
     @staticmethod
     def query_records(build, classification, severity, machine_id,
                       data_source=None, limit=None, payload=None,
-                      not_payload=None, from_id=None):
-        records = Record.query
+                      not_payload=None, from_id=None, since=None, ts_capture=None, columns=None):
+        """ Returns the query of the records matching the filters, latest
+            first. from_id excludes the records from that id on, since and
+            ts_capture exclude the records received and captured before
+            these timestamps. Given the attribute names in columns, rows of
+            only these columns are returned instead of records, the payload
+            is not read unless it is one of them. """
+        if columns is not None:
+            records = Record.query_columns(columns)
+        else:
+            records = Record.query.options(undefer(Record.payload))
 
         if build is not None:
-            records = records.filter_by(build=build)
+            records = records.filter(Record.build == build)
         if classification is not None:
-            records = records.filter_by(classification=classification)
+            records = records.filter(Record.classification == classification)
         if severity is not None:
             records = records.filter(Record.severity == severity)
         if machine_id is not None:
@@ -202,6 +903,10 @@ class Record(db.Model):
                 records = records.filter(Record.external == False)
         if from_id is not None:
             records = records.filter(Record.id < from_id)
+        if since is not None:
+            records = records.filter(Record.timestamp_server >= since)
+        if ts_capture is not None:
+            records = records.filter(Record.timestamp_client >= ts_capture)
 
         records = records.order_by(Record.id.desc())
 
@@ -210,6 +915,26 @@ class Record(db.Model):
 
         return records
 
+    @staticmethod
+    def query_columns(columns):
+        """ Returns the query of the given record attributes. The values
+            of dimensions are read from their tables joined on the records,
+            the dimension properties only serve in filters. """
+        dimensions = dict(RECORD_DIMENSIONS)
+        entities = []
+        joined = []
+        for c in columns:
+            if c in dimensions:
+                entities.append(label(c, dimensions[c].get_value_column()))
+                joined.append(dimensions[c])
+            else:
+                entities.append(label(c, getattr(Record, c)))
+        records = db.session.query(*entities).select_from(Record)
+        for dimension in joined:
+            column = getattr(Record, '{}_id'.format(dimension.value_name))
+            records = records.outerjoin(dimension, dimension.id == column)
+        return records
+
     @staticmethod
     def get_record(record_id):
         record = Record.query.filter_by(id=record_id).first()
@@ -218,7 +943,7 @@ class Record(db.Model):
     @staticmethod
     def filter_records(build, classification, severity, machine_id=None, system_name=None, limit=None, from_date=None,
                        to_date=None, payload=None, not_payload=None, data_source=None, lastid=None):
-        records = Record.query
+        records = Record.query.options(undefer(Record.payload))
         if build is not None:
             records = records.filter_by(build=build)
         if classification is not None:
@@ -258,63 +983,41 @@ class Record(db.Model):
         return records
 
     @staticmethod
-    def delete_records():
-        MAX_DAYS_KEEP_UNFILTERED_RECORDS = app.config.get("MAX_DAYS_KEEP_UNFILTERED_RECORDS", 35)
-        PURGE_FILTERED_RECORDS = app.config.get("PURGE_FILTERED_RECORDS", {})
-        try:
-            def purge_field(field):
-                for name in PURGE_FILTERED_RECORDS[field].keys():
-                    if PURGE_FILTERED_RECORDS[field][name]:
-                        age = time() - PURGE_FILTERED_RECORDS[field][name] * 24 * 60 * 60
-                        q = db.session.query(Record)
-                        if field == 'classification':
-                            q = q.filter(Record.classification.like(name.replace("*", "%")))
-                        else:
-                            q = q.filter(getattr(Record, field) == name)
-                        q = q.filter(Record.timestamp_server < age)
-                        if q.all():
-                            count = db.session.query(Record).filter(Record.id.in_([x.id for x in q.all()])).delete(synchronize_session=False)
-                            print("Deleted {} {} records".format(count, name))
-            for field in PURGE_FILTERED_RECORDS.keys():
-                purge_field(field)
-            if MAX_DAYS_KEEP_UNFILTERED_RECORDS:
-                unfiltered_age = time() - MAX_DAYS_KEEP_UNFILTERED_RECORDS * 24 * 60 * 60
-                q = db.session.query(Record.id)
-                for field in PURGE_FILTERED_RECORDS.keys():
-                    if field == 'classification':
-                        for classification in PURGE_FILTERED_RECORDS[field].keys():
-                            q = q.filter(~Record.classification.like(classification.replace("*", "%")))
-                    else:
-                        for name in PURGE_FILTERED_RECORDS[field].keys():
-                            q = q.filter(getattr(Record, field) != name)
-                q = q.filter(Record.timestamp_server < unfiltered_age)
-                if q.all():
-                    count = db.session.query(Record).filter(Record.id.in_([x.id for x in q.all()])).delete(synchronize_session=False)
-                    print("Deleted {} old records".format(count))
-            db.session.commit()
-        except Exception as e:
-            app.logger.error("Record purging failed")
-            app.logger.error(e)
-            db.session.rollback()
+    def delete_records(archive=None, throttle=None, time_budget=None):
+        """ Purges the records past their retention, returns the statistics
+            of each purge rule """
+        if time_budget is None:
+            time_budget = app.config.get("PURGE_TIME_BUDGET", 3600)
+        purge = RecordPurge(RecordPurge.get_rules(),
+                            app.config.get("PURGE_CHUNK_SIZE", 10000),
+                            time_budget, archive, throttle)
+        stats = purge.run()
+        for rule in stats:
+            print("Deleted {deleted} {rule} records in {seconds:.1f}s ({rate:.0f}/s){incomplete}".format(
+                incomplete="" if rule['complete'] else ", out of time", **rule))
+        return stats
 
     @staticmethod
     def get_recordcnts_by_build():
-        q = db.session.query(Record.build, db.func.count(Record.id))
-        q = q.filter(Record.build.op('~')('^[0-9]+$'))
-        q = q.group_by(Record.build).order_by(cast(Record.build, db.Integer)).all()
+        q = db.session.query(Build.build, db.func.count(Record.id))
+        q = q.join(Record, Record.build_id == Build.id)
+        q = q.filter(Build.build_number.isnot(None))
+        q = q.group_by(Build.build, Build.build_number).order_by(Build.build_number).all()
         return q
 
     @staticmethod
     def get_builds():
-        q = db.session.query(Record.build).distinct()
-        q = q.filter(Record.build.op('~')('^[0-9]+$'))
-        q = q.order_by(Record.build)
-        return sorted(q.all(), key=lambda x: LooseVersion(x[0]), reverse=True)
+        q = db.session.query(Build.build)
+        q = q.filter(Build.build_number.isnot(None))
+        q = q.filter(db.exists().where(Record.build_id == Build.id))
+        q = q.order_by(desc(Build.build_number))
+        return q.all()
 
     @staticmethod
     def get_recordcnts_by_classification():
-        q = db.session.query(Record.classification, db.func.count(Record.id).label('total'))
-        q = q.group_by(Record.classification)
+        q = db.session.query(Classification.classification, db.func.count(Record.id).label('total'))
+        q = q.join(Record, Record.classification_id == Classification.id)
+        q = q.group_by(Classification.classification)
         q = q.order_by(desc('total'))
         return q.all()
 
@@ -325,7 +1028,8 @@ class Record(db.Model):
 
     @staticmethod
     def get_classifications(with_regex=False):
-        q = db.session.query(Record.classification).distinct()
+        q = db.session.query(Classification.classification)
+        q = q.filter(db.exists().where(Record.classification_id == Classification.id))
         if with_regex:
             classes = [Record.expand_class(c[0].split('/')) for c in q.all()]
             return sorted(set(itertools.chain(*classes)))
@@ -334,7 +1038,11 @@ class Record(db.Model):
 
     @staticmethod
     def get_os_map():
-        q = db.session.query(Record.system_name, Record.build).order_by(Record.system_name).group_by(Record.system_name, Record.build).all()
+        pairs = db.session.query(Record.system_name_id, Record.build_id).distinct().subquery()
+        q = db.session.query(SystemName.system_name, Build.build)
+        q = q.join(pairs, pairs.c.system_name_id == SystemName.id)
+        q = q.join(Build, Build.id == pairs.c.build_id)
+        q = q.order_by(SystemName.system_name).all()
         result = {}
         for x in q:
             result.setdefault(x[0], []).append(x[1])
@@ -342,8 +1050,9 @@ class Record(db.Model):
 
     @staticmethod
     def get_recordcnts_by_machine_type():
-        q = db.session.query(Record.host_type, db.func.count(Record.id).label('total'))
-        q = q.group_by(Record.host_type)
+        q = db.session.query(HostType.host_type, db.func.count(Record.id).label('total'))
+        q = q.join(Record, Record.host_type_id == HostType.id)
+        q = q.group_by(HostType.host_type)
         q = q.order_by(desc('total'))
         return q.all()
 
@@ -354,40 +1063,42 @@ class Record(db.Model):
 
     @staticmethod
     def get_crashcnts_by_class(classes=None):
-        q = db.session.query(Record.classification, db.func.count(Record.id))
+        q = db.session.query(Classification.classification, db.func.count(Record.id))
+        q = q.join(Record, Record.classification_id == Classification.id)
         if classes:
-            q = q.filter(Record.classification.in_(classes))
+            q = q.filter(Classification.classification.in_(classes))
         else:
-            q = q.filter(Record.classification.like('org.clearlinux/crash/%'))
-        q = q.group_by(Record.classification)
+            q = q.filter(Classification.classification.like('org.clearlinux/crash/%'))
+        q = q.group_by(Classification.classification)
         return q.all()
 
     @staticmethod
     def get_crashcnts_by_build(classes=None):
-        q = db.session.query(Record.build, db.func.count(Record.id))
+        q = db.session.query(Build.build, db.func.count(Record.id))
+        q = q.join(Record, Record.build_id == Build.id)
         if not classes:
             classes = ['org.clearlinux/crash/clr']
         q = q.filter(Record.classification.in_(classes))
-        q = q.filter(Record.build.op('~')('^[0-9]+$'))
-        q = q.group_by(Record.build)
-        q = q.order_by(desc(cast(Record.build, db.Integer)))
+        q = q.filter(Build.build_number.isnot(None))
+        q = q.group_by(Build.build, Build.build_number)
+        q = q.order_by(desc(Build.build_number))
         q = q.limit(10)
         return q.all()
 
     @staticmethod
     def get_top_crash_guilties(classes=None):
-        q = db.session.query(Guilty.function, Guilty.module, Record.build, db.func.count(Record.id).label('total'), Guilty.id, Guilty.comment)
-        q = q.join(Record)
+        q = db.session.query(Guilty.function, Guilty.module, Build.build, db.func.count(Record.id).label('total'), Guilty.id, Guilty.comment)
+        q = q.join(Record, Record.guilty_id == Guilty.id)
+        q = q.join(Build, Build.id == Record.build_id)
         if not classes:
             classes = ['org.clearlinux/crash/clr']
         q = q.filter(Record.classification.in_(classes))
-        q = q.filter(Record.build.op('~')('^[0-9][0-9]+$'))
-        q = q.filter(cast(Record.build, db.Integer) <= 100000)
+        q = q.filter(Build.build_number.between(10, 100000))
         q = q.filter(Guilty.hide == False)
-        q = q.group_by(Guilty.function, Guilty.module, Guilty.comment, Guilty.id, Record.build)
-        q = q.order_by(desc(cast(Record.build, db.Integer)), desc('total'))
+        q = q.group_by(Guilty.function, Guilty.module, Guilty.comment, Guilty.id, Build.build, Build.build_number)
+        q = q.order_by(desc(Build.build_number), desc('total'))
         # query for records created in the last week (~ 10 Clear builds)
-        q = q.filter(Record.build.in_(sorted(tuple(set([x[2] for x in q.all()])), key=lambda x: int(x))[-8:]))
+        q = q.filter(Build.build.in_(sorted(tuple(set([x[2] for x in q.all()])), key=lambda x: int(x))[-8:]))
         interval_sec = 24 * 60 * 60 * 7
         current_time = time()
         sec_in_past = current_time - interval_sec
@@ -474,12 +1185,13 @@ class Record(db.Model):
 
     @staticmethod
     def get_machine_ids_for_guilty(id, most_recent=None):
-        q = db.session.query(Record.build, Record.machine_id, db.func.count(Record.id).label('total'), Record.guilty_id)
+        q = db.session.query(Build.build, Record.machine_id, db.func.count(Record.id).label('total'), Record.guilty_id)
+        q = q.join(Record, Record.build_id == Build.id)
         q = q.filter(Record.guilty_id == id)
         q = q.filter(Record.system_name == 'clear-linux-os')
-        q = q.filter(Record.build.op('~')('^[0-9][0-9]+$'))
-        q = q.group_by(Record.build, Record.machine_id, Record.guilty_id)
-        q = q.order_by(desc(cast(Record.build, db.Integer)), desc('total'))
+        q = q.filter(Build.build_number >= 10)
+        q = q.group_by(Build.build, Build.build_number, Record.machine_id, Record.guilty_id)
+        q = q.order_by(desc(Build.build_number), desc('total'))
         if most_recent:
             interval_sec = 24 * 60 * 60 * int(most_recent)
             current_time = time()
@@ -514,6 +1226,17 @@ class Record(db.Model):
         q = q.order_by(desc(Record.timestamp_client))
         return q
 
+    @staticmethod
+    def get_weekly_counts(classes, since):
+        """ Counts the records of classes captured since `since` by
+            classification and week, see CLIENT_WEEK """
+        q = db.session.query(Classification.classification, Record.client_week, db.func.count(Record.id))
+        q = q.join(Record, Record.classification_id == Classification.id)
+        q = q.filter(Classification.classification.in_(classes))
+        q = q.filter(Record.timestamp_client >= since)
+        q = q.group_by(Classification.classification, Record.client_week)
+        return q.all()
+
     @staticmethod
     def get_heartbeat_msgs(most_recent=None):
         # These two expressions are SQL CASE conditional expressions, later
@@ -521,10 +1244,11 @@ class Record(db.Model):
         internal_expr = case([(Record.external == False, Record.machine_id), ]).label('internal_count')
         external_expr = case([(Record.external == True, Record.machine_id), ]).label('external_count')
 
-        q = db.session.query(Record.build, db.func.count(db.distinct(internal_expr)), db.func.count(db.distinct(external_expr)))
+        q = db.session.query(Build.build, db.func.count(db.distinct(internal_expr)), db.func.count(db.distinct(external_expr)))
+        q = q.join(Record, Record.build_id == Build.id)
         q = q.filter(Record.classification == "org.clearlinux/heartbeat/ping")
         q = q.filter(Record.system_name == 'clear-linux-os')
-        q = q.group_by(Record.build)
+        q = q.group_by(Build.build, Build.build_number)
 
         if most_recent:
             interval_sec = 24 * 60 * 60 * int(most_recent)
@@ -532,9 +1256,59 @@ class Record(db.Model):
             sec_in_past = current_time - interval_sec
             q = q.filter(Record.timestamp_client > sec_in_past)
 
-        q = q.order_by(cast(Record.build, db.Integer))
+        q = q.order_by(Build.build_number)
         return q.all()
 
+    @staticmethod
+    def get_partitions():
+        """ Returns the name and the bounds of each records partition, the
+            default partition excluded """
+        sql = text("SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+                   "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'records'::regclass")
+        partitions = []
+        for name, bounds in db.session.execute(sql).fetchall():
+            match = PARTITION_BOUNDS.search(bounds)
+            if match:
+                partitions.append((name, float(match.group(1)), float(match.group(2))))
+        return sorted(partitions, key=lambda p: p[1])
+
+    @staticmethod
+    def ensure_partitions(now=None):
+        """ Creates the partitions for the current and the next
+            RECORDS_PARTITIONS_AHEAD intervals, returns their names """
+        timestamp = now or time()
+        existing = Record.get_partitions()
+        created = []
+        for _ in range(RECORDS_PARTITIONS_AHEAD + 1):
+            name, start, end = get_partition(timestamp, RECORDS_PARTITION_INTERVAL)
+            timestamp = end
+            if any(s < end and start < e for _, s, e in existing):
+                continue
+            try:
+                db.session.execute(text('CREATE TABLE "{}" PARTITION OF records FOR VALUES FROM ({}) TO ({})'.format(name, start, end)))
+                db.session.commit()
+                created.append(name)
+            except SQLAlchemyError as e:
+                # The default partition already holds records of this interval
+                app.logger.error("Could not create partition {}".format(name))
+                app.logger.error(e)
+                db.session.rollback()
+        return created
+
+    @staticmethod
+    def drop_partitions(before):
+        """ Drops the partitions holding only records received before
+            `before`, returns the names of the partitions dropped """
+        dropped = []
+        for name, start, end in Record.get_partitions():
+            if end <= before:
+                db.session.execute(text('DROP TABLE "{}"'.format(name)))
+                dropped.append(name)
+        if dropped:
+            DataVersion.bump('records')
+        db.session.commit()
+        return dropped
+
     @staticmethod
     def get_latest_timestamp_server():
         sql = text("SELECT timestamp_server FROM records WHERE id = (SELECT MAX(id) FROM records)")
@@ -542,6 +1316,187 @@ class Record(db.Model):
         return result.first()[0]
 
 
+# Columns of the purged records passed to the archive
+ARCHIVE_COLUMNS = (
+    'id', 'machine_id', 'host_type', 'severity', 'classification', 'build', 'architecture',
+    'kernel_version', 'record_version', 'timestamp_client', 'timestamp_server', 'payload_version',
+    'system_name', 'board_name', 'bios_version', 'cpu_model', 'event_id', 'external', 'processed',
+    'payload',
+)
+
+
+class PurgeRule(object):
+    """ Records matching condition are kept for days after their reception """
+
+    def __init__(self, name, days, condition):
+        self.name = name
+        self.days = days
+        self.condition = condition
+
+
+class RecordPurge(object):
+    """ Deletes the records past their retention without loading them. Each
+        rule deletes in ranges of chunk_size ids, one transaction per range,
+        so locks are held briefly and the purge can resume at any point. The
+        purge stops after time_budget seconds, 0 lets it run to completion.
+        Rows are passed to archive.write before they are deleted, a chunk is
+        kept if writing it fails. throttle.wait is called with the duration
+        of each chunk, once it is committed.
+    """
+
+    def __init__(self, rules, chunk_size, time_budget, archive=None, throttle=None):
+        self.rules = rules
+        self.chunk_size = chunk_size
+        self.time_budget = time_budget
+        self.archive = archive
+        self.throttle = throttle
+
+    @staticmethod
+    def get_rules():
+        """ Returns the rules of PURGE_FILTERED_RECORDS, followed by the rule
+            of MAX_DAYS_KEEP_UNFILTERED_RECORDS for the records matching no
+            filter. Filters of 0 days keep their records forever. """
+        max_days = app.config.get("MAX_DAYS_KEEP_UNFILTERED_RECORDS", 35)
+        filters = app.config.get("PURGE_FILTERED_RECORDS", {})
+        rules = []
+        unfiltered = []
+        for field in filters.keys():
+            for name in filters[field].keys():
+                if field == 'classification':
+                    condition = Record.classification.like(name.replace("*", "%"))
+                else:
+                    condition = getattr(Record, field) == name
+                unfiltered.append(~condition)
+                if filters[field][name]:
+                    rules.append(PurgeRule(str(name), filters[field][name], condition))
+        if max_days:
+            rules.append(PurgeRule("old", max_days, db.and_(*unfiltered) if unfiltered else true()))
+        return rules
+
+    def get_partition_cutoff(self, now):
+        # Partitions past the longest retention only hold records of expired
+        # rules, unless a filter keeps some records forever
+        filters = app.config.get("PURGE_FILTERED_RECORDS", {})
+        retention = [app.config.get("MAX_DAYS_KEEP_UNFILTERED_RECORDS", 35)]
+        for field in filters.keys():
+            retention.extend(filters[field].values())
+        if not all(retention):
+            return None
+        return now - max(retention) * 24 * 60 * 60
+
+    def drop_partitions(self, cutoff):
+        try:
+            dropped = Record.drop_partitions(cutoff)
+            if dropped:
+                print("Dropped partitions {}".format(", ".join(dropped)))
+        except Exception as e:
+            app.logger.error("Partition purging failed")
+            app.logger.error(e)
+            db.session.rollback()
+
+    def purge_events(self, now):
+        # The events only serve the detection of retries, they expire on
+        # their own even when records are kept forever
+        try:
+            count = RecordEvent.purge(now - EVENT_ID_RETENTION_DAYS * 24 * 60 * 60)
+            if count:
+                print("Deleted {} expired events".format(count))
+        except Exception as e:
+            app.logger.error("Event purging failed")
+            app.logger.error(e)
+            db.session.rollback()
+
+    def run(self, now=None):
+        """ Drops the expired partitions, applies every rule and deletes the
+            payloads left unreferenced and the expired events. Returns the
+            statistics of each rule. """
+        now = now or time()
+        deadline = now + self.time_budget if self.time_budget else None
+        cutoff = self.get_partition_cutoff(now)
+        if cutoff is not None and self.archive is None:
+            self.drop_partitions(cutoff)
+        stats = []
+        complete = True
+        for rule in self.rules:
+            try:
+                stats.append(self.purge(rule, now - rule.days * 24 * 60 * 60, deadline))
+                complete = complete and stats[-1]['complete']
+            except Exception as e:
+                app.logger.error("Record purging failed for {}".format(rule.name))
+                app.logger.error(e)
+                db.session.rollback()
+                complete = False
+        # The expired partitions are only dropped once the rules have
+        # archived every record in them
+        if cutoff is not None and self.archive is not None and complete:
+            self.drop_partitions(cutoff)
+        count = Payload.delete_unreferenced()
+        if count:
+            print("Deleted {} unreferenced payloads".format(count))
+        self.purge_events(now)
+        return stats
+
+    def purge(self, rule, cutoff, deadline):
+        """ Deletes the records of rule received before cutoff, from the
+            lowest id to the highest id of a record older than cutoff """
+        start = time()
+        stats = {'rule': rule.name, 'deleted': 0, 'chunks': 0, 'complete': True}
+        low = db.session.query(db.func.min(Record.id)).scalar()
+        high = db.session.query(db.func.max(Record.id)).filter(Record.timestamp_server < cutoff).scalar()
+        db.session.commit()
+        while low is not None and high is not None and low <= high:
+            if deadline is not None and time() >= deadline:
+                stats['complete'] = False
+                break
+            chunk_start = time()
+            q = db.session.query(Record)
+            q = q.filter(Record.id >= low, Record.id < low + self.chunk_size)
+            q = q.filter(Record.timestamp_server < cutoff, rule.condition)
+            if self.archive is not None:
+                rows = q.with_entities(*[getattr(Record, c).label(c) for c in ARCHIVE_COLUMNS])
+                rows = [r._asdict() for r in rows.with_for_update().all()]
+                if rows:
+                    self.archive.write(rows)
+                # Only the rows archived are deleted
+                q = db.session.query(Record).filter(Record.id.in_([r['id'] for r in rows]))
+            stats['deleted'] += q.delete(synchronize_session=False)
+            db.session.commit()
+            stats['chunks'] += 1
+            low += self.chunk_size
+            if self.throttle is not None:
+                self.throttle.wait(time() - chunk_start)
+        stats['seconds'] = time() - start
+        stats['rate'] = stats['deleted'] / stats['seconds'] if stats['seconds'] else 0.0
+        return stats
+
+
+# Records outside of every partition, the partitions of the coming
+# intervals are created by Record.ensure_partitions
+event.listen(Record.__table__, 'after_create',
+             DDL("CREATE TABLE records_default PARTITION OF records DEFAULT"))
+
+
+# Record.create argument names and their dimension tables
+RECORD_DIMENSIONS = (
+    ('architecture', Architecture),
+    ('bios_version', BiosVersion),
+    ('board_name', BoardName),
+    ('build', Build),
+    ('classification', Classification),
+    ('cpu_model', CpuModel),
+    ('host_type', HostType),
+    ('kernel_version', KernelVersion),
+    ('system_name', SystemName),
+)
+
+
+@event.listens_for(Record, 'before_insert')
+def insert_payload(mapper, connection, target):
+    payload = getattr(target, 'new_payload', None)
+    if payload is not None:
+        connection.execute(Payload.get_insert([{'hash': target.payload_hash, 'payload': payload}]))
+
+
 class GuiltyBlacklist(db.Model):
     __tablename__ = 'guilty_blacklisted'
     id = db.Column(db.Integer, primary_key=True)
@@ -614,4 +1569,82 @@ class GuiltyBlacklist(db.Model):
             db.session.rollback()
             raise
 
+
+class DataVersion(db.Model):
+    """ Counts the changes to the data the views depend on besides the new
+        records, bumped by statement triggers on the guilty tables and on
+        the updates and deletes of records """
+    __tablename__ = 'data_versions'
+    name = db.Column(db.Text, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    modified = db.Column(db.BigInteger, nullable=False)
+
+    @staticmethod
+    def bump(name):
+        """ For the changes no trigger sees, like dropped partitions """
+        db.session.execute(text(BUMP_DATA_VERSION), {'name': name})
+
+    @staticmethod
+    def get_version(max_age=None):
+        """ Returns an opaque token of the current version of the data and
+            the epoch time it was reached. Given max_age the version also
+            changes every max_age seconds, for the views on a time window
+            or served from a cache of that age. """
+        last_id, last_reception, versions, modified = db.session.execute(text(DATA_VERSION)).first()
+        modified = max([int(modified), int(last_reception or 0)])
+        token = "{}-{}".format(last_id, versions)
+        if max_age:
+            period = int(time()) // max_age
+            token = "{}-{}".format(token, period)
+            modified = max(modified, period * max_age)
+        return token, modified
+
+
+# Sequence values are not rolled back, new records may change the
+# version before they are committed, never after
+DATA_VERSION = """
+  SELECT (SELECT last_value FROM records_id_seq),
+         (SELECT timestamp_server FROM records ORDER BY id DESC LIMIT 1),
+         (SELECT COALESCE(string_agg(name || '.' || version, '-' ORDER BY name), '') FROM data_versions),
+         (SELECT COALESCE(max(modified), 0) FROM data_versions)
+"""
+
+BUMP_DATA_VERSION = """
+  INSERT INTO data_versions (name, version, modified)
+  VALUES (:name, 1, extract(epoch FROM now())::bigint)
+  ON CONFLICT (name) DO UPDATE SET version = data_versions.version + 1, modified = EXCLUDED.modified
+"""
+
+CREATE_BUMP_FUNCTION = """
+  CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+  BEGIN
+    INSERT INTO data_versions (name, version, modified)
+    VALUES (TG_ARGV[0], 1, extract(epoch FROM now())::bigint)
+    ON CONFLICT (name) DO UPDATE SET version = data_versions.version + 1, modified = EXCLUDED.modified;
+    RETURN NULL;
+  END
+  $$ LANGUAGE plpgsql
+"""
+
+# table, events, counter. Once per statement, a purge chunk or a guilty
+# edit bumps the counter once.
+DATA_VERSION_TRIGGERS = (
+    ('records', 'UPDATE OF guilty_id OR DELETE', 'records'),
+    ('guilty', 'INSERT OR UPDATE OR DELETE', 'guilty'),
+    ('guilty_blacklisted', 'INSERT OR UPDATE OR DELETE', 'blacklist'),
+)
+
+CREATE_DATA_VERSION_TRIGGER = """
+  CREATE TRIGGER {0}_data_version AFTER {1} ON {0}
+  FOR EACH STATEMENT EXECUTE PROCEDURE bump_data_version('{2}')
+"""
+
+for table, events, counter in DATA_VERSION_TRIGGERS:
+    # The function resolves data_versions when it runs, the tables may be
+    # created in any order
+    event.listen(db.metadata.tables[table], 'after_create', DDL(CREATE_BUMP_FUNCTION))
+    event.listen(db.metadata.tables[table], 'after_create',
+                 DDL(CREATE_DATA_VERSION_TRIGGER.format(table, events, counter)))
+
+
 # vi: ts=4 et sw=4 sts=4